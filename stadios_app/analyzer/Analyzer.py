@@ -1,6 +1,9 @@
-from SPARQLWrapper import SPARQLWrapper
-from pathlib import Path
 from abc import ABC, abstractmethod
+from sparql.QueryBackend import get_endpoint, get_query_backend
+from sparql.QueryCache import QueryCache
+from sparql.QueryRegistry import get_query_registry
+from sparql.ResultDecoder import ResultDecoder
+from tracing.Tracer import get_tracer
 
 
 class Analyzer:
@@ -8,12 +11,16 @@ class Analyzer:
     """
 
     def __init__(self):
-        """ Builder overload -- Initialize SparqlWrapper parameters
+        """ Builder overload -- Initialize query parameters
 
         """
-        self.endpoint = Path('data/sparql_endpoint').read_text()
-        self.sparql_wrapper = SPARQLWrapper(self.endpoint, agent="SparqlWrapper - StaDiOS analysis")
-        self.prefixes = Path('data/sparql_prefixes').read_text()
+        self.endpoint = get_endpoint()
+        self.query_backend = get_query_backend()
+        self.query_registry = get_query_registry()
+        self.prefixes = self.query_registry.prefixes
+        self.query_cache = QueryCache()
+        self.result_decoder = ResultDecoder()
+        self.tracer = get_tracer()
 
     @abstractmethod
     def adjust_detection_probability(self, dataframe):
@@ -90,3 +97,12 @@ class Analyzer:
         :return:
         """
         pass
+
+    @abstractmethod
+    def get_dataframe_analysis(self, simplified_df):
+        """ It generates an analysis from the result of a StaDiOS query already loaded in a dataframe
+
+        :param simplified_df: Dataframe with the minimum information to set up analysis
+        :return:
+        """
+        pass
@@ -0,0 +1,231 @@
+import os
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
+from analyzer.ResultExporter import ResultExporter
+from sparql.QueryBackend import QueryBackend
+
+# Analyzer of each worker process of the pool
+worker_analyzer = None
+
+
+def initialize_worker():
+    global worker_analyzer
+    worker_analyzer = CostEffectivenessAnalyzer()
+
+
+def analyze_partition(partition):
+    """ Generates the analysis of a single partition in a worker process
+
+    :param partition: Pair with the partition key and the query dataframe of the partition
+    :return: Tuple with the partition key, the analysis dataframe and the error found, if any
+    """
+    key, dataframe = partition
+    try:
+        return key, worker_analyzer.get_dataframe_analysis(dataframe), None
+    except Exception as error:
+        return key, None, repr(error)
+
+
+class BatchAnalyzer:
+    """ Class for the generation of the cost-effectiveness analyses of every disease, development,
+    follow-up, treatment and study combination loaded in the StaDiOS ontology.
+
+    The base query is run once without filters, its result is partitioned in memory and each
+    partition is analyzed in a process pool. The query may also be streamed in pages sorted by partition,
+    so each partition is analyzed as soon as its last row arrives and the analyses are written as they
+    finish, and the memory of a run is bounded by the size of a page and of the partitions in flight
+    instead of by the size of the ontology.
+    """
+
+    PARTITION_COLUMNS = ['disease', 'development', 'followUpStrategy', 'treatmentStrategy', 'studyIdentifier']
+    GROUPED_PARAMS = ['interventionKind', 'detectionStrategy', 'treatmentStrategy', 'followUpStrategy']
+    RESULT_COLUMNS = ['Branch Lifetime Cost', 'Branch Annual Cost', 'Branch QALY']
+
+    def __init__(self, max_workers=None):
+        """ Builder overload -- Initialize BatchAnalyzer parameters
+
+        :param max_workers: Number of worker processes, by default the number of processors
+        """
+        self.analyzer = CostEffectivenessAnalyzer()
+        self.max_workers = max_workers
+        self.query = self.analyzer.query_registry.bind('cost_effectiveness_query')
+
+    def get_partitions(self, dataframe):
+        """
+        :param dataframe: Result of the base cost-effectiveness query
+        :return: List of pairs with the key and the dataframe of each partition
+        """
+        return [(key, self.compact_partition(partition))
+                for key, partition in dataframe.groupby(self.PARTITION_COLUMNS, sort=False, observed=True)]
+
+    @staticmethod
+    def compact_partition(partition):
+        """ Partitions keep the categories of the whole result, which are sent to the workers and back with
+        every partition, so only the categories of the partition are kept
+
+        :param partition: Rows of a partition of the query result
+        :return: Partition with a new index and without unused categories
+        """
+        partition = partition.reset_index(drop=True)
+        for column in partition.select_dtypes('category').columns:
+            partition[column] = partition[column].cat.remove_unused_categories()
+
+        return partition
+
+    def iter_partitions(self, page_rows=None):
+        """
+        :param page_rows: Number of rows of each page of the query, None to run it whole through the query cache
+        :return: Generator of pairs with the key and the dataframe of each partition
+        """
+        if page_rows is None:
+            yield from self.get_partitions(self.analyzer.get_query(self.query))
+            return
+
+        # Pages are sorted by partition, so only the last partition of a page may continue in the next one
+        carried_df = None
+        for page_df in self.analyzer.iter_query(self.query, self.PARTITION_COLUMNS, page_rows):
+            if carried_df is not None:
+                page_df = self.analyzer.result_decoder.concat_chunks([carried_df, page_df])
+            if page_df.empty:
+                continue
+            groups = page_df.groupby(self.PARTITION_COLUMNS, sort=False, observed=True).ngroup().to_numpy()
+            is_last = groups == groups[-1]
+            carried_df = page_df[is_last]
+            yield from self.get_partitions(page_df[~is_last])
+
+        if carried_df is not None:
+            yield from self.get_partitions(carried_df)
+
+    def iter_batch_analysis(self, page_rows=None, partitions=None):
+        """ Analyzes the partitions of the ontology in a process pool as they are read, with a bounded number of
+        partitions in flight
+
+        :param page_rows: Number of rows of each page of the query, None to run it whole through the query cache
+        :param partitions: Iterable of pairs with the key and the dataframe of the partitions to analyze, by
+        default every partition of the query
+        :return: Generator of tuples with the key of each partition, its analysis dataframe and the error found,
+        if any, in the order of the partitions
+        """
+        partitions = self.iter_partitions(page_rows) if partitions is None else partitions
+        max_pending = 2 * (self.max_workers or os.cpu_count() or 1)
+        pending = deque()
+
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=initialize_worker) as executor:
+            for partition in partitions:
+                pending.append(executor.submit(analyze_partition, partition))
+                if len(pending) >= max_pending:
+                    yield self.get_partition_result(pending.popleft().result())
+            while pending:
+                yield self.get_partition_result(pending.popleft().result())
+
+    @staticmethod
+    def get_partition_result(result):
+        """
+        :param result: Tuple with the partition key, the analysis dataframe and the error found, if any
+        :return: Same tuple, with the study of the partition in the analysis dataframe
+        """
+        key, ce_dataframe, error = result
+        if error is None:
+            ce_dataframe.insert(0, 'studyIdentifier', key[-1])
+
+        return key, ce_dataframe, error
+
+    def get_batch_analysis(self, page_rows=None):
+        """ Generates the analysis of every partition of the ontology
+
+        :param page_rows: Number of rows of each page of the query, None to run it whole through the query cache
+        :return: Dataframe with the branches of all the analyses and dataframe with the partitions that
+        could not be analyzed
+        """
+        analyses = list()
+        failures = list()
+
+        for key, ce_dataframe, error in self.iter_batch_analysis(page_rows):
+            if error is None:
+                analyses.append(ce_dataframe)
+            else:
+                failures.append(dict(zip(self.PARTITION_COLUMNS, key), error=error))
+
+        # The sub-tables are unified in a single allocation
+        batch_dataframe = self.analyzer.result_decoder.concat_chunks(analyses) if analyses else pd.DataFrame()
+        if analyses:
+            batch_dataframe['studyIdentifier'] = batch_dataframe['studyIdentifier'].astype('category')
+
+        return batch_dataframe, pd.DataFrame(failures, columns=self.PARTITION_COLUMNS + ['error'])
+
+    def iter_blocks(self, dataframes, block_rows=ResultExporter.DEFAULT_CHUNK_ROWS):
+        """ Analyses are written and grouped in blocks of rows, since each partition only has a few branches
+
+        :param dataframes: Iterable of analysis dataframes
+        :param block_rows: Minimum number of rows of each block but the last one
+        :return: Generator of the dataframes concatenated in blocks
+        """
+        block = list()
+        block_rows_read = 0
+        for dataframe in dataframes:
+            block.append(dataframe)
+            block_rows_read += len(dataframe)
+            if block_rows_read >= block_rows:
+                yield self.analyzer.result_decoder.concat_chunks(block)
+                block = list()
+                block_rows_read = 0
+        if block:
+            yield self.analyzer.result_decoder.concat_chunks(block)
+
+    def get_batch_results(self, batch_dataframe):
+        """
+        :param batch_dataframe: Branches of all the analyses
+        :return: Cost-effectiveness results of each analysis, grouped as in the main page
+        """
+        return batch_dataframe.groupby(['studyIdentifier', 'disease', 'development'] + self.GROUPED_PARAMS,
+                                       as_index=False, observed=True)[self.RESULT_COLUMNS].sum()
+
+    def write_batch_analysis(self, output_path, results_path, failures_path,
+                             page_rows=QueryBackend.DEFAULT_PAGE_ROWS):
+        """ Streams the analysis of every partition of the ontology to a file as the analyses finish, keeping
+        only the grouped results and the failures in memory
+
+        :param output_path: File for the branches of every analysis
+        :param results_path: File for the grouped results of every analysis
+        :param failures_path: File for the partitions that could not be analyzed
+        :param page_rows: Number of rows of each page of the query
+        :return: Number of branches analyzed and number of partitions that failed
+        """
+        result_exporter = ResultExporter()
+        results = list()
+        failures = list()
+        branches = 0
+
+        def iter_analyses():
+            for key, ce_dataframe, error in self.iter_batch_analysis(page_rows):
+                if error is None:
+                    yield ce_dataframe
+                else:
+                    failures.append(dict(zip(self.PARTITION_COLUMNS, key), error=error))
+
+        def iter_blocks():
+            nonlocal branches
+            for block_dataframe in self.iter_blocks(iter_analyses(), result_exporter.chunk_rows):
+                results.append(self.get_batch_results(block_dataframe))
+                branches += len(block_dataframe)
+                yield block_dataframe
+
+        result_exporter.write_chunks(iter_blocks(), output_path)
+        results = pd.concat(results, ignore_index=True) if results else pd.DataFrame(
+            columns=['studyIdentifier', 'disease', 'development'] + self.GROUPED_PARAMS + self.RESULT_COLUMNS)
+        self.write_dataframe(self.get_batch_results(results), results_path)
+        self.write_dataframe(pd.DataFrame(failures, columns=self.PARTITION_COLUMNS + ['error']), failures_path)
+
+        return branches, len(failures)
+
+    @staticmethod
+    def write_dataframe(dataframe, path):
+        """ Writes a dataframe as Parquet, Arrow IPC or CSV depending on the file extension, streaming it in
+        chunks of rows
+
+        :param dataframe: Dataframe to write
+        :param path: Output file
+        """
+        ResultExporter().write(dataframe, path)
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+
+class CombinationEngine:
+    """ Vectorized engine for the combinations between the manifestations of a disease development.
+
+    A development with N independent manifestations has 2^N possible Yes/No combinations. The absolute
+    probability of a manifestation is the sum of the probabilities of every combination in which it
+    appears, and since the factors of the remaining manifestations add up to one, it reduces to the
+    probability of the manifestation itself. The combination table is therefore only enumerated, in
+    chunks, when it is explicitly requested.
+    """
+
+    DEFAULT_CHUNK_SIZE = 2 ** 16
+
+    @staticmethod
+    def validate_probabilities(probabilities):
+        """ Checks that every manifestation probability lies within the 0-1 range
+
+        :param probabilities: Probability of each manifestation
+        :return: Probabilities as a float array
+        """
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        if np.isnan(probabilities).any() or ((probabilities < 0.0) | (probabilities > 1.0)).any():
+            raise Exception('Incorrect probabilities included - Not within 0-1 range')
+
+        return probabilities
+
+    @staticmethod
+    def marginal_probabilities(probabilities):
+        """ Closed form of the absolute probability of each manifestation over all its combinations
+
+        :param probabilities: Probability of each manifestation
+        :return: Array with the absolute probability of each manifestation
+        """
+        return CombinationEngine.validate_probabilities(probabilities).copy()
+
+    @staticmethod
+    def iter_combinations(probabilities, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Streams the Yes/No combinations between manifestations as bit-masks. Combinations keep the
+        order of itertools.product(['Yes', 'No']), so the first manifestation varies the slowest.
+
+        :param probabilities: Probability of each manifestation
+        :param chunk_size: Maximum number of combinations per chunk
+        :return: Generator of (masks, probabilities) pairs, where masks[i, j] is True when the
+        manifestation j is present in the combination i
+        """
+        probabilities = CombinationEngine.validate_probabilities(probabilities)
+        n_manifestations = len(probabilities)
+        shifts = np.arange(n_manifestations - 1, -1, -1, dtype=np.uint64)
+
+        for start in range(0, 2 ** n_manifestations, chunk_size):
+            stop = min(start + chunk_size, 2 ** n_manifestations)
+            codes = np.arange(start, stop, dtype=np.uint64)
+            masks = ((codes[:, None] >> shifts) & np.uint64(1)) == 0
+            yield masks, np.where(masks, probabilities, 1.0 - probabilities).prod(axis=1)
+
+    @staticmethod
+    def combination_table(manifestations, probabilities, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Streams the full combination table, with one Yes/No column per manifestation and
+        the probability of each combination.
+
+        :param manifestations: Manifestation names
+        :param probabilities: Probability of each manifestation
+        :param chunk_size: Maximum number of rows per chunk
+        :return: Generator of dataframes
+        """
+        manifestations = list(manifestations)
+        for masks, combination_probabilities in CombinationEngine.iter_combinations(probabilities, chunk_size):
+            chunk = pd.DataFrame(np.where(masks, 'Yes', 'No'), columns=manifestations)
+            chunk['Probability'] = combination_probabilities
+            yield chunk
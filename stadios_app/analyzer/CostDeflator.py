@@ -0,0 +1,62 @@
+import numpy as np
+
+
+class CostDeflator:
+    """ Vectorized update of costs according to a Consumer Price Index (CPI).
+
+    For each index and target year, the update ratio of every original year is precomputed once in a
+    lookup array, so that updating a cost column is a gather followed by a multiplication.
+    """
+
+    def __init__(self, first_year, general_index, healthcare_index):
+        """ Builder overload -- Initialize the price indexes
+
+        :param first_year: Year of the first value of the indexes
+        :param general_index: General CPI, one value per year
+        :param healthcare_index: Healthcare CPI, one value per year
+        """
+        self.first_year = first_year
+        self.indexes = {True: np.asarray(general_index, dtype=np.float64),
+                        False: np.asarray(healthcare_index, dtype=np.float64)}
+        self.ratios = dict()
+
+    def get_ratios(self, new_year, use_general_index):
+        """ Lookup array with the update ratio from each year of the index to the new year
+
+        :param new_year: Year to which costs are updated
+        :param use_general_index: Use of the general index instead of the healthcare one
+        :return: Array of ratios, indexed by year - first_year
+        """
+        key = (new_year, use_general_index)
+
+        if key not in self.ratios:
+            ipc = self.indexes[use_general_index]
+            if not self.first_year <= new_year < self.first_year + len(ipc):
+                raise Exception('Parameter out of range')
+            self.ratios[key] = np.round(1000 * ipc[new_year - self.first_year] / ipc) / 1000.0
+
+        return self.ratios[key]
+
+    def update_costs(self, costs, original_years, new_year, use_general_index):
+        """ Updates an array of costs, of any shape, to the new year
+
+        :param costs: Costs to update
+        :param original_years: Year in which each cost was obtained
+        :param new_year: Year to which costs are updated
+        :param use_general_index: Use of the general index instead of the healthcare one
+        :return: Array of updated costs
+        """
+        costs = np.asarray(costs, dtype=np.float64)
+        original_years = np.asarray(original_years, dtype=np.int64)
+        same_year = original_years == new_year
+
+        # Costs already expressed in the new year are kept as they are
+        if same_year.all():
+            return costs.copy()
+
+        ratios = self.get_ratios(new_year, use_general_index)
+        positions = original_years - self.first_year
+        if not ((positions >= 0) & (positions < len(ratios)) | same_year).all():
+            raise Exception('Parameter out of range')
+
+        return costs * np.where(same_year, 1.0, ratios[np.clip(positions, 0, len(ratios) - 1)])
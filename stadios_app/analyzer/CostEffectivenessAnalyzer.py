@@ -1,235 +1,350 @@
+import numpy as np
 import pandas as pd
 from abc import ABC
-from SPARQLWrapper import JSON
-from pandas import json_normalize
 from analyzer.Analyzer import Analyzer
-from itertools import product
+from analyzer.CombinationEngine import CombinationEngine
+from analyzer.CostingStage import get_costing_stage
+from analyzer.DecisionTree import DecisionTree
+from sparql.QueryBackend import QueryBackend
 
 
 class CostEffectivenessAnalyzer(Analyzer, ABC):
     """ Class for the definition and implementation of cost-effectiveness analysis of the StaDiOs ontology.
     """
 
+    # Branches added by the simulation to each intervention: health state and detection case. Screening
+    # interventions add the first ones and standard interventions add the last one.
+    SIMULATED_BRANCHES = [('Disease', 'True Positive'), ('No Disease', 'False Positive'),
+                          ('No Disease', 'True Negative'), ('No Disease', 'NONE')]
+    SCREENING_BRANCHES = 3
+    # Labels of the health states and detection cases of the branches, stored as categorical codes
+    HEALTH_STATES = ['Disease', 'No Disease']
+    DETECTION_CASES = ['True Positive', 'False Positive', 'True Negative', 'False Negative', 'NONE']
+    # String literals of the query, repeated on many rows, which are interned as categoricals like the IRIs
+    LABEL_COLUMNS = ['interventionKind', 'populationKind', 'detectionStrategyCurrency', 'manifestationCurrency',
+                     'utilityKind', 'followUpCurrency', 'treatmentStrategyCurrency', 'studyIdentifier',
+                     'detectionStrategyCountry', 'manifestationCountry', 'followUpCountry', 'treatmentCountry',
+                     'populationCountry']
+    YEAR_COLUMNS = ['detectionStrategyYear', 'manifestationYear', 'followUpYear', 'treatmentYear']
+
     def __init__(self):
         Analyzer.__init__(self)
-        self.LAST_YEAR = 2023
-        self.GENERAL_INDEX = [69.53, 72.111, 73.773, 76.046, 79.234, 81.129, 84.598, 85.281,
-                              86.158, 88.975, 90.753, 93.188, 93.373, 92.141, 91.876, 94.609,
-                              95.153, 96.085, 97.139, 97.583, 103.567, 109.67]
-        self.HEALTHCARE_INDEX = [86.313, 88.385, 90.115, 90.337, 90.946, 92.417, 90.668, 90.732,
-                                 89.542, 88.267, 85.699, 96.032, 97.271, 97.175, 96.828, 97.551,
-                                 97.848, 98.694, 99.149, 99.62, 100.5]
-        self.FIRST_YEAR = self.LAST_YEAR - len(self.GENERAL_INDEX) + 1
+        # Price indexes, exchange rates and discount rates are read from the tables of the data directory
+        self.costing_stage = get_costing_stage()
+        self.LAST_YEAR = self.costing_stage.target_year
+        self.cost_deflator = self.costing_stage.get_deflator()
+        # Cost columns of the analysis and the year in which each one was obtained
+        self.COST_COLUMNS = {'detectionStrategyAmount': 'detectionStrategyYear',
+                             'manifestationInitialAmount': 'manifestationYear',
+                             'manifestationAnnualAmount': 'manifestationYear',
+                             'followUpAmount': 'followUpYear',
+                             'treatmentStrategyAmount': 'treatmentYear'}
+        # Country and currency of each cost column
+        self.COST_COUNTRIES = {'detectionStrategyAmount': 'detectionStrategyCountry',
+                               'manifestationInitialAmount': 'manifestationCountry',
+                               'manifestationAnnualAmount': 'manifestationCountry',
+                               'followUpAmount': 'followUpCountry',
+                               'treatmentStrategyAmount': 'treatmentCountry'}
+        self.COST_CURRENCIES = {'detectionStrategyAmount': 'detectionStrategyCurrency',
+                                'manifestationInitialAmount': 'manifestationCurrency',
+                                'manifestationAnnualAmount': 'manifestationCurrency',
+                                'followUpAmount': 'followUpCurrency',
+                                'treatmentStrategyAmount': 'treatmentStrategyCurrency'}
 
     @staticmethod
     def adjust_detection_probability(dataframe):
-        dataframe.loc[dataframe['DetectionCase'] == 'True Positive', 'DetectionProbability'] = \
-            dataframe['sensitivity'] * dataframe['prevalenceAtBirth']
-        dataframe.loc[dataframe['DetectionCase'] == 'False Positive', 'DetectionProbability'] = \
-            (1 - dataframe['sensitivity']) * (1 - dataframe['prevalenceAtBirth'])
-        dataframe.loc[dataframe['DetectionCase'] == 'True Negative', 'DetectionProbability'] = \
-            dataframe['specificity'] * (1 - dataframe['prevalenceAtBirth'])
-        dataframe.loc[dataframe['DetectionCase'] == 'False Negative', 'DetectionProbability'] = \
-            (1 - dataframe['specificity']) * (dataframe['prevalenceAtBirth'])
+        dataframe['DetectionProbability'] = DecisionTree.screening_detection_probability(
+            dataframe['DetectionCase'], dataframe['sensitivity'], dataframe['specificity'],
+            dataframe['prevalenceAtBirth'], dataframe['DetectionProbability'])
 
         return dataframe
 
     def screening_simulation(self, dataframe):
-        dataframe.insert(6, 'hasDisease', 'Disease')
-        dataframe.insert(7, 'DetectionCase', 'False Negative')
-        dataframe.insert(12, 'DetectionProbability', 1.0)
-        dataframe = dataframe.reset_index(drop=True)
-
-        # True positive configuration - No manifestation, only detection and treatment costs
-        dataframe = pd.concat([dataframe, dataframe[-1:]]).reset_index(drop=True)
-        dataframe.loc[dataframe.index[-1], ['hasDisease', 'DetectionCase', 'DetectionProbability',
-                                            'manifestation', 'manifestationProbability',
-                                            'manifestationInitialAmount', 'manifestationAnnualAmount',
-                                            'utilityValue']] = \
-            ['Disease', 'True Positive', 1.0, 'NONE', 0.0, 0.0, 0.0, 1.0]
-
-        # False positive configuration - No manifestation, only detection costs
-        dataframe = pd.concat([dataframe, dataframe[-1:]]).reset_index(drop=True)
-        dataframe.loc[dataframe.index[-1], ['hasDisease', 'DetectionCase', 'DetectionProbability',
-                                            'manifestation', 'manifestationProbability',
-                                            'manifestationInitialAmount', 'manifestationAnnualAmount',
-                                            'utilityValue', 'followUpAmount', 'treatmentStrategyAmount']] = \
-            ['No Disease', 'False Positive', 1.0, 'NONE', 0.0, 0.0, 0.0, 1.0, 0.0, 0.0]
-
-        # True negative configuration - No manifestation, only detection costs
-        dataframe = pd.concat([dataframe, dataframe[-1:]]).reset_index(drop=True)
-        dataframe.loc[dataframe.index[-1], ['hasDisease', 'DetectionCase', 'DetectionProbability',
-                                            'manifestation', 'manifestationProbability',
-                                            'manifestationInitialAmount', 'manifestationAnnualAmount',
-                                            'utilityValue', 'followUpAmount', 'treatmentStrategyAmount']] = \
-            ['No Disease', 'True Negative', 1.0, 'NONE', 0.0, 0.0, 0.0, 1.0, 0.0, 0.0]
-
-        return self.adjust_detection_probability(dataframe)
+        return self.expand_branches(dataframe, np.zeros(len(dataframe), dtype=np.int64), np.array([True]))
 
     @staticmethod
     def standard_simulation(dataframe):
-        dataframe.insert(6, 'hasDisease', 'Disease')
-        dataframe.insert(7, 'DetectionCase', 'NONE')
+        return CostEffectivenessAnalyzer.expand_branches(dataframe, np.zeros(len(dataframe), dtype=np.int64),
+                                                         np.array([False]))
+
+    @staticmethod
+    def expand_branches(dataframe, codes, screening):
+        """ Simulates the branches of several interventions at once. The rows of each intervention are
+        followed by the branches that the simulation adds to it, which are copies of its last row.
+
+        :param dataframe: Rows of the interventions
+        :param codes: Position of the intervention of each row, in the order of the result
+        :param screening: Whether each intervention is simulated as a screening or as a standard intervention
+        :return: Dataframe with the branches of every intervention and their detection probability
+        """
+        n_interventions = len(screening)
+        # Added branches of each intervention, as positions in SIMULATED_BRANCHES
+        n_added = np.where(screening, CostEffectivenessAnalyzer.SCREENING_BRANCHES, 1)
+        added_codes = np.repeat(np.arange(n_interventions), n_added)
+        added_order = np.arange(len(added_codes)) - np.repeat(np.cumsum(n_added) - n_added, n_added)
+        templates = np.where(screening[added_codes], added_order, CostEffectivenessAnalyzer.SCREENING_BRANCHES)
+
+        rows = np.argsort(codes, kind='stable')
+        last_rows = rows[np.cumsum(np.bincount(codes, minlength=n_interventions)) - 1]
+        branch_codes = np.concatenate([codes[rows], added_codes])
+        branch_templates = np.concatenate([np.full(len(rows), -1), templates])
+        order = np.lexsort((np.concatenate([np.zeros(len(rows)), added_order + 1]), branch_codes))
+        branch_codes, branch_templates = branch_codes[order], branch_templates[order]
+
+        # The whole result is gathered in a single allocation
+        dataframe = dataframe.iloc[np.concatenate([rows, last_rows[added_codes]])[order]].reset_index(drop=True)
+        if isinstance(dataframe['manifestation'].dtype, pd.CategoricalDtype) \
+                and 'NONE' not in dataframe['manifestation'].cat.categories:
+            dataframe['manifestation'] = dataframe['manifestation'].cat.add_categories('NONE')
+
+        # Health states and detection cases are gathered as codes of their labels
+        health_states = pd.Index(CostEffectivenessAnalyzer.HEALTH_STATES)
+        detection_cases = pd.Index(CostEffectivenessAnalyzer.DETECTION_CASES)
+        branches = np.array(CostEffectivenessAnalyzer.SIMULATED_BRANCHES, dtype=object)
+        branch_states = health_states.get_indexer(branches[:, 0])
+        branch_cases = detection_cases.get_indexer(branches[:, 1])
+        is_screening = screening[branch_codes]
+        is_added = branch_templates >= 0
+        dataframe.insert(6, 'hasDisease', pd.Categorical.from_codes(
+            np.where(is_added, branch_states[branch_templates], health_states.get_loc('Disease')), health_states))
+        first_cases = np.where(is_screening, detection_cases.get_loc('False Negative'), detection_cases.get_loc('NONE'))
+        dataframe.insert(7, 'DetectionCase', pd.Categorical.from_codes(
+            np.where(is_added, branch_cases[branch_templates], first_cases), detection_cases))
         dataframe.insert(12, 'DetectionProbability', 1.0)
-        dataframe = dataframe.reset_index(drop=True)
 
-        dataframe = pd.concat([dataframe, dataframe[-1:]]).reset_index(drop=True)
-        dataframe.loc[dataframe.index[-1], ['hasDisease', 'DetectionCase', 'DetectionProbability', 'manifestation',
-                                            'manifestationProbability', 'manifestationInitialAmount',
-                                            'manifestationAnnualAmount', 'utilityValue', 'followUpAmount',
-                                            'treatmentStrategyAmount']] = \
-            ['No Disease', 'NONE', 1.0, 'NONE', 0.0, 0.0, 0.0, 1.0, 0.0, 0.0]
+        # Added branches have no manifestation, and only those with the disease keep the follow-up and treatment
+        dataframe.loc[is_added, ['manifestation', 'manifestationProbability', 'manifestationInitialAmount',
+                                 'manifestationAnnualAmount', 'utilityValue']] = ['NONE', 0.0, 0.0, 0.0, 1.0]
+        dataframe.loc[is_added & (dataframe['hasDisease'] == 'No Disease').to_numpy(),
+                      ['followUpAmount', 'treatmentStrategyAmount']] = [0.0, 0.0]
 
-        dataframe.loc[dataframe['hasDisease'] == 'Disease', 'DetectionProbability'] = dataframe['prevalenceAtBirth']
-        dataframe.loc[dataframe['hasDisease'] == 'No Disease', 'DetectionProbability'] = \
-            1 - dataframe['prevalenceAtBirth']
+        dataframe['DetectionProbability'] = np.where(
+            is_screening,
+            DecisionTree.screening_detection_probability(dataframe['DetectionCase'], dataframe['sensitivity'],
+                                                         dataframe['specificity'], dataframe['prevalenceAtBirth']),
+            DecisionTree.standard_detection_probability(dataframe['hasDisease'], dataframe['prevalenceAtBirth']))
 
         return dataframe
 
     def adjust_branch_probability(self, dataframe):
         dataframe['Branch Probability'] = 0.0
         ref_column = 'manifestation'
+        has_manifestation = (dataframe[ref_column] != 'NONE').to_numpy()
 
-        # Get the unique values in the reference column
-        ref_values = dataframe[ref_column].unique()
-        ref_values = [i for i in ref_values if i != 'NONE']
-
-        # Generate all combinations of "Yes" and "No" values
-        combos = list(product(['Yes', 'No'], repeat=len(ref_values)))
-        new_df = pd.DataFrame(columns=[ref_column] + [f'{ref_values[i]}' for i in range(len(ref_values))])
-
-        # We generate dataframe with the possible combinations of manifestations
-        for i, combo in enumerate(combos):
-            new_row = {ref_column: dataframe['detectionStrategy'].unique()}
-            for j, value in enumerate(combo):
-                new_row[f'{ref_values[j]}'] = value
-            new_df.loc[i] = new_row
-        # We replace the "Yes" and "No" values by the probability of each manifestation
-        for column in new_df.columns[1:]:
-            row = dataframe.loc[dataframe[ref_column] == column]
-            new_df.loc[new_df[column] == 'Yes', column] = row['manifestationProbability'].values[0]
-            new_df.loc[new_df[column] == 'No', column] = 1 - row['manifestationProbability'].values[0]
-
-        # We add a column with the real probability of each combination of manifestations
-        new_df['Probability'] = new_df.iloc[:, 1:].apply(lambda x: x.prod(), axis=1)
-        if new_df['Probability'].sum() != 1.0:
-            raise Exception('Incorrect probabilities included - Not within 0-1 range')
-        # Sum of the absolute probabilities of manifestations
-        proportion_sum = dataframe['manifestationProbability'].sum()
-
-        # For each combination associated with a manifestation we multiply its actual
-        # probability by the probability of detection. We add them all together and obtain
-        # the absolute probability of each manifestation.
-        for column in new_df.iloc[:, 1:-1]:
-            row = dataframe.loc[dataframe[ref_column] == column].squeeze()
-
-            manifestation_prob = row['manifestationProbability']
-
-            sum = new_df.loc[new_df[column] == manifestation_prob, 'Probability'].sum()
-            dataframe.loc[dataframe['manifestation'] == column, 'Branch Probability'] = \
-                (dataframe['DetectionProbability'] * sum) / proportion_sum
+        # Probability of each manifestation, as it is first listed in the development of its intervention
+        ref_values = dataframe.groupby(['intervention', ref_column], sort=False, observed=True)[
+            'manifestationProbability'].transform('first')
+
+        # Absolute probability of each manifestation over all its combinations with the rest
+        absolute_probabilities = CombinationEngine.marginal_probabilities(ref_values[has_manifestation])
+        # Sum of the absolute probabilities of manifestations of each intervention
+        proportion_sum = dataframe.groupby('intervention', sort=False, observed=True)[
+            'manifestationProbability'].transform('sum').to_numpy()
+
+        # We multiply the absolute probability of each manifestation by the probability of detection
+        dataframe.loc[has_manifestation, 'Branch Probability'] = DecisionTree.manifestation_branch_probability(
+            dataframe.loc[has_manifestation, 'DetectionProbability'].to_numpy(), absolute_probabilities,
+            proportion_sum[has_manifestation])
 
         return dataframe
 
-    def get_query(self, sparql_query):
-        self.sparql_wrapper.setQuery(sparql_query)
-        self.sparql_wrapper.setReturnFormat(JSON)
+    @staticmethod
+    def get_manifestation_combinations(dataframe, chunk_size=CombinationEngine.DEFAULT_CHUNK_SIZE):
+        """ Explicitly enumerates the combinations between the manifestations of a dataframe
 
-        # Ask for the result in JSON format
-        result = self.sparql_wrapper.query().convert()
-        result = json_normalize(result["results"]["bindings"])
+        :param dataframe: Dataframe to analyze
+        :param chunk_size: Maximum number of combinations per chunk
+        :return: Generator of dataframes with the Yes/No value of each manifestation and its probability
+        """
+        ref_values = dataframe.loc[dataframe['manifestation'] != 'NONE'].drop_duplicates('manifestation')
 
-        simplified_df = result.filter(regex='value')
-        simplified_df = simplified_df.rename(columns=lambda col: col.replace(".value", ""))
-        simplified_df = simplified_df.apply(
-            lambda row: row.replace(
-                {'http://www.semanticweb.org/storh/ontologies/2022/11/StaDiOS#': ''}, regex=True))
+        return CombinationEngine.combination_table(ref_values['manifestation'],
+                                                   ref_values['manifestationProbability'], chunk_size)
 
-        return simplified_df
+    @staticmethod
+    def intern_labels(dataframe):
+        """ Stores the string literals of a query result as categoricals, so every branch only keeps the
+        integer code of its labels and the partitions of the result share their dictionaries
+
+        :param dataframe: Result of the cost-effectiveness query
+        :return: Dataframe with categorical labels and compact years
+        """
+        for column in CostEffectivenessAnalyzer.LABEL_COLUMNS:
+            if column in dataframe.columns and not isinstance(dataframe[column].dtype, pd.CategoricalDtype):
+                dataframe[column] = dataframe[column].astype('category')
+        for column in CostEffectivenessAnalyzer.YEAR_COLUMNS:
+            if column in dataframe.columns and pd.api.types.is_integer_dtype(dataframe[column].dtype):
+                dataframe[column] = dataframe[column].astype(np.int16)
 
-    def update_cost(self, cost, original_year, new_year, use_general_index):
+        return dataframe
 
-        # Update costs according to the Spanish Consumer Price Index (CPI)
-        ipc = []
+    def get_query(self, sparql_query):
+        # Rows are sorted as in the pages of the batch, so an analysis has the same order whatever the endpoint
+        # and whether it is served from the materialized view or not
+        sparql_query = QueryBackend.get_page_query(sparql_query)
+        with self.tracer.span('query') as span:
+            cached_df = self.query_cache.get(sparql_query)
+            if cached_df is not None:
+                span.add('cacheHits')
+                span.set('rows', len(cached_df))
+                return cached_df
+            span.add('cacheMisses')
+
+            # Ask for the result in JSON format and decode it into typed columns
+            with self.tracer.span('sparql'):
+                result = self.query_backend.query(sparql_query)
+            with self.tracer.span('decode', rows=len(result['results']['bindings'])):
+                simplified_df = self.intern_labels(self.result_decoder.decode_json(result))
+            self.query_cache.put(sparql_query, simplified_df)
+            span.set('rows', len(simplified_df))
 
-        if original_year == new_year:
-            return cost
-        elif original_year > self.LAST_YEAR | original_year < self.FIRST_YEAR:
-            raise Exception('Parameter out of range')
-        elif new_year > self.LAST_YEAR | new_year < self.FIRST_YEAR:
-            raise Exception('Parameter out of range')
+        return simplified_df
 
-        if use_general_index:
-            ipc = self.GENERAL_INDEX
-        else:
-            ipc = self.HEALTHCARE_INDEX
+    def iter_query(self, sparql_query, order_variables=(), page_rows=QueryBackend.DEFAULT_PAGE_ROWS):
+        """ Streams the result of a query one page at a time, without keeping it whole in memory or in the
+        query cache
+
+        :param sparql_query: StaDiOS sparql query
+        :param order_variables: Variables by which the rows are sorted, so the rows that share their values
+        are consecutive
+        :param page_rows: Number of rows of each page
+        :return: Generator of the typed dataframe of each page
+        """
+        pages = self.query_backend.query_pages(sparql_query, order_variables, page_rows)
+        while True:
+            with self.tracer.span('sparql'):
+                result = next(pages, None)
+            if result is None:
+                return
+            with self.tracer.span('decode', rows=len(result['results']['bindings'])):
+                page_df = self.intern_labels(self.result_decoder.decode_json(result))
+            # The raw page is released before the dataframe is handed over, not when the next one is requested
+            del result
+            yield page_df
 
-        original_ipc = ipc[original_year - self.FIRST_YEAR]
-        new_ipc = ipc[new_year - self.FIRST_YEAR]
-        return cost * round(1000 * new_ipc / original_ipc) / 1000.0
+    def update_cost(self, cost, original_year, new_year, use_general_index):
+        # Update costs according to the Spanish Consumer Price Index (CPI)
+        return float(self.cost_deflator.update_costs(cost, original_year, new_year, use_general_index))
 
     def update_dataframe_costs(self, dataframe):
-        dataframe['detectionStrategyAmount'] = dataframe.apply(
-            lambda row: self.update_cost(row['detectionStrategyAmount'],
-                                         row['detectionStrategyYear'],
-                                         self.LAST_YEAR, True), axis=1)
-
-        dataframe['manifestationInitialAmount'] = dataframe.apply(
-            lambda row: self.update_cost(row['manifestationInitialAmount'],
-                                         row['manifestationYear'],
-                                         self.LAST_YEAR, True), axis=1)
-
-        dataframe['manifestationAnnualAmount'] = dataframe.apply(
-            lambda row: self.update_cost(row['manifestationAnnualAmount'],
-                                         row['manifestationYear'], self.LAST_YEAR, True), axis=1)
-
-        dataframe['followUpAmount'] = dataframe.apply(
-            lambda row: self.update_cost(row['followUpAmount'],
-                                         row['followUpYear'], self.LAST_YEAR, True), axis=1)
-
-        dataframe['treatmentStrategyAmount'] = dataframe.apply(
-            lambda row: self.update_cost(row['treatmentStrategyAmount'],
-                                         row['treatmentYear'], self.LAST_YEAR, True), axis=1)
-
-        diagnosis_cost = max(
-            dataframe.loc[dataframe['interventionKind'] == 'DIAGNOSIS', 'detectionStrategyAmount'].unique())
-        screening_cost = min(
-            dataframe.loc[dataframe['interventionKind'] == 'SCREENING', 'detectionStrategyAmount'].unique())
-        # When screening is positive, a diagnostic test is needed to confirm the disease.
-        dataframe.loc[dataframe["DetectionCase"] == "True Positive", "detectionStrategyAmount"] += diagnosis_cost
-        dataframe.loc[dataframe["DetectionCase"] == "False Positive", "detectionStrategyAmount"] += diagnosis_cost
-        # When diagnosis is positive, a screening test is needed too.
-        dataframe.loc[(dataframe['interventionKind'] == "DIAGNOSIS")
-                      & (dataframe['hasDisease'] == 'Disease'), 'detectionStrategyAmount'] += screening_cost
-        # These subjects will not be subjected to a diagnostic test, so they do not have their costs.
-        dataframe.loc[(dataframe['interventionKind'] == "DIAGNOSIS")
-                      & (dataframe['hasDisease'] == 'No Disease'), 'detectionStrategyAmount'] = 0.0
+        # We update the costs to the present time and adjust costs for somewhat specific cases
+        return self.adjust_detection_costs(self.deflate_dataframe_costs(dataframe))
+
+    def deflate_dataframe_costs(self, dataframe):
+        """ Updates every cost of the analysis to the present time and the target currency, and adds the
+        discounted years of costs and QALY of each branch
+
+        :param dataframe: Dataframe to analyze
+        :return: Dataframe with updated costs
+        """
+        # All cost columns are updated at once, gathering the ratio of the country and year of each cost and
+        # the rate of its currency. Results without countries use the price index of the default country.
+        cost_columns = list(self.COST_COLUMNS.keys())
+        dataframe[cost_columns] = self.costing_stage.update_costs(
+            dataframe[cost_columns].to_numpy(), dataframe[list(self.COST_COLUMNS.values())].to_numpy(),
+            self.get_columns(dataframe, [self.COST_COUNTRIES[column] for column in cost_columns]),
+            self.get_columns(dataframe, [self.COST_CURRENCIES[column] for column in cost_columns]))
+
+        return self.discount_dataframe(dataframe)
+
+    def discount_dataframe(self, dataframe):
+        """ Adds the years over which the annual costs and QALY of each branch accrue, discounted with the rates
+        of the country of its population
+
+        :param dataframe: Dataframe to analyze
+        :return: Dataframe with the discountedCostYears and discountedQalyYears columns
+        """
+        cost_rates, effect_rates = self.costing_stage.get_discount_rates(
+            self.get_columns(dataframe, 'populationCountry'), len(dataframe))
+        life_expectancy = dataframe['lifeExpectancy'].to_numpy(dtype=np.float64)
+        dataframe['discountedCostYears'] = DecisionTree.discounted_years(life_expectancy, cost_rates)
+        dataframe['discountedQalyYears'] = DecisionTree.discounted_years(life_expectancy, effect_rates)
 
         return dataframe
 
-    def get_analysis(self, sparql_query):
-        simplified_df = self.get_query(sparql_query)
+    @staticmethod
+    def get_columns(dataframe, columns):
+        """
+        :param dataframe: Dataframe to analyze
+        :param columns: Column or list of columns
+        :return: Values of the columns, or None if the dataframe does not have all of them
+        """
+        names = [columns] if isinstance(columns, str) else columns
+        if not set(names) <= set(dataframe.columns):
+            return None
+
+        return dataframe[columns].astype(object).to_numpy()
 
-        simplified_df['sensitivity'] = simplified_df['sensitivity'].apply(pd.to_numeric)
-        simplified_df['specificity'] = simplified_df['specificity'].apply(pd.to_numeric)
-        simplified_df['manifestationProbability'] = simplified_df['manifestationProbability'].apply(pd.to_numeric)
-        simplified_df['prevalenceAtBirth'] = simplified_df['prevalenceAtBirth'].apply(pd.to_numeric)
+    @staticmethod
+    def adjust_detection_costs(dataframe):
+        """ Adds to the detection cost of each branch the cost of the complementary tests
 
-        interventions = simplified_df.intervention.unique()
-        grouped_interventions = simplified_df.groupby(simplified_df.intervention)
-        interventions_df = list()
+        :param dataframe: Dataframe with updated costs
+        :return: Dataframe with adjusted detection costs
+        """
+        diagnosis_cost, screening_cost = CostEffectivenessAnalyzer.get_detection_costs(dataframe)
 
-        for intervention in interventions:
-            interventions_df.append(grouped_interventions.get_group(intervention))
+        dataframe['detectionStrategyAmount'] = DecisionTree.detection_cost(
+            dataframe['detectionStrategyAmount'].to_numpy(), (dataframe['interventionKind'] == 'DIAGNOSIS').to_numpy(),
+            dataframe['DetectionCase'], dataframe['hasDisease'], diagnosis_cost, screening_cost)
 
-        for i in range(len(interventions_df)):
-            if 'SCREENING' in interventions_df[i]['interventionKind'].unique() \
-                    and 'NEONATAL' in interventions_df[i]['populationKind'].unique():
-                interventions_df[i] = self.screening_simulation(interventions_df[i])
-            else:
-                interventions_df[i] = self.standard_simulation(interventions_df[i])
+        return dataframe
+
+    @staticmethod
+    def get_detection_costs(dataframe):
+        """
+        :param dataframe: Dataframe with updated costs
+        :return: Pair with the cost of the diagnostic test and the cost of the screening test
+        """
+        diagnosis_costs = dataframe.loc[dataframe['interventionKind'] == 'DIAGNOSIS', 'detectionStrategyAmount']
+        screening_costs = dataframe.loc[dataframe['interventionKind'] == 'SCREENING', 'detectionStrategyAmount']
+        # Without both kinds of test there is nothing to compare, as when the grouping of the interventions failed
+        if diagnosis_costs.empty or screening_costs.empty:
+            raise KeyError('The analysis needs the cost of both a diagnostic and a screening test')
+        diagnosis_cost = max(diagnosis_costs.unique())
+        screening_cost = min(screening_costs.unique())
+
+        return diagnosis_cost, screening_cost
 
-            interventions_df[i] = self.adjust_branch_probability(interventions_df[i])
+    def get_analysis(self, sparql_query):
+        with self.tracer.span('get_analysis'):
+            return self.get_dataframe_analysis(self.get_query(sparql_query))
+
+    def get_dataframe_analysis(self, simplified_df):
+        with self.tracer.span('analysis', rows=len(simplified_df)):
+            with self.tracer.span('simulation') as span:
+                full_dataframe = self.get_branch_dataframe(simplified_df)
+                span.set('branches', len(full_dataframe))
+
+            # We update the costs to the present time and adjust costs for somewhat specific cases
+            with self.tracer.span('costs'):
+                full_dataframe = self.update_dataframe_costs(full_dataframe)
+
+            with self.tracer.span('ce'):
+                return self.get_ce_dataframe(full_dataframe)
+
+    def get_branch_dataframe(self, simplified_df):
+        """ Generates the branches of the decision tree of each intervention with their probabilities
+
+        :param simplified_df: Dataframe with the minimum information to set up analysis
+        :return: Full analysis table, with costs not yet updated
+        """
+        # An empty selection has no intervention to group, which is reported as a missing key
+        if simplified_df.empty:
+            raise KeyError('The selection does not have any intervention to analyze')
+        # Decoded results are already typed, so this only converts untyped literals
+        probability_params = ['sensitivity', 'specificity', 'manifestationProbability', 'prevalenceAtBirth']
+        simplified_df[probability_params] = simplified_df[probability_params].apply(pd.to_numeric)
+        simplified_df = self.intern_labels(simplified_df)
+        # Interventions keep the order in which they are listed, and each one is simulated as a screening
+        # when it is a neonatal screening
+        codes = pd.factorize(simplified_df['intervention'])[0]
+        screening = pd.DataFrame({'screening': (simplified_df['interventionKind'] == 'SCREENING').to_numpy(),
+                                  'neonatal': (simplified_df['populationKind'] == 'NEONATAL').to_numpy()}) \
+            .groupby(codes).any().all(axis=1).to_numpy()
+
+        # Every intervention is expanded at once into its branches
+        full_dataframe = self.adjust_branch_probability(self.expand_branches(simplified_df, codes, screening))
 
         # It is convenient to say which parameters we want to treat as numerical parameters.
         numeric_params = ['populationAverageAge', 'populationUtilityValue', 'DetectionProbability',
@@ -238,47 +353,44 @@ class CostEffectivenessAnalyzer(Analyzer, ABC):
                           'treatmentStrategyAmount', 'detectionStrategyYear', 'manifestationYear', 'followUpYear',
                           'treatmentYear', 'Branch Probability']
 
-        # Full analysis table - Has some extra but not crucial information
-        full_dataframe = pd.DataFrame()
+        full_dataframe[numeric_params] = full_dataframe[numeric_params].apply(pd.to_numeric)
 
-        # We unify the sub-tables
-        for i in range(len(interventions_df)):
-            full_dataframe = pd.concat([full_dataframe, interventions_df[i]], axis=0).reset_index(drop=True)
-        for i in numeric_params:
-            full_dataframe[i] = full_dataframe[i].apply(pd.to_numeric)
+        return full_dataframe
 
-        # We update the costs to the present time and adjust costs for somewhat specific cases
-        full_dataframe = self.update_dataframe_costs(full_dataframe)
+    @staticmethod
+    def get_ce_dataframe(full_dataframe):
+        """ Evaluates the cost and QALY of each branch of the decision tree
 
+        :param full_dataframe: Full analysis table with updated costs
+        :return: Dataframe with the most important columns of the analysis
+        """
         # We create a final dataframe with the most important columns of our analysis
         ce_dataframe = full_dataframe[
             ['disease', 'interventionKind', 'hasDisease', 'DetectionCase', 'detectionStrategy', 'development',
              'manifestation', 'followUpStrategy', 'treatmentStrategy', 'populationAverageAge', 'populationUtilityValue',
              'DetectionProbability', 'detectionStrategyAmount', 'lifeExpectancy', 'manifestationProbability',
              'manifestationInitialAmount', 'manifestationAnnualAmount', 'utilityValue', 'followUpAmount',
-             'treatmentStrategyAmount', 'Branch Probability']].copy()
+             'treatmentStrategyAmount', 'discountedCostYears', 'discountedQalyYears', 'Branch Probability']].copy()
 
         # Probability of reaching each event not including manifestations
         ce_dataframe.loc[ce_dataframe['manifestationProbability'] == 0.000, 'Branch Probability'] = \
             ce_dataframe['DetectionProbability']
 
         # Lifetime cost associated with a manifestation
-        ce_dataframe['Branch Lifetime Cost'] = \
-            ce_dataframe['Branch Probability'] * \
-            (ce_dataframe['detectionStrategyAmount'] + ce_dataframe['manifestationInitialAmount'] +
-             ((ce_dataframe['followUpAmount'] + ce_dataframe['treatmentStrategyAmount']) *
-              ce_dataframe['lifeExpectancy']))
+        ce_dataframe['Branch Lifetime Cost'] = DecisionTree.lifetime_cost(
+            ce_dataframe['Branch Probability'], ce_dataframe['detectionStrategyAmount'],
+            ce_dataframe['manifestationInitialAmount'], ce_dataframe['followUpAmount'],
+            ce_dataframe['treatmentStrategyAmount'], ce_dataframe['discountedCostYears'])
 
         # Annual cost associated with a manifestation
-        ce_dataframe['Branch Annual Cost'] = \
-            ce_dataframe['Branch Probability'] * \
-            (ce_dataframe['detectionStrategyAmount'] +
-             (ce_dataframe['lifeExpectancy'] *
-              (ce_dataframe['manifestationAnnualAmount'] + ce_dataframe['followUpAmount'] +
-               ce_dataframe['treatmentStrategyAmount'])))
+        ce_dataframe['Branch Annual Cost'] = DecisionTree.annual_cost(
+            ce_dataframe['Branch Probability'], ce_dataframe['detectionStrategyAmount'],
+            ce_dataframe['manifestationAnnualAmount'], ce_dataframe['followUpAmount'],
+            ce_dataframe['treatmentStrategyAmount'], ce_dataframe['discountedCostYears'])
 
         # QALY associated with a manifestation
-        ce_dataframe['Branch QALY'] = ce_dataframe['Branch Probability'] * ce_dataframe['lifeExpectancy'] * \
-                                      ce_dataframe['populationUtilityValue'] * ce_dataframe['utilityValue']
+        ce_dataframe['Branch QALY'] = DecisionTree.qaly(
+            ce_dataframe['Branch Probability'], ce_dataframe['discountedQalyYears'],
+            ce_dataframe['populationUtilityValue'], ce_dataframe['utilityValue'])
 
         return ce_dataframe
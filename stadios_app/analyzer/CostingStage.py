@@ -0,0 +1,174 @@
+import threading
+import numpy as np
+import pandas as pd
+from analyzer.CostDeflator import CostDeflator
+
+
+class CostingStage:
+    """ Vectorized costing of the analysis driven by pluggable index tables.
+
+    The price indexes of each country, the exchange rates of each currency and the discount rates of each
+    country are loaded once per process into lookup arrays. Updating the costs is then a gather of the ratio
+    of the country and year of every cost, and of the rate of its currency, followed by a multiplication,
+    whatever the number of countries and currencies of the studies.
+    """
+
+    PRICE_INDEXES_PATH = 'data/price_indexes.csv'
+    EXCHANGE_RATES_PATH = 'data/exchange_rates.csv'
+    DISCOUNT_RATES_PATH = 'data/discount_rates.csv'
+    DEFAULT_COUNTRY = 'Spain'
+    DEFAULT_CURRENCY = 'Euro'
+    # Row of the discount rates used by the countries without their own rates
+    DEFAULT_DISCOUNT = 'Default'
+
+    # Tables already loaded in this process, by path
+    tables = dict()
+    tables_lock = threading.Lock()
+
+    def __init__(self, price_indexes_path=PRICE_INDEXES_PATH, exchange_rates_path=EXCHANGE_RATES_PATH,
+                 discount_rates_path=DISCOUNT_RATES_PATH, target_year=None, target_currency=DEFAULT_CURRENCY,
+                 default_country=DEFAULT_COUNTRY, use_general_index=True):
+        """ Builder overload -- Initialize CostingStage parameters
+
+        :param price_indexes_path: CSV file with the general and healthcare price index of each country and year
+        :param exchange_rates_path: CSV file with the rate of each currency, and optionally year, to a common unit
+        :param discount_rates_path: CSV file with the annual discount rates of costs and QALY of each country
+        :param target_year: Year to which costs are updated, by default the last year of the price indexes
+        :param target_currency: Currency to which costs are converted
+        :param default_country: Country whose price index updates the costs of countries without one
+        :param use_general_index: Use of the general index instead of the healthcare one
+        """
+        price_indexes = self.load_table(price_indexes_path)
+        exchange_rates = self.load_table(exchange_rates_path)
+        discount_rates = self.load_table(discount_rates_path)
+
+        self.first_year = int(price_indexes['year'].min())
+        self.last_year = int(price_indexes['year'].max())
+        self.target_year = self.last_year if target_year is None else target_year
+        self.target_currency = target_currency
+        self.use_general_index = use_general_index
+
+        # Update ratio of each country, by position, and year, by offset from the first year
+        self.deflators = dict()
+        self.countries = pd.Index(price_indexes['country'].unique())
+        if default_country not in self.countries:
+            raise Exception('There is no price index for the default country: ' + default_country)
+        self.default_country = self.countries.get_loc(default_country)
+        self.price_ratios = np.full((len(self.countries), self.last_year - self.first_year + 1), np.nan)
+        for position, country in enumerate(self.countries):
+            country_indexes = price_indexes[price_indexes['country'] == country].sort_values('year')
+            self.deflators[country] = CostDeflator(int(country_indexes['year'].iloc[0]),
+                                                   country_indexes['general'].dropna().to_numpy(),
+                                                   country_indexes['healthcare'].dropna().to_numpy())
+            deflator = self.deflators[country]
+            index_years = range(deflator.first_year, deflator.first_year + len(deflator.indexes[use_general_index]))
+            if self.target_year in index_years:
+                ratios = deflator.get_ratios(self.target_year, use_general_index)
+                offset = deflator.first_year - self.first_year
+                self.price_ratios[position, offset:offset + len(ratios)] = ratios
+
+        # Rate of each currency in the target year, the latest one available, relative to the target currency
+        exchange_rates = exchange_rates[exchange_rates['year'].isna() | (exchange_rates['year'] <= self.target_year)]
+        exchange_rates = exchange_rates.assign(year=exchange_rates['year'].fillna(-1)).sort_values('year') \
+            .drop_duplicates('currency', keep='last').set_index('currency')['rate']
+        if target_currency not in exchange_rates.index:
+            raise Exception('There is no exchange rate for the target currency: ' + target_currency)
+        self.currencies = exchange_rates.index
+        self.exchange_rates = exchange_rates.to_numpy(dtype=np.float64) / exchange_rates[target_currency]
+
+        self.discount_rates = discount_rates.set_index('country')[['costRate', 'effectRate']]
+
+    @staticmethod
+    def load_table(path):
+        with CostingStage.tables_lock:
+            if path not in CostingStage.tables:
+                CostingStage.tables[path] = pd.read_csv(path)
+
+        return CostingStage.tables[path]
+
+    def get_deflator(self, country=None):
+        """
+        :param country: Country of the price index, by default the default country
+        :return: Deflator of the price index of the country
+        """
+        return self.deflators[self.countries[self.default_country] if country is None else country]
+
+    def get_country_codes(self, countries):
+        """
+        :param countries: Country of each cost, missing or unknown ones use the price index of the default country
+        :return: Position of the price index of each cost
+        """
+        countries = np.asarray(countries, dtype=object)
+        codes = self.countries.get_indexer(countries.ravel()).reshape(countries.shape)
+
+        return np.where(codes < 0, self.default_country, codes)
+
+    def update_costs(self, costs, original_years, countries=None, currencies=None):
+        """ Updates an array of costs, of any shape, to the target year with the price index of the country of
+        each cost and converts them to the target currency
+
+        :param costs: Costs to update
+        :param original_years: Year in which each cost was obtained
+        :param countries: Country of each cost, None for the default country
+        :param currencies: Currency of each cost, None for the target currency
+        :return: Array of updated costs
+        """
+        costs = np.asarray(costs, dtype=np.float64)
+        original_years = np.asarray(original_years, dtype=np.int64)
+        country_codes = np.full(costs.shape, self.default_country) if countries is None else \
+            self.get_country_codes(countries)
+
+        positions = original_years - self.first_year
+        in_range = (positions >= 0) & (positions < self.price_ratios.shape[1])
+        ratios = np.where(original_years == self.target_year, 1.0,
+                          self.price_ratios[country_codes, np.clip(positions, 0, self.price_ratios.shape[1] - 1)])
+        # Countries whose index does not cover the year use the index of the default country
+        missing = np.isnan(ratios)
+        ratios[missing] = self.price_ratios[self.default_country,
+                                            np.clip(positions, 0, self.price_ratios.shape[1] - 1)][missing]
+        if not (in_range | (original_years == self.target_year)).all() or np.isnan(ratios).any():
+            raise Exception('Parameter out of range')
+
+        if currencies is not None:
+            currencies = np.asarray(currencies, dtype=object)
+            currency_codes = self.currencies.get_indexer(currencies.ravel()).reshape(currencies.shape)
+            if (currency_codes < 0).any():
+                unknown = pd.unique(currencies[currency_codes < 0].astype(str))
+                raise Exception('There is no exchange rate for the currencies: ' + ', '.join(unknown))
+            ratios = ratios * self.exchange_rates[currency_codes]
+
+        return costs * ratios
+
+    def get_discount_rates(self, countries=None, size=None):
+        """
+        :param countries: Country of each branch, None for the default discount rates
+        :param size: Number of branches when no countries are given
+        :return: Pair of arrays with the annual discount rate of costs and of QALY of each branch
+        """
+        defaults = self.discount_rates.loc[self.DEFAULT_DISCOUNT].to_numpy(dtype=np.float64) \
+            if self.DEFAULT_DISCOUNT in self.discount_rates.index else np.zeros(2)
+        if countries is None:
+            return np.full(size, defaults[0]), np.full(size, defaults[1])
+
+        # Countries without their own rates get the last row, with the default ones
+        codes = self.discount_rates.index.get_indexer(np.asarray(countries, dtype=object))
+        rates = np.vstack([self.discount_rates.to_numpy(dtype=np.float64), defaults])[codes]
+
+        return rates[:, 0], rates[:, 1]
+
+
+# Costing stage shared by the whole process
+process_costing_stage = None
+process_costing_stage_lock = threading.Lock()
+
+
+def get_costing_stage():
+    """
+    :return: Costing stage with the default tables shared by the whole process, loaded on first use
+    """
+    global process_costing_stage
+    with process_costing_stage_lock:
+        if process_costing_stage is None:
+            process_costing_stage = CostingStage()
+
+    return process_costing_stage
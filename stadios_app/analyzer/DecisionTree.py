@@ -0,0 +1,129 @@
+import numpy as np
+
+
+class DecisionTree:
+    """ Formulas of the branches of the cost-effectiveness decision tree.
+
+    Every formula works element-wise on arrays or series, so the same code evaluates the branches of an
+    analysis dataframe and, broadcast over a leading axis, thousands of sampled draws of those branches.
+    """
+
+    @staticmethod
+    def screening_detection_probability(detection_case, sensitivity, specificity, prevalence, default=1.0):
+        """ Probability of each detection case of a screening test
+
+        :param detection_case: Detection case of each branch
+        :param sensitivity: Sensitivity of the detection strategy
+        :param specificity: Specificity of the detection strategy
+        :param prevalence: Prevalence at birth of the disease
+        :param default: Probability of the branches that are not a detection case
+        :return: Detection probability of each branch
+        """
+        detection_case = np.asarray(detection_case)
+
+        return np.select([detection_case == 'True Positive', detection_case == 'False Positive',
+                          detection_case == 'True Negative', detection_case == 'False Negative'],
+                         [sensitivity * prevalence, (1 - sensitivity) * (1 - prevalence),
+                          specificity * (1 - prevalence), (1 - specificity) * prevalence], default)
+
+    @staticmethod
+    def standard_detection_probability(has_disease, prevalence, default=1.0):
+        """ Probability of having the disease or not when there is no screening test
+
+        :param has_disease: Disease or No Disease label of each branch
+        :param prevalence: Prevalence at birth of the disease
+        :param default: Probability of the branches without label
+        :return: Detection probability of each branch
+        """
+        has_disease = np.asarray(has_disease)
+
+        return np.select([has_disease == 'Disease', has_disease == 'No Disease'],
+                         [prevalence, 1 - prevalence], default)
+
+    @staticmethod
+    def manifestation_branch_probability(detection_probability, manifestation_probability, proportion_sum):
+        """
+        :param detection_probability: Detection probability of each branch
+        :param manifestation_probability: Absolute probability of the manifestation of each branch
+        :param proportion_sum: Sum of the manifestation probabilities of the intervention of each branch
+        :return: Probability of each manifestation branch
+        """
+        return detection_probability * manifestation_probability / proportion_sum
+
+    @staticmethod
+    def branch_probability(detection_probability, manifestation_probability, proportion_sum):
+        """ Branches without manifestation are reached with their detection probability
+
+        :param detection_probability: Detection probability of each branch
+        :param manifestation_probability: Absolute probability of the manifestation of each branch
+        :param proportion_sum: Sum of the manifestation probabilities of the intervention of each branch
+        :return: Probability of each branch
+        """
+        return np.where(manifestation_probability == 0.0, detection_probability,
+                        DecisionTree.manifestation_branch_probability(detection_probability,
+                                                                      manifestation_probability, proportion_sum))
+
+    @staticmethod
+    def detection_cost(detection_amount, is_diagnosis, detection_case, has_disease, diagnosis_cost, screening_cost):
+        """ Detection costs adjusted for the tests that each branch also goes through
+
+        :param detection_amount: Cost of the detection strategy of each branch
+        :param is_diagnosis: Whether each branch belongs to a diagnosis intervention
+        :param detection_case: Detection case of each branch
+        :param has_disease: Disease or No Disease label of each branch
+        :param diagnosis_cost: Cost of the diagnostic test
+        :param screening_cost: Cost of the screening test
+        :return: Adjusted detection cost of each branch
+        """
+        detection_case = np.asarray(detection_case)
+        has_disease = np.asarray(has_disease)
+        is_diagnosis = np.asarray(is_diagnosis)
+
+        # When screening is positive, a diagnostic test is needed to confirm the disease.
+        positive_screening = (detection_case == 'True Positive') | (detection_case == 'False Positive')
+        # When diagnosis is positive, a screening test is needed too.
+        adjusted_amount = detection_amount + np.where(positive_screening, diagnosis_cost, 0.0) + \
+            np.where(is_diagnosis & (has_disease == 'Disease'), screening_cost, 0.0)
+
+        # These subjects will not be subjected to a diagnostic test, so they do not have their costs.
+        return np.where(is_diagnosis & (has_disease == 'No Disease'), 0.0, adjusted_amount)
+
+    @staticmethod
+    def discounted_years(life_expectancy, discount_rate):
+        """ Present value of one unit per year over the life expectancy, continuously discounted
+
+        :param life_expectancy: Life expectancy of each branch
+        :param discount_rate: Annual discount rate of each branch
+        :return: Discounted years of each branch, which are the life expectancy when the rate is 0
+        """
+        life_expectancy = np.asarray(life_expectancy, dtype=np.float64)
+        discount_rate = np.asarray(discount_rate, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            discounted = -np.expm1(-np.log1p(discount_rate) * life_expectancy) / np.log1p(discount_rate)
+
+        return np.where(discount_rate == 0, life_expectancy, discounted)
+
+    @staticmethod
+    def lifetime_cost(branch_probability, detection_amount, initial_amount, follow_up_amount, treatment_amount,
+                      life_expectancy):
+        """
+        :return: Lifetime cost associated with each branch
+        """
+        return branch_probability * (detection_amount + initial_amount +
+                                     (follow_up_amount + treatment_amount) * life_expectancy)
+
+    @staticmethod
+    def annual_cost(branch_probability, detection_amount, annual_amount, follow_up_amount, treatment_amount,
+                    life_expectancy):
+        """
+        :return: Annual cost associated with each branch
+        """
+        return branch_probability * (detection_amount +
+                                     life_expectancy * (annual_amount + follow_up_amount + treatment_amount))
+
+    @staticmethod
+    def qaly(branch_probability, life_expectancy, population_utility, utility):
+        """
+        :return: QALY associated with each branch
+        """
+        return branch_probability * life_expectancy * population_utility * utility
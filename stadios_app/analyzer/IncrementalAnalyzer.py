@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+from analyzer.CombinationEngine import CombinationEngine
+from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
+from analyzer.DecisionTree import DecisionTree
+
+
+class IncrementalAnalyzer(CostEffectivenessAnalyzer):
+    """ Class for the what-if exploration of a cost-effectiveness analysis.
+
+    The intermediate results of the analysis are kept as a dependency graph: the query dataframe, the
+    simulated branches of every intervention, the updated costs, the costs of the complementary tests and
+    the final dataframe. When a single parameter is edited, only the branches that depend on it are
+    evaluated again, without running the query, the simulation or the cost update of the rest.
+    """
+
+    # Column whose value identifies the parameter in each branch
+    PARAMETER_ENTITIES = {'sensitivity': 'detectionStrategy',
+                          'specificity': 'detectionStrategy',
+                          'prevalenceAtBirth': 'disease',
+                          'manifestationProbability': 'manifestation',
+                          'utilityValue': 'manifestation',
+                          'populationUtilityValue': 'intervention',
+                          'lifeExpectancy': 'intervention',
+                          'detectionStrategyAmount': 'detectionStrategy',
+                          'manifestationInitialAmount': 'manifestation',
+                          'manifestationAnnualAmount': 'manifestation',
+                          'followUpAmount': 'followUpStrategy',
+                          'treatmentStrategyAmount': 'treatmentStrategy'}
+    # Parameters that change the probability of the branches of their intervention
+    PROBABILITY_PARAMS = ['sensitivity', 'specificity', 'prevalenceAtBirth', 'manifestationProbability']
+    # Columns derived from the life expectancy of each branch
+    DISCOUNTED_COLUMNS = ['discountedCostYears', 'discountedQalyYears']
+
+    def __init__(self):
+        CostEffectivenessAnalyzer.__init__(self)
+        self.query_dataframe = None
+        self.branch_dataframe = None
+        self.ce_dataframe = None
+        self.inherited = dict()
+        self.intervention_rows = dict()
+        self.detection_costs = None
+
+    def get_incremental_analysis(self, sparql_query):
+        return self.load_dataframe(self.get_query(sparql_query))
+
+    def load_dataframe(self, simplified_df):
+        """ Runs the whole analysis once and keeps its intermediate results
+
+        :param simplified_df: Dataframe with the minimum information to set up analysis
+        :return: Dataframe with the most important columns of the analysis
+        """
+        self.query_dataframe = simplified_df.copy()
+        self.branch_dataframe = self.deflate_dataframe_costs(self.get_branch_dataframe(simplified_df.copy()))
+
+        # The simulation overwrites some parameters of the branches it adds, such as the costs of the false
+        # positives. Simulating the parameters as missing values shows which branches inherit them.
+        probed_params = [parameter for parameter in self.PARAMETER_ENTITIES if parameter != 'manifestationProbability']
+        probe_dataframe = simplified_df.copy()
+        probe_dataframe[probed_params] = np.nan
+        probe_dataframe = self.get_branch_dataframe(probe_dataframe)
+        self.inherited = {parameter: probe_dataframe[parameter].isna().to_numpy() for parameter in probed_params}
+        self.inherited['manifestationProbability'] = (self.branch_dataframe['manifestation'] != 'NONE').to_numpy()
+
+        self.intervention_rows = self.branch_dataframe.groupby('intervention', sort=False, observed=True).indices
+        self.detection_costs = self.get_detection_costs(self.branch_dataframe)
+        self.ce_dataframe = self.get_ce_dataframe(self.adjust_detection_costs(self.branch_dataframe.copy()))
+        self.branch_dataframe['Branch Probability'] = self.ce_dataframe['Branch Probability']
+
+        return self.ce_dataframe
+
+    def get_parameter_values(self, parameter):
+        """
+        :param parameter: Editable parameter
+        :return: Series with the current value of the parameter for each entity
+        """
+        if parameter not in self.PARAMETER_ENTITIES:
+            raise Exception('Parameter not editable: ' + str(parameter))
+
+        values = self.query_dataframe[[self.PARAMETER_ENTITIES[parameter], parameter]].drop_duplicates(
+            self.PARAMETER_ENTITIES[parameter])
+
+        return values.set_index(self.PARAMETER_ENTITIES[parameter])[parameter]
+
+    def set_parameter(self, parameter, entity, value):
+        """ Edits a parameter and evaluates again only the branches that depend on it
+
+        :param parameter: Editable parameter
+        :param entity: Entity of the parameter, such as the treatment strategy of a treatment cost
+        :param value: New value of the parameter, with costs in the currency of their original year
+        :return: Dataframe with the most important columns of the analysis
+        """
+        if self.branch_dataframe is None:
+            raise Exception('There is no analysis loaded')
+        if parameter not in self.PARAMETER_ENTITIES:
+            raise Exception('Parameter not editable: ' + str(parameter))
+        if parameter in self.PROBABILITY_PARAMS:
+            value = float(CombinationEngine.validate_probabilities([value])[0])
+
+        entity_column = self.PARAMETER_ENTITIES[parameter]
+        query_rows = (self.query_dataframe[entity_column] == entity).to_numpy()
+        if not query_rows.any():
+            raise Exception('Unknown ' + entity_column + ': ' + str(entity))
+        self.query_dataframe.loc[query_rows, parameter] = value
+
+        rows = np.flatnonzero((self.branch_dataframe[entity_column] == entity).to_numpy() & self.inherited[parameter])
+        new_values = np.full(len(rows), value, dtype=np.float64)
+        if parameter in self.COST_COLUMNS:
+            countries = self.get_columns(self.branch_dataframe, self.COST_COUNTRIES[parameter])
+            currencies = self.get_columns(self.branch_dataframe, self.COST_CURRENCIES[parameter])
+            new_values = self.costing_stage.update_costs(
+                new_values, self.branch_dataframe[self.COST_COLUMNS[parameter]].to_numpy()[rows],
+                None if countries is None else countries[rows], None if currencies is None else currencies[rows])
+        self.branch_dataframe.loc[rows, parameter] = new_values
+        if parameter == 'lifeExpectancy':
+            # Discounted years depend on the life expectancy of each branch
+            branches = self.discount_dataframe(self.branch_dataframe.iloc[rows].copy())
+            self.branch_dataframe.loc[rows, self.DISCOUNTED_COLUMNS] = branches[self.DISCOUNTED_COLUMNS].to_numpy()
+
+        if parameter in self.PROBABILITY_PARAMS:
+            # Probabilities are normalized over the whole intervention
+            interventions = self.branch_dataframe['intervention'].to_numpy()[rows]
+            rows = np.concatenate([self.intervention_rows[intervention] for intervention in pd.unique(interventions)]
+                                  + [np.zeros(0, dtype=np.int64)])
+            self.adjust_rows_probability(rows)
+        elif parameter == 'detectionStrategyAmount':
+            detection_costs = self.get_detection_costs(self.branch_dataframe)
+            if detection_costs != self.detection_costs:
+                # Every branch pays the complementary tests, so all of them depend on their costs
+                self.detection_costs = detection_costs
+                rows = np.arange(len(self.branch_dataframe))
+
+        self.evaluate_rows(rows)
+
+        return self.ce_dataframe
+
+    def adjust_rows_probability(self, rows):
+        """ Detection and branch probabilities of the branches of some interventions
+
+        :param rows: Positions of every branch of the interventions
+        """
+        branches = self.branch_dataframe.iloc[rows]
+        prevalence = branches['prevalenceAtBirth'].to_numpy()
+        detection_probability = DecisionTree.screening_detection_probability(
+            branches['DetectionCase'], branches['sensitivity'].to_numpy(), branches['specificity'].to_numpy(),
+            prevalence, DecisionTree.standard_detection_probability(branches['hasDisease'], prevalence))
+
+        manifestation_probability = branches['manifestationProbability'].to_numpy()
+        proportion_sum = branches.groupby('intervention', sort=False, observed=True)['manifestationProbability'] \
+            .transform('sum').to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            branch_probability = DecisionTree.branch_probability(detection_probability, manifestation_probability,
+                                                                 proportion_sum)
+
+        self.branch_dataframe.loc[rows, 'DetectionProbability'] = detection_probability
+        self.branch_dataframe.loc[rows, 'Branch Probability'] = branch_probability
+
+    def evaluate_rows(self, rows):
+        """ Evaluates again the cost and QALY of some branches
+
+        :param rows: Positions of the branches
+        """
+        branches = self.branch_dataframe.iloc[rows]
+        detection_amount = DecisionTree.detection_cost(
+            branches['detectionStrategyAmount'].to_numpy(), (branches['interventionKind'] == 'DIAGNOSIS').to_numpy(),
+            branches['DetectionCase'], branches['hasDisease'], *self.detection_costs)
+
+        updated_columns = [column for column in self.ce_dataframe.columns if column in self.PARAMETER_ENTITIES]
+        self.ce_dataframe.loc[rows, updated_columns] = branches[updated_columns].to_numpy()
+        self.ce_dataframe.loc[rows, self.DISCOUNTED_COLUMNS] = branches[self.DISCOUNTED_COLUMNS].to_numpy()
+        self.ce_dataframe.loc[rows, 'DetectionProbability'] = branches['DetectionProbability'].to_numpy()
+        self.ce_dataframe.loc[rows, 'detectionStrategyAmount'] = detection_amount
+        self.ce_dataframe.loc[rows, 'Branch Probability'] = branches['Branch Probability'].to_numpy()
+
+        ce_branches = self.ce_dataframe.iloc[rows]
+        self.ce_dataframe.loc[rows, 'Branch Lifetime Cost'] = DecisionTree.lifetime_cost(
+            ce_branches['Branch Probability'].to_numpy(), detection_amount,
+            ce_branches['manifestationInitialAmount'].to_numpy(), ce_branches['followUpAmount'].to_numpy(),
+            ce_branches['treatmentStrategyAmount'].to_numpy(), ce_branches['discountedCostYears'].to_numpy())
+        self.ce_dataframe.loc[rows, 'Branch Annual Cost'] = DecisionTree.annual_cost(
+            ce_branches['Branch Probability'].to_numpy(), detection_amount,
+            ce_branches['manifestationAnnualAmount'].to_numpy(), ce_branches['followUpAmount'].to_numpy(),
+            ce_branches['treatmentStrategyAmount'].to_numpy(), ce_branches['discountedCostYears'].to_numpy())
+        self.ce_dataframe.loc[rows, 'Branch QALY'] = DecisionTree.qaly(
+            ce_branches['Branch Probability'].to_numpy(), ce_branches['discountedQalyYears'].to_numpy(),
+            ce_branches['populationUtilityValue'].to_numpy(), ce_branches['utilityValue'].to_numpy())
@@ -0,0 +1,304 @@
+import numpy as np
+import pandas as pd
+from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
+
+
+class MarkovAnalyzer(CostEffectivenessAnalyzer):
+    """ Class for the cost-effectiveness analysis of the StaDiOS ontology with a Markov cohort model.
+
+    The branches of the decision tree of each intervention are the live health states of its cohort, which
+    starts distributed with the branch probabilities and moves from each state to death with the constant
+    annual hazard of the life expectancy of the branch. The cohorts of every intervention are propagated
+    together with one batched matrix product per cycle, and each state accrues its costs and QALY in every
+    cycle, discounted and with half-cycle correction, over a fixed number of cycles or over the lifetime of
+    the cohort. The ontology stores no transitions between live states, so the cohort of each state usually
+    only decays geometrically, and then the cycles are summed up in closed form instead of propagated.
+    """
+
+    # Lifetime horizon, until the whole cohort has died
+    DEFAULT_CYCLES = None
+    DEFAULT_DISCOUNT_RATE = 0.03
+    # Share of the cohort still alive at the end of the trace of a lifetime horizon, and at the end of the
+    # propagation whose cycles are summed up
+    TRACE_TOLERANCE = 1e-3
+    LIFETIME_TOLERANCE = 1e-9
+    # Cycles propagated at a time with a lifetime horizon, and limit of the lifetime of a cohort
+    LIFETIME_BLOCK = 100
+    MAX_CYCLES = 100000
+
+    def __init__(self, cycles=DEFAULT_CYCLES, cost_discount_rate=DEFAULT_DISCOUNT_RATE,
+                 effect_discount_rate=DEFAULT_DISCOUNT_RATE, half_cycle_correction=True):
+        """ Builder overload -- Initialize MarkovAnalyzer parameters
+
+        :param cycles: Number of yearly cycles of the time horizon, None for a lifetime horizon
+        :param cost_discount_rate: Annual discount rate of the costs
+        :param effect_discount_rate: Annual discount rate of the QALY
+        :param half_cycle_correction: Count the cohort of each cycle at its middle instead of at its start
+        """
+        CostEffectivenessAnalyzer.__init__(self)
+        self.cycles = cycles
+        self.cost_discount_rate = cost_discount_rate
+        self.effect_discount_rate = effect_discount_rate
+        self.half_cycle_correction = half_cycle_correction
+
+    @staticmethod
+    def get_state_positions(interventions):
+        """
+        :param interventions: Intervention of each branch
+        :return: Position of the intervention of each branch, position of the state of each branch in its
+        intervention, interventions and number of live states of the largest intervention
+        """
+        codes, uniques = pd.factorize(interventions)
+        positions = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+
+        return codes, positions, uniques, int(positions.max(initial=-1)) + 1
+
+    @staticmethod
+    def get_transition_matrices(life_expectancy, codes, positions, interventions, states):
+        """ Transition matrices of the interventions, whose last state is death. Interventions with fewer
+        states are padded with empty states that keep their cohort. Subclasses may add transitions between
+        live states, or return a matrix per cycle, and then the cohorts are propagated.
+
+        :param life_expectancy: Life expectancy of each branch
+        :param codes: Position of the intervention of each branch
+        :param positions: Position of the state of each branch in its intervention
+        :param interventions: Number of interventions
+        :param states: Number of live states of each intervention
+        :return: Array of shape (interventions, states + 1, states + 1)
+        """
+        life_expectancy = np.asarray(life_expectancy, dtype=np.float64)
+        if np.isinf(life_expectancy).any():
+            raise Exception('The life expectancy of every branch must be finite')
+        death_probability = np.ones(len(life_expectancy))
+        alive = life_expectancy > 0
+        death_probability[alive] = -np.expm1(-1 / life_expectancy[alive])
+
+        matrices = np.zeros((interventions, states + 1, states + 1))
+        matrices[:, np.arange(states + 1), np.arange(states + 1)] = 1.0
+        matrices[codes, positions, positions] = 1 - death_probability
+        matrices[codes, positions, states] = death_probability
+
+        return matrices
+
+    @staticmethod
+    def get_survival_ratios(transitions, states):
+        """
+        :param transitions: Transition matrices of the interventions
+        :param states: Number of live states of each intervention
+        :return: Share of the cohort of each live state that stays in it each cycle, or None when the cohort
+        moves between live states, leaves death or has different transitions in each cycle
+        """
+        if transitions.ndim == 4:
+            return None
+        live = transitions[:, :, :states]
+        ratios = np.diagonal(live, axis1=1, axis2=2)
+        if np.count_nonzero(live) != np.count_nonzero(ratios):
+            return None
+
+        return ratios
+
+    @staticmethod
+    def propagate(initial, transitions, cycles, first_cycle=0):
+        """ Propagates the cohorts of every intervention at once
+
+        :param initial: Initial distribution of each cohort, of shape (interventions, states)
+        :param transitions: Transition matrices, of shape (interventions, states, states), or of shape
+        (cycles, interventions, states, states) when they change in each cycle, the last one holding for the
+        cycles after them
+        :param cycles: Number of cycles
+        :param first_cycle: Cycle of the initial distribution
+        :return: Cohort trace, of shape (cycles + 1, interventions, states)
+        """
+        trace = np.empty((cycles + 1,) + initial.shape)
+        trace[0] = initial
+        for cycle in range(cycles):
+            matrices = transitions[min(first_cycle + cycle, len(transitions) - 1)] if transitions.ndim == 4 \
+                else transitions
+            trace[cycle + 1] = np.matmul(trace[cycle][:, None, :], matrices)[:, 0, :]
+
+        return trace
+
+    def propagate_horizon(self, initial, transitions, states, tolerance):
+        """ Propagates the cohorts over the time horizon. With a lifetime horizon they are propagated a block of
+        cycles at a time, until the share of the cohort still alive is below the tolerance.
+
+        :param initial: Initial distribution of each cohort, of shape (interventions, states + 1)
+        :param transitions: Transition matrices of the interventions
+        :param states: Number of live states of each intervention
+        :param tolerance: Share of the initial cohort still alive at the end of a lifetime horizon
+        :return: Cohort trace, of shape (cycles + 1, interventions, states + 1)
+        """
+        if self.cycles is not None:
+            return self.propagate(initial, transitions, self.cycles)
+
+        traces = [initial[None]]
+        cycles = 0
+        threshold = tolerance * initial[:, :states].sum()
+        while traces[-1][-1][:, :states].sum() > threshold:
+            if cycles >= self.MAX_CYCLES:
+                raise Exception('The cohort is still alive after ' + str(cycles) + ' cycles, and a lifetime '
+                                'horizon needs it to die')
+            traces.append(self.propagate(traces[-1][-1], transitions, self.LIFETIME_BLOCK, cycles)[1:])
+            cycles += self.LIFETIME_BLOCK
+
+        return np.concatenate(traces)
+
+    def get_cycle_weights(self, discount_rate, cycles):
+        """
+        :param discount_rate: Annual discount rate
+        :param cycles: Number of cycles of the trace
+        :return: Weight of the cohort of each point of the trace
+        """
+        weights = (1 + discount_rate) ** -np.arange(cycles + 1, dtype=np.float64)
+        if self.half_cycle_correction:
+            # The cohort of each cycle is the mean of its start and its end
+            weights[0] *= 0.5
+            weights[-1] *= 0.5
+        else:
+            weights[-1] = 0.0
+
+        return weights
+
+    def get_cycle_years(self, ratios, discount_rate):
+        """ Sums up the cycles of the horizon of each state as a geometric series, which is what the
+        propagation of states that only decay adds up
+
+        :param ratios: Survival ratio of each state
+        :param discount_rate: Annual discount rate
+        :return: Discounted years lived by each state per unit of its initial cohort
+        """
+        factors = ratios / (1 + discount_rate)
+        if self.cycles is None:
+            if (factors >= 1).any():
+                raise Exception('A lifetime horizon needs every live state to lose part of its cohort, '
+                                'or a discount rate')
+            # The cohort is empty at the end of a lifetime horizon
+            last = np.zeros(len(factors))
+            years = 1 / (1 - factors)
+        else:
+            # Sum of the cohort at the start of every cycle from the first one to the end of the horizon, which
+            # is one per cycle for a state that keeps its whole cohort without discount
+            last = factors ** self.cycles
+            with np.errstate(divide='ignore', invalid='ignore'):
+                years = np.where(factors == 1, self.cycles + 1, (1 - last * factors) / (1 - factors))
+        if self.half_cycle_correction:
+            # The cohort of each cycle is the mean of its start and its end
+            return years - 0.5 * (1 + last)
+
+        return years - last
+
+    def get_trace_cycles(self, ratios):
+        """
+        :param ratios: Survival ratio of each state
+        :return: Cycles of the horizon or, with a lifetime horizon, cycles until every cohort is below the
+        tolerance
+        """
+        if self.cycles is not None:
+            return self.cycles
+        ratio = ratios.max(initial=0.0)
+        if ratio >= 1:
+            raise Exception('A lifetime horizon needs every live state to lose part of its cohort')
+
+        return int(np.ceil(np.log(self.TRACE_TOLERANCE) / np.log(ratio))) if ratio > 0 else 0
+
+    def get_trace(self, interventions, life_expectancy, branch_probability):
+        """
+        :param interventions: Intervention of each branch
+        :param life_expectancy: Life expectancy of each branch
+        :param branch_probability: Probability of each branch, which is its initial cohort
+        :return: Dataframe with the proportion of the cohort of each intervention alive in each cycle
+        """
+        codes, positions, uniques, states = self.get_state_positions(interventions)
+        transitions = self.get_transition_matrices(life_expectancy, codes, positions, len(uniques), states)
+        branch_probability = np.asarray(branch_probability, dtype=np.float64)
+        ratios = self.get_survival_ratios(transitions, states)
+
+        if ratios is not None:
+            # Cohort of each state in each cycle, summed up by intervention
+            ratios = ratios[codes, positions]
+            cycles = np.arange(self.get_trace_cycles(ratios) + 1)
+            alive = np.zeros((len(cycles), len(uniques)))
+            np.add.at(alive, (slice(None), codes), branch_probability * ratios ** cycles[:, None])
+        else:
+            initial = np.zeros((len(uniques), states + 1))
+            initial[codes, positions] = branch_probability
+            alive = self.propagate_horizon(initial, transitions, states, self.TRACE_TOLERANCE)[:, :, :states] \
+                .sum(axis=2)
+
+        return pd.DataFrame(alive, columns=uniques).rename_axis('cycle').reset_index()
+
+    def get_state_years(self, interventions, life_expectancy, branch_probability):
+        """ Sums up the cohort of each state over the cycles of the horizon, in closed form when the cohort of
+        every state only decays and by propagating the transition matrices otherwise
+
+        :param interventions: Intervention of each branch
+        :param life_expectancy: Life expectancy of each branch
+        :param branch_probability: Probability of each branch, which is its initial cohort
+        :return: Tuple with the years lived by the cohort of each state, and those discounted as costs and as QALY
+        """
+        codes, positions, uniques, states = self.get_state_positions(interventions)
+        transitions = self.get_transition_matrices(life_expectancy, codes, positions, len(uniques), states)
+        discount_rates = [0.0, self.cost_discount_rate, self.effect_discount_rate]
+        ratios = self.get_survival_ratios(transitions, states)
+
+        if ratios is not None:
+            ratios = ratios[codes, positions]
+            return tuple(branch_probability * self.get_cycle_years(ratios, rate) for rate in discount_rates)
+
+        initial = np.zeros((len(uniques), states + 1))
+        initial[codes, positions] = branch_probability
+        trace = self.propagate_horizon(initial, transitions, states, self.LIFETIME_TOLERANCE)
+
+        return tuple(np.tensordot(self.get_cycle_weights(rate, len(trace) - 1), trace, axes=1)[codes, positions]
+                     for rate in discount_rates)
+
+    def get_trace_dataframe(self, simplified_df):
+        """
+        :param simplified_df: Dataframe with the minimum information to set up analysis
+        :return: Dataframe with the proportion of the cohort of each intervention alive in each cycle
+        """
+        full_dataframe = self.update_dataframe_costs(self.get_branch_dataframe(simplified_df))
+        ce_dataframe = self.get_ce_dataframe(full_dataframe)
+
+        return self.get_trace(full_dataframe['intervention'], ce_dataframe['lifeExpectancy'],
+                              ce_dataframe['Branch Probability'])
+
+    def get_markov_dataframe(self, full_dataframe):
+        """ Evaluates the cost and QALY of each state of the Markov cohort model
+
+        :param full_dataframe: Full analysis table with updated costs
+        :return: Dataframe with the most important columns of the analysis
+        """
+        # The cohort starts with the branch probabilities of the decision tree
+        ce_dataframe = self.get_ce_dataframe(full_dataframe)
+        branch_probability = ce_dataframe['Branch Probability'].to_numpy(dtype=np.float64)
+
+        # Cohort of each state summed over the cycles, weighted by the discount of costs and of QALY
+        life_years, cost_years, effect_years = self.get_state_years(
+            full_dataframe['intervention'], ce_dataframe['lifeExpectancy'], branch_probability)
+
+        ce_dataframe['Branch Life Years'] = life_years
+        ce_dataframe['Branch Lifetime Cost'] = \
+            branch_probability * (ce_dataframe['detectionStrategyAmount'] +
+                                  ce_dataframe['manifestationInitialAmount']) + \
+            (ce_dataframe['followUpAmount'] + ce_dataframe['treatmentStrategyAmount']) * cost_years
+        ce_dataframe['Branch Annual Cost'] = \
+            branch_probability * ce_dataframe['detectionStrategyAmount'] + \
+            (ce_dataframe['manifestationAnnualAmount'] + ce_dataframe['followUpAmount'] +
+             ce_dataframe['treatmentStrategyAmount']) * cost_years
+        ce_dataframe['Branch QALY'] = \
+            ce_dataframe['populationUtilityValue'] * ce_dataframe['utilityValue'] * effect_years
+
+        return ce_dataframe
+
+    def get_dataframe_analysis(self, simplified_df):
+        with self.tracer.span('analysis', rows=len(simplified_df)):
+            with self.tracer.span('simulation') as span:
+                full_dataframe = self.get_branch_dataframe(simplified_df)
+                span.set('branches', len(full_dataframe))
+
+            with self.tracer.span('costs'):
+                full_dataframe = self.update_dataframe_costs(full_dataframe)
+
+            with self.tracer.span('markov', cycles=self.cycles):
+                return self.get_markov_dataframe(full_dataframe)
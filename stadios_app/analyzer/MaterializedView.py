@@ -0,0 +1,366 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from analyzer.BatchAnalyzer import BatchAnalyzer
+from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
+from analyzer.CostingStage import CostingStage
+from analyzer.ResultExporter import ResultExporter
+from sparql.QueryBackend import QueryBackend
+from sparql.QueryCache import QueryCache
+
+
+class MaterializedView:
+    """ Materialized cost-effectiveness analyses of every selection of the StaDiOS ontology.
+
+    The analysis and the grouped results of each disease, development, follow-up, treatment and study of the
+    ontology are computed by the batch analyzer and stored as Arrow IPC files, which are memory-mapped and
+    sliced with an index keyed by the selection, so serving a selection does not query nor analyze anything.
+    The view is stamped with the hash of the ontology file, and when it changes the view is refreshed on a
+    thread of its own: the rows of each selection are fingerprinted and only the selections whose rows changed
+    are analyzed again, while the rest are copied from the previous view. A failed refresh removes its files
+    and is retried after a delay that doubles with each failure.
+    """
+
+    DEFAULT_DIRECTORY = '.cache/materialized'
+    MANIFEST_NAME = 'manifest.json'
+    # Version of the layout of the files, part of the version of the analyses
+    FORMAT_VERSION = 1
+    SELECTION_COLUMNS = BatchAnalyzer.PARTITION_COLUMNS
+    GROUPED_PARAMS = BatchAnalyzer.GROUPED_PARAMS
+    RESULT_COLUMNS = BatchAnalyzer.RESULT_COLUMNS
+    ENTRY_COLUMNS = SELECTION_COLUMNS + ['fingerprint', 'branchOffset', 'branchRows', 'error']
+    # Labels whose categories have a fixed order in the analyses, the rest are sorted
+    LABEL_CATEGORIES = {'hasDisease': CostEffectivenessAnalyzer.HEALTH_STATES,
+                        'DetectionCase': CostEffectivenessAnalyzer.DETECTION_CASES}
+    # Labels that the simulation adds after the sorted ones of the query
+    ADDED_LABELS = {'manifestation': ['NONE']}
+    # Seconds before a failed refresh is started again, doubled after each failure up to the maximum
+    RETRY_DELAY = 60
+    MAX_RETRY_DELAY = 3600
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_workers=None, page_rows=QueryBackend.DEFAULT_PAGE_ROWS):
+        """ Builder overload -- Initialize MaterializedView parameters
+
+        :param directory: Directory of the materialized files
+        :param max_workers: Number of worker processes of the refreshes, by default the number of processors
+        :param page_rows: Number of rows of each page of the query of the refreshes
+        """
+        self.directory = Path(directory)
+        self.batch_analyzer = BatchAnalyzer(max_workers)
+        self.page_rows = page_rows
+        self.state = None
+        # Inode, modification time and size of the manifest of the loaded state
+        self.manifest_stamp = None
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.retry_time = 0.0
+        self.retry_delay = self.RETRY_DELAY
+        self.logger = logging.getLogger('stadios.materialized')
+        self.load()
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def hash_file(path, modified, size):
+        """ Files are only hashed again when they are modified
+
+        :param path: File to hash
+        :param modified: Modification time of the file, in nanoseconds
+        :param size: Size of the file
+        :return: Hash of the file
+        """
+        return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+    @staticmethod
+    def get_file_version(path):
+        """
+        :param path: File to hash
+        :return: Hash of the file, or an empty stamp when it is not available
+        """
+        path = Path(path)
+        if not path.is_file():
+            return ''
+        stat = path.stat()
+
+        return MaterializedView.hash_file(str(path), stat.st_mtime_ns, stat.st_size)
+
+    def get_versions(self):
+        """
+        :return: Version of the dataset, which is the hash of the ontology file as in the query cache, and
+        version of the analyses, which changes with the query and the costing tables
+        """
+        analysis_inputs = [self.FORMAT_VERSION, self.batch_analyzer.analyzer.query_registry.get(
+            'cost_effectiveness_query').version] + [self.get_file_version(path) for path in (
+            CostingStage.PRICE_INDEXES_PATH, CostingStage.EXCHANGE_RATES_PATH, CostingStage.DISCOUNT_RATES_PATH)]
+
+        return self.get_file_version(QueryCache.ONTOLOGY_PATH), \
+            hashlib.sha256(json.dumps(analysis_inputs).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_fingerprint(partition):
+        """
+        :param partition: Rows of the query of a selection
+        :return: Hash of the values of the rows, which changes when any input of the analysis of the selection does
+        """
+        hashes = pd.util.hash_pandas_object(partition, index=False).to_numpy()
+
+        return hashlib.sha256('\t'.join(partition.columns).encode('utf-8') + hashes.tobytes()).hexdigest()
+
+    @staticmethod
+    def get_key(selection):
+        return tuple(str(value) for value in selection)
+
+    def load(self):
+        """ Maps the files of the view published in the manifest, if any. The manifest is replaced when a view
+        is published, so the loaded state is kept until the stamp of the manifest changes.
+        """
+        manifest_path = self.directory / self.MANIFEST_NAME
+        if not manifest_path.is_file():
+            return
+        stat = manifest_path.stat()
+        manifest_stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if manifest_stamp == self.manifest_stamp:
+                return
+
+        manifest = json.loads(manifest_path.read_text())
+        view_directory = self.directory / manifest['directory']
+        index = pd.read_parquet(view_directory / 'index.parquet')
+        keys = [self.get_key(selection) for selection in index[self.SELECTION_COLUMNS].itertuples(index=False)]
+        state = dict(manifest, index=dict(zip(keys, index.to_dict('records'))),
+                     branches=pa.ipc.open_file(pa.memory_map(str(view_directory / 'branches.arrow'))).read_all(),
+                     results=pa.ipc.open_file(pa.memory_map(str(view_directory / 'results.arrow'))).read_all())
+        with self.lock:
+            self.state = state
+            self.manifest_stamp = manifest_stamp
+
+    def get_state(self):
+        """ A view of another version of the ontology is not served. The view published by another process is
+        loaded when the manifest changes, and otherwise a refresh is started in the background, unless one is
+        running or failed recently.
+
+        :return: State of the view of the current ontology, or None while it is not materialized
+        """
+        dataset_version, analysis_version = self.get_versions()
+        with self.lock:
+            state = self.state
+        if state is not None and (state['datasetVersion'], state['analysisVersion']) == \
+                (dataset_version, analysis_version):
+            return state
+
+        self.load()
+        with self.lock:
+            state = self.state
+            if state is not None and (state['datasetVersion'], state['analysisVersion']) == \
+                    (dataset_version, analysis_version):
+                return state
+            if (self.refresh_thread is None or not self.refresh_thread.is_alive()) and \
+                    time.monotonic() >= self.retry_time:
+                # The refresh runs the whole batch, so it does not take a worker of the pool of the queries
+                self.refresh_thread = threading.Thread(target=self.refresh_in_background, daemon=True,
+                                                       name='stadios-materialized-refresh')
+                self.refresh_thread.start()
+
+        return None
+
+    def refresh_in_background(self):
+        """ Refreshes the view, delaying the next attempt when the refresh fails
+        """
+        try:
+            self.refresh()
+        except Exception:
+            with self.lock:
+                delay = self.retry_delay
+                self.retry_time = time.monotonic() + delay
+                self.retry_delay = min(2 * delay, self.MAX_RETRY_DELAY)
+            self.logger.warning('The materialized view is served live until the refresh is retried in %d seconds',
+                                delay)
+        else:
+            with self.lock:
+                self.retry_delay = self.RETRY_DELAY
+
+    @staticmethod
+    def encode_labels(name, column):
+        """ Labels are stored as strings and dictionary encoded by Arrow when they are read, which is faster
+        than converting them to categoricals in pandas
+
+        :param name: Name of the column
+        :param column: Column of strings
+        :return: Dictionary column with the categories of the labels in the analyses
+        """
+        if name in MaterializedView.LABEL_CATEGORIES:
+            categories = pa.array(MaterializedView.LABEL_CATEGORIES[name], pa.string())
+        else:
+            added = pa.array(MaterializedView.ADDED_LABELS.get(name, list()), pa.string())
+            categories = pc.drop_null(column.unique())
+            categories = categories.filter(pc.invert(pc.is_in(categories, value_set=added)))
+            categories = pa.concat_arrays([categories.take(pc.sort_indices(categories)), added])
+
+        return pa.chunked_array([pa.DictionaryArray.from_arrays(pc.index_in(chunk, value_set=categories), categories)
+                                 for chunk in column.chunks], pa.dictionary(pa.int32(), pa.string()))
+
+    @staticmethod
+    def to_dataframe(table):
+        """
+        :param table: Slice of a materialized table
+        :return: Dataframe whose labels are categoricals, as in the analyses
+        """
+        columns = [MaterializedView.encode_labels(name, column) if pa.types.is_string(column.type) else column
+                   for name, column in zip(table.column_names, table.columns)]
+
+        return pa.Table.from_arrays(columns, names=table.column_names).to_pandas()
+
+    def get_analysis(self, selection):
+        """
+        :param selection: Disease, development, follow-up, treatment and study of the analysis
+        :return: Analysis dataframe of the selection, or None if it is not materialized or could not be analyzed
+        """
+        state = self.get_state()
+        entry = state['index'].get(self.get_key(selection)) if state is not None else None
+        if entry is None or pd.notna(entry['error']):
+            return None
+
+        return self.to_dataframe(state['branches'].slice(entry['branchOffset'], entry['branchRows'])
+                                 .drop(['studyIdentifier']))
+
+    def get_results(self, selection):
+        """
+        :param selection: Disease, development, follow-up, treatment and study of the analysis
+        :return: Grouped results of the selection, as in the main page, or None if they are not materialized
+        """
+        state = self.get_state()
+        entry = state['index'].get(self.get_key(selection)) if state is not None else None
+        if entry is None or pd.notna(entry['error']):
+            return None
+
+        results = self.to_dataframe(state['results'].slice(entry['resultOffset'], entry['resultRows']))
+
+        return results[self.GROUPED_PARAMS + self.RESULT_COLUMNS]
+
+    def get_block_results(self, block_dataframe):
+        """
+        :param block_dataframe: Branches of several selections
+        :return: Grouped results of each selection
+        """
+        grouping = self.SELECTION_COLUMNS + [column for column in self.GROUPED_PARAMS
+                                             if column not in self.SELECTION_COLUMNS]
+
+        return block_dataframe.groupby(grouping, as_index=False, observed=True)[self.RESULT_COLUMNS].sum()
+
+    def write_view(self, view_directory, reusable):
+        """ Writes the files of a view, analyzing the selections whose rows changed since the reusable view
+
+        :param view_directory: Directory of the files of the view
+        :param reusable: State of the previous view whose analyses can be copied, or None
+        :return: Number of selections analyzed and number of selections reused
+        """
+        entries = list()
+        reused = list()
+        fingerprints = dict()
+        results = list()
+
+        def iter_changed_partitions():
+            for key, partition in self.batch_analyzer.iter_partitions(self.page_rows):
+                key = self.get_key(key)
+                fingerprints[key] = self.get_fingerprint(partition)
+                entry = reusable['index'].get(key) if reusable is not None else None
+                if entry is not None and entry['fingerprint'] == fingerprints[key]:
+                    reused.append(entry)
+                else:
+                    yield key, partition
+
+        def iter_analyses():
+            branch_offset = 0
+            for key, ce_dataframe, error in self.batch_analyzer.iter_batch_analysis(
+                    partitions=iter_changed_partitions()):
+                branch_rows = len(ce_dataframe) if error is None else 0
+                entries.append(dict(zip(self.SELECTION_COLUMNS, key), fingerprint=fingerprints[key],
+                                    branchOffset=branch_offset, branchRows=branch_rows, error=error))
+                branch_offset += branch_rows
+                if error is None:
+                    yield ce_dataframe
+
+            # The selections whose rows did not change are copied from the files of the previous view
+            for entry in reused:
+                entries.append(dict({column: entry[column] for column in self.ENTRY_COLUMNS},
+                                    branchOffset=branch_offset))
+                branch_offset += entry['branchRows']
+                if pd.isna(entry['error']):
+                    yield self.to_dataframe(
+                        reusable['branches'].slice(entry['branchOffset'], entry['branchRows']))
+
+        def iter_blocks():
+            for block_dataframe in self.batch_analyzer.iter_blocks(iter_analyses()):
+                results.append(self.get_block_results(block_dataframe))
+                yield block_dataframe
+
+        result_exporter = ResultExporter(compression=None)
+        result_exporter.write_chunks(iter_blocks(), view_directory / 'branches.arrow')
+
+        # Results are sorted by selection and then by their grouping, as the main page sorts them
+        results = pd.concat(results, ignore_index=True) if results else pd.DataFrame(
+            columns=self.SELECTION_COLUMNS + self.GROUPED_PARAMS + self.RESULT_COLUMNS)
+        sort_columns = list(dict.fromkeys(self.SELECTION_COLUMNS + self.GROUPED_PARAMS))
+        results = results.astype({column: str for column in sort_columns}).sort_values(sort_columns) \
+            .reset_index(drop=True)
+        result_exporter.write(results, view_directory / 'results.arrow')
+
+        index = pd.DataFrame(entries, columns=self.ENTRY_COLUMNS)
+        result_positions = results.rename_axis('position').reset_index().groupby(
+            self.SELECTION_COLUMNS, as_index=False).agg(resultOffset=('position', 'first'),
+                                                        resultRows=('position', 'size'))
+        index = index.merge(result_positions, how='left', on=self.SELECTION_COLUMNS)
+        index[['resultOffset', 'resultRows']] = index[['resultOffset', 'resultRows']].fillna(0).astype('int64')
+        index.to_parquet(view_directory / 'index.parquet', index=False)
+
+        return len(entries) - len(reused), len(reused)
+
+    def refresh(self, full=False):
+        """ Materializes the analyses of the current ontology, reusing those of the previous view whose
+        selections have the same rows and the same version of the analyses
+
+        :param full: Analyze every selection again
+        :return: Number of selections analyzed and number of selections reused
+        """
+        with self.refresh_lock:
+            self.load()
+            dataset_version, analysis_version = self.get_versions()
+            with self.lock:
+                previous = self.state
+            reusable = previous if previous is not None and not full and \
+                previous['analysisVersion'] == analysis_version else None
+
+            view_name = dataset_version[:16] + '-' + uuid.uuid4().hex[:8]
+            view_directory = self.directory / view_name
+            view_directory.mkdir(parents=True)
+            temporary_path = self.directory / (self.MANIFEST_NAME + '.' + uuid.uuid4().hex + '.tmp')
+            try:
+                analyzed, reused = self.write_view(view_directory, reusable)
+
+                # The manifest is replaced at once, so other processes either see the previous view or the new one
+                manifest = {'datasetVersion': dataset_version, 'analysisVersion': analysis_version,
+                            'directory': view_name}
+                temporary_path.write_text(json.dumps(manifest))
+                os.replace(temporary_path, self.directory / self.MANIFEST_NAME)
+            except BaseException:
+                # The previous view stays published and the files of the failed one are removed
+                self.logger.exception('Refresh of the materialized view failed')
+                shutil.rmtree(view_directory, ignore_errors=True)
+                temporary_path.unlink(missing_ok=True)
+                raise
+            self.load()
+
+            if previous is not None and previous['directory'] != view_name:
+                shutil.rmtree(self.directory / previous['directory'], ignore_errors=True)
+
+        return analyzed, reused
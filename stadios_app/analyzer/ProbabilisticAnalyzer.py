@@ -0,0 +1,348 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
+from analyzer.DecisionTree import DecisionTree
+
+# Decision tree template of each worker process of the pool
+worker_template = None
+
+
+def initialize_worker(template):
+    global worker_template
+    worker_template = template
+
+
+def simulate_chunk(chunk):
+    """ Samples and evaluates a chunk of draws in a worker process
+
+    :param chunk: Pair with the seed sequence and the number of draws of the chunk
+    :return: Tuple with the lifetime cost, annual cost and QALY of each draw and strategy, and the number of
+    draws in which each strategy is optimal for each threshold
+    """
+    seed, draws = chunk
+    return ProbabilisticAnalyzer.simulate(worker_template, np.random.default_rng(seed), draws)
+
+
+class ProbabilisticAnalyzer(CostEffectivenessAnalyzer):
+    """ Class for the probabilistic sensitivity analysis of the StaDiOS cost-effectiveness decision tree.
+
+    The branches of the tree are generated once, as in the deterministic analysis, and turned into a
+    template of arrays. The uncertain parameters are then sampled for thousands of draws at once and the
+    branch formulas are evaluated as array math over a (draws, branches) matrix, in chunks spread across
+    a process pool.
+    """
+
+    GROUPED_PARAMS = ['interventionKind', 'detectionStrategy', 'treatmentStrategy', 'followUpStrategy']
+    # Distribution of each uncertain parameter: kind, column whose values share a sample and relative
+    # standard error. Kinds are 'beta', 'gamma', 'lognormal' and 'fixed'.
+    DEFAULT_DISTRIBUTIONS = {'sensitivity': ('beta', 'detectionStrategy', 0.05),
+                             'specificity': ('beta', 'detectionStrategy', 0.05),
+                             'prevalenceAtBirth': ('beta', 'disease', 0.2),
+                             'manifestationProbability': ('beta', 'manifestation', 0.2),
+                             'utilityValue': ('beta', 'manifestation', 0.1),
+                             'populationUtilityValue': ('beta', 'intervention', 0.05),
+                             'detectionStrategyAmount': ('gamma', 'detectionStrategy', 0.2),
+                             'manifestationInitialAmount': ('gamma', 'manifestation', 0.2),
+                             'manifestationAnnualAmount': ('gamma', 'manifestation', 0.2),
+                             'followUpAmount': ('gamma', 'followUpStrategy', 0.2),
+                             'treatmentStrategyAmount': ('gamma', 'treatmentStrategy', 0.2)}
+    DEFAULT_DRAWS = 10000
+    DEFAULT_CHUNK_SIZE = 2 ** 12
+    # Willingness to pay per QALY of the acceptability curves
+    DEFAULT_THRESHOLDS = np.linspace(0, 100000, 101)
+
+    def __init__(self, max_workers=None):
+        """ Builder overload -- Initialize ProbabilisticAnalyzer parameters
+
+        :param max_workers: Number of worker processes, by default the number of processors
+        """
+        CostEffectivenessAnalyzer.__init__(self)
+        self.max_workers = max_workers
+
+    @staticmethod
+    def sample(kind, means, relative_error, rng, draws):
+        """ Samples a parameter around its point estimates. Parameters at the bounds of their
+        distribution, such as a probability of 0 or a cost of 0, are kept constant.
+
+        :param kind: Distribution of the parameter
+        :param means: Point estimate of each distinct value of the parameter
+        :param relative_error: Standard error of the parameter relative to its point estimate
+        :param rng: Random generator
+        :param draws: Number of draws
+        :return: Matrix with the draws of each distinct value
+        """
+        samples = np.broadcast_to(means, (draws, len(means))).copy()
+        if kind == 'fixed' or relative_error == 0:
+            return samples
+
+        if kind == 'beta':
+            varying = (means > 0) & (means < 1)
+            mean = means[varying]
+            # Method of moments, capping the variance below the maximum of a beta distribution
+            variance = np.minimum((relative_error * mean) ** 2, 0.99 * mean * (1 - mean))
+            common = mean * (1 - mean) / variance - 1
+            samples[:, varying] = rng.beta(mean * common, (1 - mean) * common, (draws, len(mean)))
+        elif kind == 'gamma':
+            varying = means > 0
+            shape = 1 / relative_error ** 2
+            samples[:, varying] = rng.gamma(shape, means[varying] / shape, (draws, int(varying.sum())))
+        elif kind == 'lognormal':
+            varying = means > 0
+            sigma = np.sqrt(np.log(1 + relative_error ** 2))
+            samples[:, varying] = rng.lognormal(np.log(means[varying]) - sigma ** 2 / 2, sigma,
+                                                (draws, int(varying.sum())))
+        else:
+            raise Exception('Unknown distribution: ' + str(kind))
+
+        return samples
+
+    def get_template(self, simplified_df, distributions=None, thresholds=None):
+        """ Generates the branches of the decision tree and turns them into arrays
+
+        :param simplified_df: Dataframe with the minimum information to set up analysis
+        :param distributions: Distribution of each uncertain parameter, by default DEFAULT_DISTRIBUTIONS
+        :param thresholds: Willingness to pay per QALY, by default DEFAULT_THRESHOLDS
+        :return: Dictionary with the arrays of the template and the strategies of the analysis
+        """
+        distributions = self.DEFAULT_DISTRIBUTIONS if distributions is None else distributions
+        # Detection costs are adjusted for every draw, so only the update to the present time is applied
+        full_dataframe = self.deflate_dataframe_costs(self.get_branch_dataframe(simplified_df))
+
+        strategy_codes = full_dataframe.groupby(self.GROUPED_PARAMS, sort=False, observed=True).ngroup().to_numpy()
+        strategies = full_dataframe[self.GROUPED_PARAMS].drop_duplicates().reset_index(drop=True)
+        intervention_codes = pd.factorize(full_dataframe['intervention'])[0]
+
+        parameters = dict()
+        entities = dict()
+        for parameter, (kind, entity_column, relative_error) in distributions.items():
+            # Branches share a sample when they have the same entity and the same point estimate
+            keys = pd.MultiIndex.from_arrays([full_dataframe[entity_column].astype(str),
+                                              full_dataframe[parameter].astype(float)])
+            codes, uniques = pd.factorize(keys)
+            parameters[parameter] = (kind, relative_error, codes,
+                                     uniques.get_level_values(1).to_numpy(dtype=np.float64))
+            entities[parameter] = uniques.get_level_values(0).to_numpy()
+
+        # Parameters without distribution keep their point estimates
+        values = {column: full_dataframe[column].to_numpy(dtype=np.float64)
+                  for column in ['lifeExpectancy'] + list(self.DEFAULT_DISTRIBUTIONS) if column not in parameters}
+
+        # Discount rates of the country of the population of each branch
+        cost_rates, effect_rates = self.costing_stage.get_discount_rates(
+            self.get_columns(full_dataframe, 'populationCountry'), len(full_dataframe))
+
+        return {'parameters': parameters,
+                'values': values,
+                'cost_rates': cost_rates,
+                'effect_rates': effect_rates,
+                'detection_case': full_dataframe['DetectionCase'].astype(str).to_numpy(),
+                'has_disease': full_dataframe['hasDisease'].astype(str).to_numpy(),
+                'is_diagnosis': (full_dataframe['interventionKind'] == 'DIAGNOSIS').to_numpy(),
+                'is_screening': (full_dataframe['interventionKind'] == 'SCREENING').to_numpy(),
+                'intervention_codes': intervention_codes,
+                'strategy_codes': strategy_codes,
+                'n_strategies': len(strategies),
+                'thresholds': np.asarray(self.DEFAULT_THRESHOLDS if thresholds is None else thresholds,
+                                         dtype=np.float64),
+                'entities': entities,
+                'strategy_table': strategies}
+
+    @staticmethod
+    def sum_groups(matrix, codes, n_groups):
+        """ Sums the values of the branches of each group without building the indicator matrix of the groups,
+        which has one column per group for every branch. Consecutive branches of the same group are added up
+        first, so when the branches of each group are together, as those of each intervention, the final
+        bincount only has one value per group.
+
+        :param matrix: Array whose last axis has one value per branch
+        :param codes: Group of each branch
+        :param n_groups: Number of groups
+        :return: Array whose last axis has one value per group
+        """
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        run_sums = np.add.reduceat(matrix, starts, axis=-1).reshape(-1, len(starts))
+        keys = codes[starts] + n_groups * np.arange(len(run_sums))[:, None]
+        sums = np.bincount(keys.ravel(), weights=run_sums.ravel(), minlength=len(run_sums) * n_groups)
+
+        return sums.reshape(matrix.shape[:-1] + (n_groups,))
+
+    @staticmethod
+    def get_proportion_sum(template, manifestation_probability):
+        """
+        :param template: Template of the decision tree, or of some of its interventions
+        :param manifestation_probability: Array whose last axis has the manifestation probability of each branch
+        :return: Sum of the manifestation probabilities of the intervention of each branch
+        """
+        codes = template['intervention_codes']
+
+        return ProbabilisticAnalyzer.sum_groups(manifestation_probability, codes, codes.max() + 1)[..., codes]
+
+    @staticmethod
+    def check_template(template):
+        """ Checks that the tree has the interventions whose tests the detection costs of the branches add up
+
+        :param template: Template of the decision tree
+        """
+        if not template['is_diagnosis'].any() or not template['is_screening'].any():
+            raise Exception('Probabilistic analysis needs both DIAGNOSIS and SCREENING interventions')
+
+    @staticmethod
+    def evaluate_branches(template, values, proportion_sum=None, detection_costs=None):
+        """ Evaluates the branch formulas of the decision tree for a matrix of draws
+
+        :param template: Template of the decision tree, or of some of its branches
+        :param values: Matrix of draws of each parameter, with one column per branch
+        :param proportion_sum: Sum of the manifestation probabilities of the intervention of each branch, by
+        default that of the draws
+        :param detection_costs: Pair with the cost of the diagnostic and of the screening test, by default that
+        of the draws
+        :return: Tuple with the lifetime cost, annual cost and QALY of each draw and branch
+        """
+        # Branches without detection case come from the standard simulation
+        detection_probability = DecisionTree.screening_detection_probability(
+            template['detection_case'], values['sensitivity'], values['specificity'], values['prevalenceAtBirth'],
+            DecisionTree.standard_detection_probability(template['has_disease'], values['prevalenceAtBirth']))
+
+        # Sum of the manifestation probabilities of the intervention of each branch
+        manifestation_probability = values['manifestationProbability']
+        if proportion_sum is None:
+            proportion_sum = ProbabilisticAnalyzer.get_proportion_sum(template, manifestation_probability)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            branch_probability = DecisionTree.branch_probability(detection_probability, manifestation_probability,
+                                                                 proportion_sum)
+
+        detection_amount = values['detectionStrategyAmount']
+        if detection_costs is None:
+            detection_costs = (detection_amount[:, template['is_diagnosis']].max(axis=1, keepdims=True),
+                               detection_amount[:, template['is_screening']].min(axis=1, keepdims=True))
+        detection_amount = DecisionTree.detection_cost(
+            detection_amount, template['is_diagnosis'], template['detection_case'], template['has_disease'],
+            *detection_costs)
+
+        cost_years = DecisionTree.discounted_years(values['lifeExpectancy'], template['cost_rates'])
+        qaly_years = DecisionTree.discounted_years(values['lifeExpectancy'], template['effect_rates'])
+        lifetime_cost = DecisionTree.lifetime_cost(
+            branch_probability, detection_amount, values['manifestationInitialAmount'], values['followUpAmount'],
+            values['treatmentStrategyAmount'], cost_years)
+        annual_cost = DecisionTree.annual_cost(
+            branch_probability, detection_amount, values['manifestationAnnualAmount'], values['followUpAmount'],
+            values['treatmentStrategyAmount'], cost_years)
+        qaly = DecisionTree.qaly(branch_probability, qaly_years, values['populationUtilityValue'],
+                                 values['utilityValue'])
+
+        return lifetime_cost, annual_cost, qaly
+
+    @staticmethod
+    def evaluate(template, values):
+        """ Evaluates the branch formulas of the decision tree for a matrix of draws
+
+        :param template: Template of the decision tree
+        :param values: Matrix of draws of each parameter, with one column per branch
+        :return: Tuple with the lifetime cost, annual cost and QALY of each draw and strategy
+        """
+        ProbabilisticAnalyzer.check_template(template)
+        lifetime_cost, annual_cost, qaly = ProbabilisticAnalyzer.evaluate_branches(template, values)
+
+        # Branches are summed up per strategy, as in the results of the main page
+        return tuple(ProbabilisticAnalyzer.sum_groups(outcome, template['strategy_codes'], template['n_strategies'])
+                     for outcome in (lifetime_cost, annual_cost, qaly))
+
+    @staticmethod
+    def simulate(template, rng, draws):
+        """ Samples and evaluates a number of draws of the decision tree
+
+        :param template: Template of the decision tree
+        :param rng: Random generator
+        :param draws: Number of draws
+        :return: Tuple with the lifetime cost, annual cost and QALY of each draw and strategy, and the number of
+        draws in which each strategy is optimal for each threshold
+        """
+        values = dict(template['values'])
+        for parameter, (kind, relative_error, codes, means) in template['parameters'].items():
+            values[parameter] = ProbabilisticAnalyzer.sample(kind, means, relative_error, rng, draws)[:, codes]
+
+        lifetime_cost, annual_cost, qaly = ProbabilisticAnalyzer.evaluate(template, values)
+
+        # Optimal strategy of each draw, the one with the largest net monetary benefit
+        optimal_counts = np.zeros((len(template['thresholds']), lifetime_cost.shape[1]), dtype=np.int64)
+        for i, threshold in enumerate(template['thresholds']):
+            optimal = np.argmax(threshold * qaly - lifetime_cost, axis=1)
+            optimal_counts[i] = np.bincount(optimal, minlength=lifetime_cost.shape[1])
+
+        return lifetime_cost, annual_cost, qaly, optimal_counts
+
+    def get_probabilistic_analysis(self, sparql_query, draws=DEFAULT_DRAWS, chunk_size=DEFAULT_CHUNK_SIZE, seed=None,
+                                   distributions=None, thresholds=None):
+        return self.get_dataframe_probabilistic_analysis(self.get_query(sparql_query), draws, chunk_size, seed,
+                                                         distributions, thresholds)
+
+    def get_dataframe_probabilistic_analysis(self, simplified_df, draws=DEFAULT_DRAWS, chunk_size=DEFAULT_CHUNK_SIZE,
+                                             seed=None, distributions=None, thresholds=None):
+        """ Generates the probabilistic sensitivity analysis of the query dataframe
+
+        :param simplified_df: Dataframe with the minimum information to set up analysis
+        :param draws: Number of draws
+        :param chunk_size: Maximum number of draws per chunk
+        :param seed: Seed of the draws, for reproducible analyses
+        :param distributions: Distribution of each uncertain parameter, by default DEFAULT_DISTRIBUTIONS
+        :param thresholds: Willingness to pay per QALY, by default DEFAULT_THRESHOLDS
+        :return: Dataframe with the cost-effectiveness plane, with the costs and QALY of each draw and strategy
+        and their increments over the first strategy, and dataframe with the acceptability curves
+        """
+        template = self.get_template(simplified_df, distributions, thresholds)
+        strategies = template.pop('strategy_table')
+
+        # Each chunk has its own independent seed, so the draws do not depend on the number of workers
+        chunk_draws = [min(chunk_size, draws - start) for start in range(0, draws, chunk_size)]
+        chunks = list(zip(np.random.SeedSequence(seed).spawn(len(chunk_draws)), chunk_draws))
+
+        if self.max_workers == 1 or len(chunks) == 1:
+            results = [self.simulate(template, np.random.default_rng(chunk_seed), n) for chunk_seed, n in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=initialize_worker,
+                                     initargs=(template,)) as executor:
+                results = list(executor.map(simulate_chunk, chunks))
+
+        lifetime_cost, annual_cost, qaly = [np.concatenate([result[i] for result in results]) for i in range(3)]
+        optimal_counts = sum(result[3] for result in results)
+
+        return self.get_plane_dataframe(strategies, lifetime_cost, annual_cost, qaly), \
+            self.get_acceptability_dataframe(strategies, template['thresholds'], optimal_counts / draws)
+
+    def get_plane_dataframe(self, strategies, lifetime_cost, annual_cost, qaly):
+        """
+        :param strategies: Grouped parameters of each strategy
+        :param lifetime_cost: Lifetime cost of each draw and strategy
+        :param annual_cost: Annual cost of each draw and strategy
+        :param qaly: QALY of each draw and strategy
+        :return: Dataframe with one row per draw and strategy
+        """
+        draws, n_strategies = lifetime_cost.shape
+        strategy_codes = np.tile(np.arange(n_strategies), draws)
+        plane_dataframe = pd.DataFrame({'draw': np.repeat(np.arange(draws), n_strategies)})
+        for column in self.GROUPED_PARAMS:
+            plane_dataframe[column] = pd.Categorical(strategies[column].astype(str).to_numpy()[strategy_codes])
+
+        plane_dataframe['Lifetime Cost'] = lifetime_cost.ravel()
+        plane_dataframe['Annual Cost'] = annual_cost.ravel()
+        plane_dataframe['QALY'] = qaly.ravel()
+        plane_dataframe['Incremental Lifetime Cost'] = (lifetime_cost - lifetime_cost[:, :1]).ravel()
+        plane_dataframe['Incremental Annual Cost'] = (annual_cost - annual_cost[:, :1]).ravel()
+        plane_dataframe['Incremental QALY'] = (qaly - qaly[:, :1]).ravel()
+
+        return plane_dataframe
+
+    def get_acceptability_dataframe(self, strategies, thresholds, probabilities):
+        """
+        :param strategies: Grouped parameters of each strategy
+        :param thresholds: Willingness to pay per QALY
+        :param probabilities: Probability of each strategy being optimal for each threshold
+        :return: Dataframe with one row per threshold and strategy
+        """
+        acceptability_dataframe = strategies.iloc[np.tile(np.arange(len(strategies)), len(thresholds))]
+        acceptability_dataframe = acceptability_dataframe.reset_index(drop=True)
+        acceptability_dataframe.insert(0, 'Willingness To Pay', np.repeat(thresholds, len(strategies)))
+        acceptability_dataframe['Probability Cost-Effective'] = probabilities.ravel()
+
+        return acceptability_dataframe
@@ -0,0 +1,153 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+class ResultAggregator:
+    """ Aggregation layer for the branches of cost-effectiveness analyses.
+
+    Aggregates are computed by DuckDB when it is installed, directly over the branch dataframe or over the
+    Parquet and CSV files of the batch analysis without loading them, and by pandas otherwise. Each
+    aggregate is kept per analysis, grouping, measure and functions, so changing the grouping of a chart
+    only computes the measures that were not aggregated yet.
+    """
+
+    FUNCTIONS = {'count': 'COUNT', 'sum': 'SUM', 'mean': 'AVG', 'min': 'MIN', 'max': 'MAX'}
+    DEFAULT_MAX_ENTRIES = 256
+
+    def __init__(self, engine=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """ Builder overload -- Initialize ResultAggregator parameters
+
+        :param engine: 'duckdb' or 'pandas', by default DuckDB when it is installed
+        :param max_entries: Number of aggregates kept in memory
+        """
+        if engine is None:
+            engine = 'duckdb' if duckdb is not None else 'pandas'
+        if engine not in ('duckdb', 'pandas'):
+            raise Exception('Unknown aggregation engine: ' + str(engine))
+        if engine == 'duckdb' and duckdb is None:
+            raise Exception('DuckDB is not installed')
+
+        self.engine = engine
+        self.max_entries = max_entries
+        self.aggregates = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def quote(column):
+        return '"' + column.replace('"', '""') + '"'
+
+    def aggregate_duckdb(self, source, grouping, measures, functions):
+        """
+        :param source: Dataframe of branches, or Parquet or CSV file with them
+        :param grouping: Columns to group by
+        :param measures: Columns to aggregate
+        :param functions: Aggregation functions
+        :return: Dataframe with one column per grouping column and per measure and function
+        """
+        if isinstance(source, pd.DataFrame):
+            relation = 'branches'
+        elif str(source).endswith('.parquet'):
+            relation = "read_parquet('" + str(source).replace("'", "''") + "')"
+        else:
+            relation = "read_csv_auto('" + str(source).replace("'", "''") + "')"
+
+        groups = ', '.join(self.quote(column) for column in grouping)
+        aggregates = ', '.join(
+            ('COALESCE(SUM(' + self.quote(measure) + '), 0)' if function == 'sum' else
+             self.FUNCTIONS[function] + '(' + self.quote(measure) + ')') + ' AS ' +
+            self.quote(measure + '\t' + function) for measure in measures for function in functions)
+        # Rows without group are left out and groups are sorted, as pandas does
+        query = 'SELECT ' + groups + ', ' + aggregates + ' FROM ' + relation + ' WHERE ' + \
+                ' AND '.join(self.quote(column) + ' IS NOT NULL' for column in grouping) + \
+                ' GROUP BY ' + groups + ' ORDER BY ' + groups
+
+        connection = duckdb.connect()
+        try:
+            if isinstance(source, pd.DataFrame):
+                connection.register('branches', source[list(grouping) + list(measures)])
+            return connection.execute(query).fetchdf()
+        finally:
+            connection.close()
+
+    def aggregate_pandas(self, source, grouping, measures, functions):
+        if not isinstance(source, pd.DataFrame):
+            columns = list(grouping) + list(measures)
+            source = pd.read_parquet(source, columns=columns) if str(source).endswith('.parquet') \
+                else pd.read_csv(source, usecols=columns)
+
+        aggregate = source.groupby(list(grouping), observed=True).agg(
+            {measure: list(functions) for measure in measures})
+        aggregate.columns = [measure + '\t' + function for measure, function in aggregate.columns]
+
+        return aggregate.reset_index()
+
+    def get_statistics(self, key, source, grouping, measures, functions=('count', 'sum', 'mean', 'min', 'max')):
+        """ Aggregates some measures of the branches of an analysis
+
+        :param key: Key of the analysis, such as its query
+        :param source: Dataframe of branches, or Parquet or CSV file with them
+        :param grouping: Columns to group by
+        :param measures: Columns to aggregate
+        :param functions: Aggregation functions among count, sum, mean, min and max
+        :return: Dataframe indexed by the grouping, with a (measure, function) column for each aggregate
+        """
+        grouping, measures, functions = list(grouping), list(measures), tuple(functions)
+        if not grouping:
+            raise ValueError('No group keys passed!')
+        unknown_functions = set(functions) - set(self.FUNCTIONS)
+        if unknown_functions:
+            raise Exception('Unknown aggregation functions: ' + ', '.join(sorted(unknown_functions)))
+        if isinstance(source, (str, Path)):
+            key = (key, str(source))
+
+        keys = {measure: (key, tuple(grouping), measure, functions) for measure in measures}
+        with self.lock:
+            missing = [measure for measure in measures if keys[measure] not in self.aggregates]
+
+        if missing:
+            aggregate_function = self.aggregate_duckdb if self.engine == 'duckdb' else self.aggregate_pandas
+            aggregate = aggregate_function(source, grouping, missing, functions).set_index(grouping)
+            with self.lock:
+                for measure in missing:
+                    measure_aggregate = aggregate[[measure + '\t' + function for function in functions]]
+                    measure_aggregate.columns = pd.MultiIndex.from_product([[measure], list(functions)])
+                    self.aggregates[keys[measure]] = measure_aggregate
+                while len(self.aggregates) > self.max_entries:
+                    self.aggregates.popitem(last=False)
+
+        with self.lock:
+            for measure in measures:
+                self.aggregates.move_to_end(keys[measure])
+            aggregates = [self.aggregates[keys[measure]] for measure in measures]
+
+        return pd.concat(aggregates, axis=1)
+
+    def get_results(self, key, source, grouping, measures):
+        """
+        :param key: Key of the analysis, such as its query
+        :param source: Dataframe of branches, or Parquet or CSV file with them
+        :param grouping: Columns to group by
+        :param measures: Columns to add up
+        :return: Dataframe with the grouping columns and the sum of each measure
+        """
+        results = self.get_statistics(key, source, grouping, measures, ('sum',))
+        results.columns = results.columns.get_level_values(0)
+
+        return results.reset_index()
+
+    def invalidate(self, key=None):
+        """
+        :param key: Key of the analysis whose aggregates are removed, None to remove all of them
+        """
+        with self.lock:
+            for aggregate_key in list(self.aggregates):
+                if key is None or aggregate_key[0] == key or \
+                        (isinstance(aggregate_key[0], tuple) and aggregate_key[0][0] == key):
+                    del self.aggregates[aggregate_key]
@@ -0,0 +1,193 @@
+import itertools
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class ResultExporter:
+    """ Export layer for the dataframes of cost-effectiveness analyses.
+
+    Dataframes are serialized in chunks of rows, as CSV, Parquet or Arrow IPC, so only one chunk is converted
+    at a time instead of the whole table as a string and then as bytes. The serialized files are kept per
+    analysis and format, and are only produced when they are requested, so the reruns of the page do not
+    serialize anything.
+    """
+
+    # Media type and extension of each format
+    FORMATS = {'csv': ('text/csv', '.csv'),
+               'parquet': ('application/vnd.apache.parquet', '.parquet'),
+               'arrow': ('application/vnd.apache.arrow.file', '.arrow')}
+    DEFAULT_CHUNK_ROWS = 2 ** 16
+    DEFAULT_COMPRESSION = 'zstd'
+    DEFAULT_MAX_BYTES = 256 * 2 ** 20
+
+    def __init__(self, chunk_rows=DEFAULT_CHUNK_ROWS, compression=DEFAULT_COMPRESSION, max_bytes=DEFAULT_MAX_BYTES):
+        """ Builder overload -- Initialize ResultExporter parameters
+
+        :param chunk_rows: Number of rows serialized at once
+        :param compression: Compression of the Parquet and Arrow IPC files, None to leave them uncompressed
+        :param max_bytes: Size of the serialized files kept in memory
+        """
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_format(path):
+        """
+        :param path: Output file
+        :return: Format of the file according to its extension, CSV by default
+        """
+        suffix = Path(path).suffix.lower()
+        for file_format, (_, extension) in ResultExporter.FORMATS.items():
+            if suffix == extension or (file_format == 'arrow' and suffix in ('.feather', '.ipc')):
+                return file_format
+
+        return 'csv'
+
+    def iter_chunks(self, dataframe):
+        """
+        :param dataframe: Dataframe to export
+        :return: Generator of consecutive slices of the dataframe
+        """
+        for start in range(0, max(len(dataframe), 1), self.chunk_rows):
+            yield dataframe.iloc[start:start + self.chunk_rows]
+
+    def iter_batches(self, dataframe):
+        """
+        :param dataframe: Dataframe to export
+        :return: Generator of Arrow record batches, one chunk of rows at a time
+        """
+        # Types are those of the whole dataframe, a column without values in the first chunk is not null typed
+        schema = pa.Schema.from_pandas(dataframe, preserve_index=False)
+        for chunk in self.iter_chunks(dataframe):
+            yield pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False)
+
+    @staticmethod
+    def iter_cast_batches(dataframes):
+        """ Converts dataframes that do not share their categoricals, such as the analyses of a batch, to record
+        batches of a single schema: categoricals are written as their values, columns without any value as
+        strings, and every batch is cast to the types of the first one
+
+        :param dataframes: Dataframes with the same columns
+        :return: Generator of Arrow record batches, one per dataframe
+        """
+        schema = None
+        for dataframe in dataframes:
+            batch = pa.RecordBatch.from_pandas(dataframe, preserve_index=False)
+            columns = [column.dictionary_decode() if pa.types.is_dictionary(column.type) else column
+                       for column in batch.columns]
+            if schema is None:
+                schema = pa.schema([pa.field(name, pa.string() if pa.types.is_null(column.type) else column.type)
+                                    for name, column in zip(batch.schema.names, columns)])
+            if batch.schema.names != schema.names:
+                raise Exception('The columns of the chunks to export differ')
+
+            yield pa.RecordBatch.from_arrays([column.cast(field.type) for column, field in zip(columns, schema)],
+                                             schema=schema)
+
+    def write(self, dataframe, destination, file_format=None):
+        """ Writes a dataframe chunk by chunk
+
+        :param dataframe: Dataframe to export
+        :param destination: Output file or binary file object
+        :param file_format: 'csv', 'parquet' or 'arrow', by default according to the extension of the file
+        """
+        # The chunks share the categoricals and the schema of the whole dataframe
+        self.write_batches(self.iter_chunks(dataframe), self.iter_batches(dataframe), destination, file_format)
+
+    def write_chunks(self, dataframes, destination, file_format=None):
+        """ Writes a sequence of dataframes with the same columns as a single file, one dataframe at a time
+
+        :param dataframes: Iterable of dataframes, such as a generator of the analyses of a batch
+        :param destination: Output file or binary file object
+        :param file_format: 'csv', 'parquet' or 'arrow', by default according to the extension of the file
+        """
+        dataframes = iter(dataframes)
+        first = next(dataframes, None)
+        if first is None:
+            return self.write(pd.DataFrame(), destination, file_format)
+
+        # Columnar formats need the record batches and CSV needs the dataframes, only one of them is consumed
+        chunks = itertools.chain([first], dataframes)
+        self.write_batches(chunks, self.iter_cast_batches(chunks), destination, file_format)
+
+    def write_batches(self, chunks, batches, destination, file_format=None):
+        """
+        :param chunks: Iterable of the dataframes of the file, written as CSV
+        :param batches: Iterable of the same chunks as Arrow record batches, written as Parquet or Arrow IPC
+        :param destination: Output file or binary file object
+        :param file_format: 'csv', 'parquet' or 'arrow', by default according to the extension of the file
+        """
+        if file_format is None:
+            file_format = self.get_format(destination) if isinstance(destination, (str, Path)) else 'csv'
+        if file_format not in self.FORMATS:
+            raise Exception('Unknown export format: ' + str(file_format))
+
+        sink = open(destination, 'wb') if isinstance(destination, (str, Path)) else destination
+        try:
+            if file_format == 'csv':
+                for position, chunk in enumerate(chunks):
+                    sink.write(chunk.to_csv(index=False, header=position == 0).encode('utf-8'))
+                return
+
+            batches = iter(batches)
+            first_batch = next(batches)
+            if file_format == 'parquet':
+                writer = pq.ParquetWriter(sink, first_batch.schema, compression=self.compression or 'none')
+                write_batch = lambda batch: writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer = pa.ipc.new_file(sink, first_batch.schema,
+                                         options=pa.ipc.IpcWriteOptions(compression=self.compression))
+                write_batch = writer.write_batch
+            with writer:
+                write_batch(first_batch)
+                for batch in batches:
+                    write_batch(batch)
+        finally:
+            if sink is not destination:
+                sink.close()
+
+    def get_bytes(self, key, dataframe, file_format='csv'):
+        """ Serializes a dataframe the first time it is requested for an analysis and format
+
+        :param key: Key of the analysis, such as its query
+        :param dataframe: Dataframe to export
+        :param file_format: 'csv', 'parquet' or 'arrow'
+        :return: Bytes of the file
+        """
+        file_key = (key, file_format)
+        with self.lock:
+            if file_key in self.files:
+                self.files.move_to_end(file_key)
+                return self.files[file_key]
+
+        # Chunks are spooled to disk and read back in a single allocation of the size of the file, instead of
+        # growing a buffer in memory
+        with tempfile.TemporaryFile() as sink:
+            self.write(dataframe, sink, file_format)
+            sink.seek(0)
+            data = sink.read()
+
+        with self.lock:
+            self.files[file_key] = data
+            # The least recently used files are dropped, but the last one is always kept
+            while len(self.files) > 1 and sum(len(value) for value in self.files.values()) > self.max_bytes:
+                self.files.popitem(last=False)
+
+        return data
+
+    def invalidate(self, key=None):
+        """
+        :param key: Key of the analysis whose files are removed, None to remove all of them
+        """
+        with self.lock:
+            for file_key in list(self.files):
+                if key is None or file_key[0] == key:
+                    del self.files[file_key]
@@ -0,0 +1,267 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from analyzer.ProbabilisticAnalyzer import ProbabilisticAnalyzer
+
+# Decision tree template of each worker process of the pool
+worker_template = None
+
+
+def initialize_worker(template):
+    global worker_template
+    worker_template = template
+
+
+def sweep_parameter(sweep):
+    """ Evaluates the sweep of a parameter in a worker process
+
+    :param sweep: Tuple with the parameter, its range and the number of points
+    :return: Dataframe with the results of each point of the sweep
+    """
+    return SensitivityAnalyzer.sweep(worker_template, *sweep)
+
+
+class SensitivityAnalyzer(ProbabilisticAnalyzer):
+    """ Class for the deterministic one-way sensitivity analysis of the StaDiOS decision tree.
+
+    The query is run and the branches of the tree are generated once, as in the probabilistic analysis, and
+    kept as a template of arrays with the outcomes of each branch at the point estimates. Each parameter of
+    each entity is then varied across its range while the rest keep their point estimates, and only the
+    branches that depend on the entity are evaluated, as a (points, branches) matrix whose change is added to
+    the base outcomes of each strategy. The sweeps of the parameters are spread across a process pool and
+    summed up into the data of a tornado diagram.
+    """
+
+    # Column whose value identifies the parameter in each branch
+    SWEEP_ENTITIES = {'sensitivity': 'detectionStrategy',
+                      'specificity': 'detectionStrategy',
+                      'prevalenceAtBirth': 'disease',
+                      'manifestationProbability': 'manifestation',
+                      'utilityValue': 'manifestation',
+                      'populationUtilityValue': 'intervention',
+                      'lifeExpectancy': 'intervention',
+                      'detectionStrategyAmount': 'detectionStrategy',
+                      'manifestationInitialAmount': 'manifestation',
+                      'manifestationAnnualAmount': 'manifestation',
+                      'followUpAmount': 'followUpStrategy',
+                      'treatmentStrategyAmount': 'treatmentStrategy'}
+    # Parameters whose values are bounded between 0 and 1
+    BOUNDED_PARAMS = ['sensitivity', 'specificity', 'prevalenceAtBirth', 'manifestationProbability', 'utilityValue',
+                      'populationUtilityValue']
+    # Relative variation of every parameter around its point estimate
+    DEFAULT_RANGE = 0.2
+    DEFAULT_POINTS = 11
+    # Willingness to pay per QALY of the net monetary benefit
+    DEFAULT_THRESHOLD = 25000
+    OUTCOME_COLUMNS = ['Lifetime Cost', 'Annual Cost', 'QALY', 'Net Monetary Benefit']
+    # Arrays of the template with one value per branch, which the evaluation of some branches needs
+    BRANCH_ARRAYS = ['cost_rates', 'effect_rates', 'detection_case', 'has_disease', 'is_diagnosis', 'is_screening',
+                     'intervention_codes']
+
+    def get_sweep_template(self, simplified_df, threshold=DEFAULT_THRESHOLD):
+        """ Generates the branches of the decision tree once for every sweep
+
+        :param simplified_df: Dataframe with the minimum information to set up analysis
+        :param threshold: Willingness to pay per QALY of the net monetary benefit
+        :return: Dictionary with the arrays of the template and the strategies of the analysis
+        """
+        # Fixed distributions keep the distinct values of each parameter without sampling them
+        template = self.get_template(simplified_df, {parameter: ('fixed', entity_column, 0.0)
+                                                     for parameter, entity_column in self.SWEEP_ENTITIES.items()},
+                                     [threshold])
+        template['strategy_labels'] = template['strategy_table'].astype(str).agg(' / '.join, axis=1).to_numpy()
+
+        # Only the values of the query are swept, not those the simulation sets for the branches it adds
+        query_dataframe = self.deflate_dataframe_costs(simplified_df.copy())
+        template['swept'] = dict()
+        for parameter, entity_column in self.SWEEP_ENTITIES.items():
+            query_values = pd.MultiIndex.from_arrays([query_dataframe[entity_column].astype(str),
+                                                      query_dataframe[parameter].astype(float)])
+            branch_values = pd.MultiIndex.from_arrays([template['entities'][parameter],
+                                                       template['parameters'][parameter][3]])
+            template['swept'][parameter] = np.flatnonzero(branch_values.isin(query_values))
+
+        # Outcomes of each branch at the point estimates, to which each sweep adds the change of its branches
+        self.check_template(template)
+        values = {parameter: value[None, :] for parameter, value in self.get_base_values(template).items()}
+        detection_amount = values['detectionStrategyAmount']
+        template['proportion_sum'] = self.get_proportion_sum(template, values['manifestationProbability'])
+        template['detection_costs'] = (detection_amount[:, template['is_diagnosis']].max(axis=1, keepdims=True),
+                                       detection_amount[:, template['is_screening']].min(axis=1, keepdims=True))
+        template['base_branches'] = np.stack(self.evaluate_branches(template, values, template['proportion_sum'],
+                                                                    template['detection_costs']), axis=2)[0]
+
+        return template
+
+    @staticmethod
+    def get_base_values(template):
+        """
+        :param template: Template of the decision tree
+        :return: Point estimate of each parameter for each branch
+        """
+        values = dict(template['values'])
+        for parameter, (_, _, codes, means) in template['parameters'].items():
+            values[parameter] = means[codes]
+
+        return values
+
+    @staticmethod
+    def evaluate_values(template, values, rows):
+        """ Evaluates the decision tree for several rows of parameter values
+
+        :param template: Template of the decision tree
+        :param values: Values of each parameter, with one column per branch and one row per evaluation or a
+        single row shared by all of them
+        :param rows: Number of evaluations
+        :return: Array of shape (rows, strategies, outcomes) with the outcomes of each strategy
+        """
+        branches = len(template['is_diagnosis'])
+        values = {parameter: np.broadcast_to(value, (rows, branches)) for parameter, value in values.items()}
+        lifetime_cost, annual_cost, qaly = ProbabilisticAnalyzer.evaluate(template, values)
+
+        return np.stack([lifetime_cost, annual_cost, qaly, template['thresholds'][0] * qaly - lifetime_cost],
+                        axis=2)
+
+    @staticmethod
+    def get_swept_rows(template, parameter, selected):
+        """
+        :param template: Template of the decision tree
+        :param parameter: Swept parameter
+        :param selected: Whether each branch has the swept entity
+        :return: Position of the branches whose outcomes depend on the swept entity
+        """
+        if parameter == 'detectionStrategyAmount':
+            # Every branch pays the complementary tests, whose costs are those of the detection strategies
+            return np.arange(len(selected))
+        if parameter == 'manifestationProbability':
+            # Probabilities are normalized over the whole intervention
+            interventions = template['intervention_codes']
+            return np.flatnonzero(np.isin(interventions, interventions[selected]))
+
+        return np.flatnonzero(selected)
+
+    @staticmethod
+    def sweep(template, parameter, value_range, points):
+        """ Varies a parameter of each of its entities across its range, keeping the rest at their point
+        estimates, and evaluates every point of the sweep at once
+
+        :param template: Template of the decision tree
+        :param parameter: Swept parameter
+        :param value_range: Pair with the lowest and highest value relative to the point estimate
+        :param points: Number of points of the sweep of each entity
+        :return: Dataframe with the outcomes of each strategy for each point of the sweep
+        """
+        _, _, codes, means = template['parameters'][parameter]
+        entities = template['swept'][parameter]
+        low, high = means[entities] * value_range[0], means[entities] * value_range[1]
+        if parameter in SensitivityAnalyzer.BOUNDED_PARAMS:
+            low, high = np.clip(low, 0, 1), np.clip(high, 0, 1)
+
+        swept_values = np.linspace(low, high, points).T
+        base_values = SensitivityAnalyzer.get_base_values(template)
+        base_branches = template['base_branches']
+        strategy_codes, n_strategies = template['strategy_codes'], template['n_strategies']
+        base_outcomes = SensitivityAnalyzer.sum_groups(base_branches.T, strategy_codes, n_strategies)
+        outcomes = np.empty((len(entities), points, base_outcomes.shape[1], len(SensitivityAnalyzer.OUTCOME_COLUMNS)))
+        for position, entity in enumerate(entities):
+            # Point estimates of the branches that depend on the entity, replacing those of the entity in each row
+            selected = codes == entity
+            rows = SensitivityAnalyzer.get_swept_rows(template, parameter, selected)
+            values = {name: np.broadcast_to(value[rows], (points, len(rows))) for name, value in base_values.items()}
+            values[parameter] = np.where(selected[rows], swept_values[position][:, None], base_values[parameter][rows])
+
+            # The sums and test costs shared with other branches only change when the swept parameter is theirs
+            branch_template = {name: template[name][rows] for name in SensitivityAnalyzer.BRANCH_ARRAYS}
+            branches = np.stack(SensitivityAnalyzer.evaluate_branches(
+                branch_template, values,
+                None if parameter == 'manifestationProbability' else template['proportion_sum'][:, rows],
+                None if parameter == 'detectionStrategyAmount' else template['detection_costs']), axis=2)
+            changes = SensitivityAnalyzer.sum_groups(np.swapaxes(branches - base_branches[rows], 1, 2),
+                                                     strategy_codes[rows], n_strategies)
+            outcomes[position, :, :, :3] = np.swapaxes(base_outcomes + changes, 1, 2)
+        outcomes[:, :, :, 3] = template['thresholds'][0] * outcomes[:, :, :, 2] - outcomes[:, :, :, 0]
+        outcomes = outcomes.reshape(-1, outcomes.shape[2], outcomes.shape[3])
+
+        swept_values = swept_values.ravel()
+        swept_entities = np.repeat(entities, points)
+        strategies = len(template['strategy_labels'])
+        sweep_dataframe = pd.DataFrame({
+            'parameter': parameter,
+            'entity': np.repeat(template['entities'][parameter][swept_entities], strategies),
+            'Base Value': np.repeat(means[swept_entities], strategies),
+            'Value': np.repeat(swept_values, strategies),
+            'strategy': np.tile(template['strategy_labels'], len(swept_values))})
+        for position, column in enumerate(SensitivityAnalyzer.OUTCOME_COLUMNS):
+            sweep_dataframe[column] = outcomes[:, :, position].ravel()
+
+        return sweep_dataframe
+
+    def get_sweep_analysis(self, sparql_query, parameters=None, ranges=None, points=DEFAULT_POINTS,
+                           threshold=DEFAULT_THRESHOLD):
+        return self.get_dataframe_sweep_analysis(self.get_query(sparql_query), parameters, ranges, points, threshold)
+
+    def get_dataframe_sweep_analysis(self, simplified_df, parameters=None, ranges=None, points=DEFAULT_POINTS,
+                                     threshold=DEFAULT_THRESHOLD):
+        """ Generates the one-way sensitivity analysis of the query dataframe
+
+        :param simplified_df: Dataframe with the minimum information to set up analysis
+        :param parameters: Swept parameters, by default every parameter of SWEEP_ENTITIES
+        :param ranges: Lowest and highest value of each parameter relative to its point estimate, by default
+        DEFAULT_RANGE around it
+        :param points: Number of points of the sweep of each entity
+        :param threshold: Willingness to pay per QALY of the net monetary benefit
+        :return: Dataframe with the outcomes of each strategy for each point of every sweep, and dataframe with
+        the base outcomes of each strategy
+        """
+        parameters = list(self.SWEEP_ENTITIES) if parameters is None else list(parameters)
+        unknown = [parameter for parameter in parameters if parameter not in self.SWEEP_ENTITIES]
+        if unknown:
+            raise Exception('Parameters without sweep: ' + ', '.join(map(str, unknown)))
+        if points < 2:
+            raise Exception('A sweep needs at least 2 points')
+        ranges = dict() if ranges is None else ranges
+
+        template = self.get_sweep_template(simplified_df, threshold)
+        template.pop('strategy_table')
+        sweeps = [(parameter, ranges.get(parameter, (1 - self.DEFAULT_RANGE, 1 + self.DEFAULT_RANGE)), points)
+                  for parameter in parameters]
+
+        if self.max_workers == 1 or len(sweeps) == 1:
+            results = [self.sweep(template, *sweep) for sweep in sweeps]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=initialize_worker,
+                                     initargs=(template,)) as executor:
+                results = list(executor.map(sweep_parameter, sweeps))
+
+        base_outcomes = self.evaluate_values(template, self.get_base_values(template), 1)[0]
+        base_dataframe = pd.DataFrame(base_outcomes, columns=self.OUTCOME_COLUMNS)
+        base_dataframe.insert(0, 'strategy', template['strategy_labels'])
+
+        return pd.concat(results, ignore_index=True), base_dataframe
+
+    @staticmethod
+    def get_tornado_dataframe(sweep_dataframe, base_dataframe, outcome='Net Monetary Benefit'):
+        """
+        :param sweep_dataframe: Outcomes of each strategy for each point of every sweep
+        :param base_dataframe: Base outcomes of each strategy
+        :param outcome: Outcome of the diagram
+        :return: Dataframe with one bar per strategy, parameter and entity, with the outcome at the lowest and
+        highest value of the parameter, sorted by strategy and decreasing swing
+        """
+        if outcome not in SensitivityAnalyzer.OUTCOME_COLUMNS:
+            raise Exception('Unknown outcome: ' + str(outcome))
+
+        # Entities whose branches have several point estimates have one bar per point estimate
+        bars = sweep_dataframe.groupby(['strategy', 'parameter', 'entity', 'Base Value'], sort=False)
+        tornado_dataframe = bars.agg(**{'Low Value': ('Value', 'first'),
+                                        'High Value': ('Value', 'last'), 'Low Outcome': (outcome, 'first'),
+                                        'High Outcome': (outcome, 'last'), 'Minimum Outcome': (outcome, 'min'),
+                                        'Maximum Outcome': (outcome, 'max')}).reset_index()
+        tornado_dataframe['Base Outcome'] = tornado_dataframe['strategy'].map(
+            base_dataframe.set_index('strategy')[outcome])
+        tornado_dataframe['Swing'] = tornado_dataframe['Maximum Outcome'] - tornado_dataframe['Minimum Outcome']
+
+        strategy_order = pd.Categorical(tornado_dataframe['strategy'], categories=base_dataframe['strategy'])
+        order = np.lexsort((-tornado_dataframe['Swing'].to_numpy(), strategy_order.codes))
+
+        return tornado_dataframe.iloc[order].reset_index(drop=True)
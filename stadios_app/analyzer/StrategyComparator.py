@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
+
+
+class StrategyComparator:
+    """ Class for the comparison of every intervention and strategy alternative of the StaDiOS ontology.
+
+    A single query returns every alternative of the selection, each partition of its result is analyzed as
+    in the main page and the alternatives of each disease, development and study are ranked together: strict
+    dominance with a running maximum over the strategies sorted by cost, extended dominance with a convex
+    hull over the rest, and the incremental cost-effectiveness ratio of each strategy of the efficiency
+    frontier against the previous one.
+    """
+
+    PARTITION_COLUMNS = ['disease', 'development', 'followUpStrategy', 'treatmentStrategy', 'studyIdentifier']
+    GROUP_COLUMNS = ['disease', 'development', 'studyIdentifier']
+    STRATEGY_COLUMNS = ['interventionKind', 'detectionStrategy', 'treatmentStrategy', 'followUpStrategy']
+    RESULT_COLUMNS = ['Branch Lifetime Cost', 'Branch Annual Cost', 'Branch QALY']
+
+    def __init__(self, analyzer=None):
+        """ Builder overload -- Initialize StrategyComparator parameters
+
+        :param analyzer: Cost-effectiveness analyzer of each partition, a new one by default
+        """
+        self.analyzer = analyzer if analyzer is not None else CostEffectivenessAnalyzer()
+
+    def get_strategy_dataframe(self, simplified_df):
+        """ Analyzes every partition of a query result and adds up the branches of each strategy
+
+        :param simplified_df: Result of the cost-effectiveness query for several alternatives
+        :return: Dataframe with the costs and QALY of each strategy and dataframe with the partitions
+        that could not be analyzed
+        """
+        analyses = list()
+        failures = list()
+        for key, partition in simplified_df.groupby(self.PARTITION_COLUMNS, sort=False, observed=True):
+            try:
+                ce_dataframe = self.analyzer.get_dataframe_analysis(partition.reset_index(drop=True))
+            except Exception as error:
+                failures.append(dict(zip(self.PARTITION_COLUMNS, key), error=repr(error)))
+                continue
+            ce_dataframe.insert(0, 'studyIdentifier', key[-1])
+            analyses.append(ce_dataframe)
+
+        failures = pd.DataFrame(failures, columns=self.PARTITION_COLUMNS + ['error'])
+        if not analyses:
+            return pd.DataFrame(columns=self.GROUP_COLUMNS + self.STRATEGY_COLUMNS + self.RESULT_COLUMNS), failures
+
+        ce_dataframe = pd.concat(analyses, ignore_index=True)
+        ce_dataframe['studyIdentifier'] = ce_dataframe['studyIdentifier'].astype('category')
+        strategy_dataframe = ce_dataframe.groupby(self.GROUP_COLUMNS + self.STRATEGY_COLUMNS, as_index=False,
+                                                  observed=True)[self.RESULT_COLUMNS].sum()
+
+        return strategy_dataframe, failures
+
+    @staticmethod
+    def get_frontier(costs, effects, groups):
+        """ Efficiency frontier of each group of strategies with a monotone convex hull. The strategies must be
+        sorted by group and cost and not be strictly dominated, so their effects grow with their costs.
+
+        :param costs: Costs of the strategies
+        :param effects: Effects of the strategies
+        :param groups: Group code of each strategy
+        :return: Mask of the strategies in the frontier
+        """
+        frontier = np.zeros(len(costs), dtype=bool)
+        hull = list()
+        for position in range(len(costs)):
+            if hull and groups[hull[-1]] != groups[position]:
+                frontier[hull] = True
+                hull = list()
+
+            # The last strategy is extendedly dominated if its ICER is higher than that of the next one
+            while len(hull) >= 2 and \
+                    (costs[hull[-1]] - costs[hull[-2]]) * (effects[position] - effects[hull[-1]]) > \
+                    (costs[position] - costs[hull[-1]]) * (effects[hull[-1]] - effects[hull[-2]]):
+                hull.pop()
+            hull.append(position)
+        frontier[hull] = True
+
+        return frontier
+
+    @staticmethod
+    def compare(strategy_dataframe, group_columns, cost_column='Branch Lifetime Cost', effect_column='Branch QALY'):
+        """ Ranks the strategies of each group by dominance and calculates their ICERs
+
+        :param strategy_dataframe: Dataframe with the cost and effect of each strategy
+        :param group_columns: Columns of the groups whose strategies are compared, none to compare all of them
+        :param cost_column: Column with the cost of each strategy
+        :param effect_column: Column with the effect of each strategy
+        :return: Dataframe sorted by group and cost, with the dominance of each strategy and, for the strategies
+        of the efficiency frontier, their incremental cost, effect and ICER against the previous one
+        """
+        group_columns = list(group_columns)
+        dataframe = strategy_dataframe.reset_index(drop=True)
+        groups = dataframe.groupby(group_columns, sort=False, observed=True).ngroup().to_numpy() \
+            if group_columns else np.zeros(len(dataframe), dtype=np.int64)
+        costs = dataframe[cost_column].to_numpy(dtype=np.float64)
+        effects = dataframe[effect_column].to_numpy(dtype=np.float64)
+
+        # Sorted by group, increasing cost and decreasing effect
+        order = np.lexsort((-effects, costs, groups))
+        dataframe = dataframe.iloc[order].reset_index(drop=True)
+        groups, costs, effects = groups[order], costs[order], effects[order]
+
+        # Repeated strategies share the status of their first occurrence
+        repeated = np.zeros(len(dataframe), dtype=bool)
+        repeated[1:] = (groups[1:] == groups[:-1]) & (costs[1:] == costs[:-1]) & (effects[1:] == effects[:-1])
+        first = np.maximum.accumulate(np.where(repeated, 0, np.arange(len(dataframe))))
+
+        # A strategy is strictly dominated if a cheaper or equal one, other than itself, is at least as effective
+        unique = ~repeated
+        unique_groups, unique_effects = groups[unique], effects[unique]
+        previous_effect = pd.Series(unique_effects).groupby(unique_groups).cummax().groupby(unique_groups).shift()
+        unique_dominated = (previous_effect.to_numpy() >= unique_effects)
+
+        unique_positions = np.flatnonzero(unique)
+        candidates = unique_positions[~unique_dominated]
+        unique_frontier = StrategyComparator.get_frontier(costs[candidates], effects[candidates], groups[candidates])
+
+        dominance = np.full(len(unique_positions), 'Extendedly dominated', dtype=object)
+        dominance[unique_dominated] = 'Strictly dominated'
+        dominance[np.flatnonzero(~unique_dominated)[unique_frontier]] = 'Frontier'
+        status = pd.Series(dominance, index=unique_positions).reindex(first).to_numpy()
+
+        # ICER of each frontier strategy against the previous strategy of the frontier of its group
+        frontier = candidates[unique_frontier]
+        incremental_cost = np.full(len(dataframe), np.nan)
+        incremental_effect = np.full(len(dataframe), np.nan)
+        follows = np.zeros(len(frontier), dtype=bool)
+        follows[1:] = groups[frontier[1:]] == groups[frontier[:-1]]
+        incremental_cost[frontier[follows]] = costs[frontier[follows]] - costs[frontier[:-1][follows[1:]]]
+        incremental_effect[frontier[follows]] = effects[frontier[follows]] - effects[frontier[:-1][follows[1:]]]
+        incremental_cost = pd.Series(incremental_cost).reindex(first).to_numpy()
+        incremental_effect = pd.Series(incremental_effect).reindex(first).to_numpy()
+
+        dataframe['Dominance'] = status
+        dataframe['Incremental Cost'] = incremental_cost
+        dataframe['Incremental QALY'] = incremental_effect
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dataframe['ICER'] = incremental_cost / incremental_effect
+
+        return dataframe
+
+    def get_dataframe_comparison(self, simplified_df, cost_column='Branch Lifetime Cost'):
+        """
+        :param simplified_df: Result of the cost-effectiveness query for several alternatives
+        :param cost_column: Column with the cost of each strategy
+        :return: Comparison of the strategies of each disease, development and study, and dataframe with the
+        partitions that could not be analyzed
+        """
+        strategy_dataframe, failures = self.get_strategy_dataframe(simplified_df)
+
+        return self.compare(strategy_dataframe, self.GROUP_COLUMNS, cost_column), failures
+
+    def get_comparison(self, cost_column='Branch Lifetime Cost', **bindings):
+        """ Compares every alternative of a selection with a single query
+
+        :param cost_column: Column with the cost of each strategy
+        :param bindings: Value or list of values of the variables of the cost-effectiveness query, such as the
+        disease, none to compare the whole ontology
+        :return: Comparison of the strategies of each disease, development and study, and dataframe with the
+        partitions that could not be analyzed
+        """
+        sparql_query = self.analyzer.query_registry.bind('cost_effectiveness_query', **bindings)
+
+        return self.get_dataframe_comparison(self.analyzer.get_query(sparql_query), cost_column)
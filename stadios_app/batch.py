@@ -0,0 +1,37 @@
+import argparse
+from analyzer.BatchAnalyzer import BatchAnalyzer
+from sparql.QueryBackend import QueryBackend
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='StaDiOS - Batch cost-effectiveness analysis of the whole ontology')
+    parser.add_argument('--output', default='ce_batch_analysis.parquet',
+                        help='File for the branches of every analysis (.parquet, .arrow or .csv)')
+    parser.add_argument('--results', default='ce_batch_results.csv',
+                        help='File for the grouped results of every analysis (.parquet, .arrow or .csv)')
+    parser.add_argument('--failures', default='ce_batch_failures.csv',
+                        help='File for the partitions without enough information to be analyzed')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--page-rows', type=int, default=QueryBackend.DEFAULT_PAGE_ROWS,
+                        help='Rows of each page of the streamed query, 0 to load the whole result at once')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    batch_analyzer = BatchAnalyzer(arguments.workers)
+
+    if arguments.page_rows > 0:
+        # Analyses are written as they finish, so memory does not grow with the size of the ontology
+        branches, failed = batch_analyzer.write_batch_analysis(arguments.output, arguments.results,
+                                                               arguments.failures, arguments.page_rows)
+    else:
+        batch_dataframe, failures = batch_analyzer.get_batch_analysis()
+
+        batch_analyzer.write_dataframe(batch_dataframe, arguments.output)
+        batch_analyzer.write_dataframe(batch_analyzer.get_batch_results(batch_dataframe), arguments.results)
+        batch_analyzer.write_dataframe(failures, arguments.failures)
+        branches, failed = batch_dataframe.shape[0], failures.shape[0]
+
+    print(str(branches) + ' branches analyzed, ' + str(failed) + ' partitions failed')
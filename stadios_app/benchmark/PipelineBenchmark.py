@@ -0,0 +1,166 @@
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
+from benchmark.SyntheticOntology import SyntheticOntology
+from sparql.CoordinateIndex import CoordinateIndex
+from sparql.QueryBackend import LocalQueryBackend
+from sparql.ResultDecoder import ResultDecoder
+from sparql.SparqlManager import SparqlManager
+
+
+class PipelineBenchmark:
+    """ Offline benchmark of the stages of the cost-effectiveness pipeline over synthetic ontologies.
+
+    Each stage is timed on its own input, prepared beforehand by the previous stages, and reports its median
+    latency over several repeats and the peak memory allocated by one extra run.
+    """
+
+    REFERENCE_PATH = '../cost_effectiveness_analysis/simulation_results/decision_tree_simulation_result.csv'
+    REFERENCE_BINDINGS = {'disease': 'PBD_ProfoundBiotinidaseDeficiency', 'development': 'PBD_NaturalDevelopment',
+                          'followUpStrategy': 'PBD_FollowUpStrategy', 'treatmentStrategy': 'PBD_BiotinTreatmentStrategy',
+                          'studyIdentifier': 'PBD_001'}
+    EMPTY_BINDINGS = dict(REFERENCE_BINDINGS, studyIdentifier='PBD_002')
+    GROUPED_PARAMS = ['interventionKind', 'detectionStrategy', 'treatmentStrategy', 'followUpStrategy']
+    RESULT_COLUMNS = ['Branch Lifetime Cost', 'Branch Annual Cost', 'Branch QALY']
+
+    def __init__(self, repeats=5):
+        """ Builder overload -- Initialize PipelineBenchmark parameters
+
+        :param repeats: Number of timed runs of each stage
+        """
+        self.repeats = repeats
+        self.analyzer = CostEffectivenessAnalyzer()
+        self.query_template = self.analyzer.query_registry.get('cost_effectiveness_query')
+
+    def measure(self, function, *arguments):
+        """
+        :param function: Stage to measure, whose arguments are copied before each run if they are dataframes
+        :param arguments: Arguments of the stage
+        :return: Median seconds, peak memory in MB and result of the stage
+        """
+        def run():
+            return function(*[argument.copy() if isinstance(argument, pd.DataFrame) else argument
+                              for argument in arguments])
+
+        seconds = list()
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            result = run()
+            seconds.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+        return float(np.median(seconds)), peak_memory, result
+
+    @staticmethod
+    def load_ontology(ontology_path):
+        """ Graphs are kept per process, so they are dropped to measure the parsing every time
+
+        :param ontology_path: OWL file
+        :return: Local backend of the ontology
+        """
+        with LocalQueryBackend.graphs_lock:
+            LocalQueryBackend.graphs.clear()
+
+        return LocalQueryBackend(ontology_path, None)
+
+    def run_stages(self, synthetic_ontology, ontology_path=None):
+        """ Measures every stage of the pipeline over a synthetic ontology
+
+        :param synthetic_ontology: Synthetic ontology
+        :param ontology_path: OWL file to write the ontology and measure the local query too, None to skip it
+        :return: List of dictionaries with the stage, its input rows, seconds and peak memory
+        """
+        stages = list()
+
+        def add_stage(stage, rows, function, *arguments):
+            seconds, peak_memory, result = self.measure(function, *arguments)
+            stages.append({'stage': stage, 'rows': rows, 'seconds': seconds, 'peakMemoryMB': peak_memory})
+            return result
+
+        if ontology_path is not None:
+            synthetic_ontology.write_ontology(ontology_path)
+            backend = add_stage('load ontology', None, self.load_ontology, ontology_path)
+            result = add_stage('query', None, backend.query, self.query_template.bind())
+            if len(result['results']['bindings']) != len(synthetic_ontology.get_dataframe()):
+                raise Exception('The synthetic ontology does not answer the synthetic bindings')
+
+        bindings = synthetic_ontology.get_bindings()
+        rows = len(bindings['results']['bindings'])
+        simplified_df = add_stage('decode', rows, ResultDecoder().decode_json, bindings)
+        branch_dataframe = add_stage('get_branch_dataframe', rows, self.analyzer.get_branch_dataframe, simplified_df)
+        add_stage('adjust_branch_probability', len(branch_dataframe), self.analyzer.adjust_branch_probability,
+                  branch_dataframe)
+        cost_dataframe = add_stage('update_dataframe_costs', len(branch_dataframe),
+                                   self.analyzer.update_dataframe_costs, branch_dataframe)
+        add_stage('get_ce_dataframe', len(cost_dataframe), self.analyzer.get_ce_dataframe, cost_dataframe)
+        add_stage('get_dataframe_analysis', rows, self.analyzer.get_dataframe_analysis, simplified_df)
+
+        coordinates = synthetic_ontology.get_coordinates_dataframe()
+        coordinate_index = add_stage('CoordinateIndex', len(coordinates), CoordinateIndex, coordinates['coordinates'])
+        origin = coordinates.iloc[0]
+        add_stage('get_nearest_param', len(coordinates), SparqlManager.get_nearest_param, coordinates,
+                  origin['disease'], origin['studyIdentifier'], origin['countryLabel'], 'Cost', coordinate_index)
+
+        return stages
+
+    def run_scaling(self, scales, dimension='studies', ontology_path=None, **parameters):
+        """ Measures every stage while one dimension of the synthetic ontology grows
+
+        :param scales: Values of the growing dimension
+        :param dimension: Parameter of SyntheticOntology that grows
+        :param ontology_path: OWL file to measure the local query too, None to skip it
+        :param parameters: Rest of parameters of SyntheticOntology
+        :return: Dataframe with one row per scale and stage
+        """
+        results = list()
+        for scale in scales:
+            synthetic_ontology = SyntheticOntology(**dict(parameters, **{dimension: scale}))
+            for stage in self.run_stages(synthetic_ontology, ontology_path):
+                results.append(dict(stage, **{dimension: scale}))
+
+        return pd.DataFrame(results, columns=[dimension, 'stage', 'rows', 'seconds', 'peakMemoryMB'])
+
+    def check_reference(self, rtol=1e-9):
+        """ Checks the analysis of the PBD case of the bundled ontology against its reference results
+
+        :param rtol: Relative tolerance
+        :return: Seconds of the analysis, including the local query
+        """
+        start = time.perf_counter()
+        ce_dataframe = self.analyzer.get_dataframe_analysis(ResultDecoder().decode_json(
+            LocalQueryBackend(graph_directory=None).query(
+            self.query_template.bind(**self.REFERENCE_BINDINGS))))
+        seconds = time.perf_counter() - start
+
+        results = ce_dataframe.groupby(self.GROUPED_PARAMS, as_index=False, observed=True)[self.RESULT_COLUMNS].sum()
+        results = results.astype({column: str for column in self.GROUPED_PARAMS}).sort_values(self.GROUPED_PARAMS)
+        reference = pd.read_csv(self.REFERENCE_PATH).sort_values(self.GROUPED_PARAMS)
+        if results[self.GROUPED_PARAMS].values.tolist() != reference[self.GROUPED_PARAMS].values.tolist() or \
+                not np.allclose(results[self.RESULT_COLUMNS].to_numpy(dtype=np.float64),
+                                reference[self.RESULT_COLUMNS].to_numpy(dtype=np.float64), rtol=rtol, atol=0):
+            raise Exception('The analysis does not match ' + self.REFERENCE_PATH)
+
+        return seconds
+
+    def check_empty_selection(self):
+        """ Checks that a selection without results is reported as missing information, which is the error
+        that the application turns into its message for studies that cannot be analyzed
+
+        :return: Message of the error
+        """
+        simplified_df = ResultDecoder().decode_json(LocalQueryBackend(graph_directory=None).query(
+            self.query_template.bind(**self.EMPTY_BINDINGS)))
+        if not simplified_df.empty:
+            raise Exception('The selection ' + self.EMPTY_BINDINGS['studyIdentifier'] + ' is not empty')
+        try:
+            self.analyzer.get_dataframe_analysis(simplified_df)
+        except KeyError as error:
+            return error.args[0]
+
+        raise Exception('The analysis of an empty selection does not raise KeyError')
@@ -0,0 +1,274 @@
+import numpy as np
+import pandas as pd
+import rdflib
+from rdflib import Literal, Namespace, OWL, RDF, XSD
+from sparql.CountryGazetteer import CountryGazetteer
+
+
+class SyntheticOntology:
+    """ Generator of synthetic StaDiOS data shaped like the studies of the ontology.
+
+    Every disease has a diagnosis intervention and several neonatal screening interventions for each study,
+    and developments with manifestations whose costs and utilities are given by each study. The same data
+    can be written as the bindings of the cost-effectiveness query, as the parameters of the geographic
+    queries and as an OWL file that answers those queries.
+    """
+
+    NAMESPACE = 'http://www.semanticweb.org/storh/ontologies/2022/11/StaDiOS#'
+    # Variables of data/cost_effectiveness_query, by kind of term
+    IRI_COLUMNS = ['disease', 'intervention', 'detectionStrategy', 'development', 'manifestation',
+                   'followUpStrategy', 'treatmentStrategy']
+    STRING_COLUMNS = ['interventionKind', 'populationKind', 'detectionStrategyCurrency', 'manifestationCurrency',
+                      'utilityKind', 'followUpCurrency', 'treatmentStrategyCurrency', 'studyIdentifier',
+                      'manifestationCountry', 'populationCountry']
+    YEAR_COLUMNS = ['detectionStrategyYear', 'manifestationYear', 'followUpYear', 'treatmentYear']
+    QUERY_COLUMNS = ['disease', 'intervention', 'interventionKind', 'populationKind', 'populationAverageAge',
+                     'populationUtilityValue', 'detectionStrategy', 'sensitivity', 'specificity', 'prevalenceAtBirth',
+                     'detectionStrategyAmount', 'detectionStrategyCurrency', 'detectionStrategyYear', 'development',
+                     'lifeExpectancy', 'manifestation', 'manifestationProbability', 'manifestationInitialAmount',
+                     'manifestationAnnualAmount', 'manifestationCurrency', 'manifestationYear', 'utilityValue',
+                     'utilityKind', 'followUpStrategy', 'followUpAmount', 'followUpCurrency', 'followUpYear',
+                     'treatmentStrategy', 'treatmentStrategyAmount', 'treatmentStrategyCurrency', 'treatmentYear',
+                     'studyIdentifier', 'manifestationCountry', 'populationCountry']
+
+    def __init__(self, diseases=1, interventions=2, developments=1, manifestations=6, studies=1, countries=10,
+                 seed=0):
+        """ Builder overload -- Initialize SyntheticOntology parameters
+
+        :param diseases: Number of diseases
+        :param interventions: Number of interventions of each study, the first one is a diagnosis
+        :param developments: Number of developments of each disease
+        :param manifestations: Number of manifestations of each development
+        :param studies: Number of studies of each disease
+        :param countries: Number of countries of the studies
+        :param seed: Seed of the generated values
+        """
+        if interventions < 2:
+            raise Exception('At least a diagnosis and a screening intervention are needed')
+
+        self.diseases = diseases
+        self.interventions = interventions
+        self.developments = developments
+        self.manifestations = manifestations
+        self.studies = studies
+        self.countries = countries
+        self.seed = seed
+        self.dataframe = None
+
+    def get_dataframe(self):
+        """
+        :return: Dataframe with the rows of the cost-effectiveness query, as decoded by the analyzer
+        """
+        if self.dataframe is not None:
+            return self.dataframe.copy()
+
+        rng = np.random.default_rng(self.seed)
+        # One row per disease, study, intervention, development and manifestation
+        d, s, i, v, m = [index.ravel() for index in np.indices(
+            (self.diseases, self.studies, self.interventions, self.developments, self.manifestations))]
+        disease = np.char.add('SYN', d.astype(str))
+        study = np.char.add(np.char.add(disease, '_'), np.char.zfill(s.astype(str), 3))
+        development = np.char.add(np.char.add(disease, '_Development'), v.astype(str))
+        manifestation = np.char.add(np.char.add(development, '_Manifestation'), m.astype(str))
+        is_diagnosis = i == 0
+
+        def draw(low, high, *shape):
+            """ Values of an entity, gathered for every row """
+            return rng.uniform(low, high, shape)
+
+        dataframe = pd.DataFrame({
+            'disease': disease,
+            'intervention': np.char.add(np.char.add(study, '_Intervention'), i.astype(str)),
+            'interventionKind': np.where(is_diagnosis, 'DIAGNOSIS', 'SCREENING'),
+            'populationKind': 'NEONATAL',
+            'populationAverageAge': 1.0,
+            'populationUtilityValue': draw(0.85, 0.95, self.diseases, self.studies, self.interventions)[d, s, i],
+            'detectionStrategy': np.where(is_diagnosis, np.char.add(disease, '_ClinicalDiagnosisStrategy'),
+                                          np.char.add(np.char.add(disease, '_ScreeningStrategy'), i.astype(str))),
+            'sensitivity': np.where(is_diagnosis, 1.0, draw(0.99, 1.0, self.diseases, self.interventions)[d, i]),
+            'specificity': np.where(is_diagnosis, 1.0, draw(0.99, 1.0, self.diseases, self.interventions)[d, i]),
+            'prevalenceAtBirth': draw(1e-5, 1e-3, self.diseases)[d],
+            'detectionStrategyAmount': np.where(is_diagnosis, draw(100, 1000, self.diseases)[d],
+                                                draw(0.5, 5, self.diseases, self.interventions)[d, i]),
+            'detectionStrategyCurrency': 'Euro',
+            'detectionStrategyYear': rng.integers(2010, 2024, (self.diseases, self.interventions))[d, i],
+            'development': development,
+            'lifeExpectancy': draw(75, 85, self.diseases, self.studies)[d, s],
+            'manifestation': manifestation,
+            'manifestationProbability': draw(0.05, 0.6, self.diseases, self.developments, self.manifestations)[d, v, m],
+            'manifestationInitialAmount': draw(1000, 50000, self.diseases, self.studies, self.developments,
+                                               self.manifestations)[d, s, v, m],
+            'manifestationAnnualAmount': draw(0, 300, self.diseases, self.studies, self.developments,
+                                              self.manifestations)[d, s, v, m],
+            'manifestationCurrency': 'Euro',
+            'manifestationYear': rng.integers(2010, 2024, (self.diseases, self.studies))[d, s],
+            'utilityValue': draw(0.6, 0.95, self.diseases, self.studies, self.developments,
+                                 self.manifestations)[d, s, v, m],
+            'utilityKind': 'UTILITY',
+            'followUpStrategy': np.char.add(disease, '_FollowUpStrategy'),
+            'followUpAmount': draw(100, 1000, self.diseases)[d],
+            'followUpCurrency': 'Euro',
+            'followUpYear': rng.integers(2010, 2024, self.diseases)[d],
+            'treatmentStrategy': np.char.add(disease, '_TreatmentStrategy'),
+            'treatmentStrategyAmount': draw(10, 100, self.diseases)[d],
+            'treatmentStrategyCurrency': 'Euro',
+            'treatmentYear': rng.integers(2010, 2024, self.diseases)[d],
+            'studyIdentifier': study}, columns=self.QUERY_COLUMNS)
+        # Manifestation costs and populations are located in the country of their study
+        study_countries = self.get_study_countries(dataframe['studyIdentifier'].unique())
+        dataframe['manifestationCountry'] = dataframe['studyIdentifier'].map(study_countries)
+        dataframe['populationCountry'] = dataframe['manifestationCountry']
+
+        dataframe[self.IRI_COLUMNS] = dataframe[self.IRI_COLUMNS].astype('category')
+        self.dataframe = dataframe
+
+        return dataframe.copy()
+
+    def get_bindings(self):
+        """
+        :return: Result of the cost-effectiveness query in the SPARQL JSON format
+        """
+        dataframe = self.get_dataframe()
+        columns = dict()
+        for column in self.QUERY_COLUMNS:
+            values = dataframe[column].astype(str).tolist()
+            if column in self.IRI_COLUMNS:
+                columns[column] = [{'type': 'uri', 'value': self.NAMESPACE + value} for value in values]
+            else:
+                datatype = str(XSD.string if column in self.STRING_COLUMNS else
+                               XSD.short if column in self.YEAR_COLUMNS else XSD.double)
+                columns[column] = [{'type': 'literal', 'datatype': datatype, 'value': value} for value in values]
+
+        bindings = [dict(zip(self.QUERY_COLUMNS, row)) for row in zip(*columns.values())]
+
+        return {'head': {'vars': self.QUERY_COLUMNS}, 'results': {'bindings': bindings}}
+
+    def get_study_countries(self, studies=None):
+        """
+        :param studies: Identifier of each study, by default those of the dataframe
+        :return: Series with the country of the gazetteer of each study
+        """
+        countries = CountryGazetteer().countries['countryLabel']
+        rng = np.random.default_rng(self.seed)
+        countries = countries.iloc[rng.choice(len(countries), min(self.countries, len(countries)), replace=False)]
+        studies = self.get_dataframe()['studyIdentifier'].unique() if studies is None else studies
+
+        return pd.Series(countries.to_numpy()[np.arange(len(studies)) % len(countries)], index=studies)
+
+    def get_parameter_countries(self):
+        """
+        :return: Dataframe with the rows of the get_parameters_coordinates query
+        """
+        dataframe = self.get_dataframe()
+        study_countries = self.get_study_countries()
+        parameters = list()
+        for parameter_type, suffix in (('Cost', '_Cost'), ('Utility', '_Utility')):
+            parameters.append(pd.DataFrame({
+                'disease': dataframe['disease'].astype(str), 'development': dataframe['development'].astype(str),
+                'parameterType': parameter_type,
+                'parameter': dataframe['manifestation'].astype(str) + '_' + dataframe['studyIdentifier'] + suffix,
+                'studyIdentifier': dataframe['studyIdentifier'],
+                'parameterCountry': dataframe['studyIdentifier'].map(study_countries)}))
+
+        return pd.concat(parameters, ignore_index=True).drop_duplicates(ignore_index=True)
+
+    def get_coordinates_dataframe(self):
+        """
+        :return: Dataframe of parameters with their country and coordinates, as used by get_nearest_param
+        """
+        parameters = CountryGazetteer().join_parameters(self.get_parameter_countries())
+
+        return parameters[['disease', 'development', 'parameterType', 'parameter', 'studyIdentifier',
+                           'countryLabel', 'coordinates']].drop_duplicates(ignore_index=True)
+
+    def get_graph(self):
+        """
+        :return: RDF graph with the individuals of the synthetic studies
+        """
+        std = Namespace(self.NAMESPACE)
+        graph = rdflib.Graph()
+        graph.bind('std', std)
+        dataframe = self.get_dataframe()
+        study_countries = self.get_study_countries()
+
+        def add(subject, properties):
+            """ Literal values are kept and the rest are individuals of the namespace """
+            for predicate, value in properties.items():
+                graph.add((std[subject], std[predicate], value if isinstance(value, Literal) else std[value]))
+
+        def double(value):
+            return Literal(float(value), datatype=XSD.double)
+
+        def string(value):
+            return Literal(str(value), datatype=XSD.string)
+
+        def year(value):
+            return Literal(int(value), datatype=XSD.short)
+
+        for parameter_class in ('Disease', 'Cost', 'Utility'):
+            graph.add((std[parameter_class], RDF.type, OWL.Class))
+
+        for row in dataframe.drop_duplicates('disease').itertuples():
+            graph.add((std[row.disease], RDF.type, std.Disease))
+            add(row.disease, {'hasPrevalenceAtBirth': double(row.prevalenceAtBirth)})
+            for strategy, kind in ((row.followUpStrategy, 'FollowUp'), (row.treatmentStrategy, 'Treatment')):
+                amount, year_value = (row.followUpAmount, row.followUpYear) if kind == 'FollowUp' else \
+                    (row.treatmentStrategyAmount, row.treatmentYear)
+                add(strategy, {'has' + kind + 'StrategyCost': strategy + '_Cost'})
+                add(strategy + '_Cost', {'hasAmount': double(amount), 'hasCurrency': string('Euro'),
+                                         'hasYear': year(year_value)})
+
+        for row in dataframe.drop_duplicates(['disease', 'development']).itertuples():
+            add(row.disease, {'hasDiseaseDevelopments': row.development})
+
+        for row in dataframe.drop_duplicates('intervention').itertuples():
+            population = row.intervention + '_Population'
+            add(row.disease, {'hasInterventions': row.intervention})
+            add(row.intervention, {'hasInterventionDetectionStrategy': row.detectionStrategy,
+                                   'hasInterventionFollowUpStrategy': row.followUpStrategy,
+                                   'hasInterventionTreatmentStrategy': row.treatmentStrategy,
+                                   'hasInterventionKind': string(row.interventionKind),
+                                   'hasInterventionPopulation': population})
+            add(population, {'hasPopulationKind': string(row.populationKind),
+                             'hasAverageAge': double(row.populationAverageAge),
+                             'hasLifeExpectancy': double(row.lifeExpectancy),
+                             'hasStudyIdentifier': string(row.studyIdentifier),
+                             'hasCountry': string(row.populationCountry),
+                             'hasPopulationUtility': population + '_Utility'})
+            add(population + '_Utility', {'hasValue': double(row.populationUtilityValue)})
+
+        for row in dataframe.drop_duplicates('detectionStrategy').itertuples():
+            add(row.detectionStrategy, {'hasDetectionStrategyCost': row.detectionStrategy + '_Cost',
+                                        'hasSpecificity': double(row.specificity),
+                                        'hasSensitivity': double(row.sensitivity)})
+            add(row.detectionStrategy + '_Cost', {'hasAmount': double(row.detectionStrategyAmount),
+                                                  'hasCurrency': string('Euro'),
+                                                  'hasYear': year(row.detectionStrategyYear)})
+
+        for row in dataframe.drop_duplicates('manifestation').itertuples():
+            add(row.development, {'hasDevelopmentManifestations': row.manifestation})
+            add(row.manifestation, {'hasManifestationTreatmentStrategy': row.treatmentStrategy,
+                                    'hasProbability': double(row.manifestationProbability)})
+
+        for row in dataframe.drop_duplicates(['manifestation', 'studyIdentifier']).itertuples():
+            cost = row.manifestation + '_' + row.studyIdentifier + '_Cost'
+            utility = row.manifestation + '_' + row.studyIdentifier + '_Utility'
+            country = string(study_countries[row.studyIdentifier])
+            add(row.manifestation, {'hasManifestationCost': cost, 'hasUtility': utility})
+            graph.add((std[cost], RDF.type, std.Cost))
+            add(cost, {'hasAmount': double(row.manifestationAnnualAmount),
+                       'hasInitialAmount': double(row.manifestationInitialAmount),
+                       'hasCurrency': string('Euro'), 'hasYear': year(row.manifestationYear),
+                       'hasStudyIdentifier': string(row.studyIdentifier), 'hasCountry': country})
+            graph.add((std[utility], RDF.type, std.Utility))
+            add(utility, {'hasValue': double(row.utilityValue), 'hasUtilityKind': string(row.utilityKind),
+                          'hasStudyIdentifier': string(row.studyIdentifier), 'hasCountry': country})
+
+        return graph
+
+    def write_ontology(self, path):
+        """ Writes the synthetic individuals as an OWL file, in RDF/XML, or as Turtle for .ttl files
+
+        :param path: Output file
+        """
+        self.get_graph().serialize(destination=str(path), format='turtle' if str(path).endswith('.ttl') else 'xml')
@@ -0,0 +1,19 @@
+import argparse
+from sparql.CountryGazetteer import CountryGazetteer
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='StaDiOS - Rebuild the local country gazetteer offline')
+    parser.add_argument('dump', help='SPARQL JSON result of data/get_wikidata_countries or Wikidata JSON '
+                                     'entity dump, optionally compressed with gzip or bzip2')
+    parser.add_argument('--version', required=True, help='Version of the new snapshot')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    countries = CountryGazetteer.refresh(arguments.dump, arguments.version)
+
+    print(str(countries.shape[0]) + ' countries written, ' +
+          str((countries['europeanUnion'] == 'true').sum()) + ' within the European Union')
@@ -1,43 +1,171 @@
+import os
 import streamlit as st
 import matplotlib.pyplot as plt
 import pyautogui
-from pathlib import Path
-from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
-from sparql.SparqlManager import SparqlManager
+from analyzer.IncrementalAnalyzer import IncrementalAnalyzer
+from analyzer.MarkovAnalyzer import MarkovAnalyzer
+from analyzer.ResultExporter import ResultExporter
+from analyzer.SensitivityAnalyzer import SensitivityAnalyzer
+from analyzer.StrategyComparator import StrategyComparator
+from resources import get_materialized_view, get_ontology_analyzer, get_query_template, get_result_aggregator, \
+    get_result_exporter, get_sparql_manager, reload_resources
+from tracing.Tracer import get_tracer
 
 
 @st.cache_data()
 def load_ce_dataframe(sparql_query):
-    return ontology_analyzer.get_analysis(sparql_query)
+    return get_ontology_analyzer().get_analysis(sparql_query)
 
 
-def callback():
-    st.session_state.load_state = True
+@st.cache_data()
+def load_markov_dataframe(sparql_query, cycles, discount_rate):
+    markov_analyzer = MarkovAnalyzer(cycles, discount_rate, discount_rate)
+    return markov_analyzer.get_analysis(sparql_query), markov_analyzer.get_trace_dataframe(
+        markov_analyzer.get_query(sparql_query))
 
 
-def resetcall():
-    st.session_state.load_state = False
+@st.cache_data()
+def load_sweep_analysis(sparql_query, relative_range, points, threshold):
+    ranges = {parameter: (1 - relative_range, 1 + relative_range) for parameter in SensitivityAnalyzer.SWEEP_ENTITIES}
+    return SensitivityAnalyzer().get_sweep_analysis(sparql_query, ranges=ranges, points=points, threshold=threshold)
 
 
-def download_ce_dataframe_button(dataframe):
-    return st.download_button(
-        label="Download CE as CSV",
-        data=dataframe.to_csv(index=False).encode('utf-8'),
-        file_name='ce_analysis.csv',
-        mime='text/csv',
-    )
+@st.cache_data()
+def load_strategy_comparison(disease):
+    return StrategyComparator(get_ontology_analyzer()).get_comparison(disease=disease)
 
 
-def download_ce_results_button(dataframe):
-    return st.download_button(
-        label="Download CE results as CSV",
-        data=dataframe.to_csv(index=False).encode('utf-8'),
-        file_name='ce_results_analysis.csv',
-        mime='text/csv',
-    )
+def callback():
+    st.session_state.load_state = True
 
 
-def main_page_initialization(param_list, sparql_query):
+def resetcall():
+    st.session_state.load_state = False
+
+
+def get_what_if_analyzer(sparql_query):
+    # The what-if analysis keeps its intermediate results while the selection does not change
+    if st.session_state.get('what_if_query') != sparql_query:
+        st.session_state.what_if_analyzer = IncrementalAnalyzer()
+        st.session_state.what_if_analyzer.get_incremental_analysis(sparql_query)
+        st.session_state.what_if_query = sparql_query
+
+    return st.session_state.what_if_analyzer
+
+
+def what_if_initialization(sparql_query, grouped_params):
+    st.header("What-if analysis")
+    what_if_analyzer = get_what_if_analyzer(sparql_query)
+
+    parameter_selected = st.selectbox('Select parameter', list(IncrementalAnalyzer.PARAMETER_ENTITIES))
+    parameter_values = what_if_analyzer.get_parameter_values(parameter_selected)
+    entity_selected = st.selectbox('Select ' + IncrementalAnalyzer.PARAMETER_ENTITIES[parameter_selected],
+                                   list(parameter_values.index))
+    value_selected = st.number_input('New value', value=float(parameter_values[entity_selected]), format='%.6f')
+
+    if st.button('Apply what-if'):
+        what_if_analyzer.set_parameter(parameter_selected, entity_selected, value_selected)
+
+    st.dataframe(what_if_analyzer.ce_dataframe.groupby(grouped_params, as_index=False, observed=True)[
+        ['Branch Lifetime Cost', 'Branch Annual Cost', 'Branch QALY']].sum())
+
+
+def markov_initialization(sparql_query, grouped_params):
+    st.header("Markov cohort analysis")
+    # By default the cohort is followed until it has died, a shorter horizon leaves out the rest of its lifetime
+    lifetime_horizon = st.checkbox('Lifetime horizon', value=MarkovAnalyzer.DEFAULT_CYCLES is None)
+    cycles = None if lifetime_horizon else int(st.number_input('Cycles (years)', min_value=1, max_value=500,
+                                                               value=100))
+    st.caption('Time horizon: ' + ('lifetime of the cohort' if cycles is None else str(cycles) + ' yearly cycles'))
+    discount_rate = st.number_input('Discount rate', min_value=0.0, max_value=1.0,
+                                    value=MarkovAnalyzer.DEFAULT_DISCOUNT_RATE, format='%.3f')
+
+    if st.button('Generate Markov Analysis'):
+        markov_df, trace_df = load_markov_dataframe(sparql_query, cycles, float(discount_rate))
+        st.dataframe(markov_df.groupby(grouped_params, as_index=False, observed=True)[
+            ['Branch Life Years', 'Branch Lifetime Cost', 'Branch Annual Cost', 'Branch QALY']].sum())
+        st.line_chart(trace_df.set_index('cycle'))
+
+
+def sensitivity_initialization(sparql_query):
+    st.header("One-way sensitivity analysis")
+    relative_range = st.number_input('Relative range', min_value=0.0, max_value=1.0,
+                                     value=SensitivityAnalyzer.DEFAULT_RANGE, format='%.2f')
+    threshold = st.number_input('Willingness to pay per QALY', min_value=0.0,
+                                value=float(SensitivityAnalyzer.DEFAULT_THRESHOLD))
+
+    if st.button('Generate Sensitivity Analysis'):
+        st.session_state.sweep_selection = (sparql_query, float(relative_range), float(threshold))
+
+    # Every parameter is swept once and the diagram of each outcome and strategy is read from the cached sweep
+    if st.session_state.get('sweep_selection', (None,))[0] == sparql_query:
+        _, relative_range, threshold = st.session_state.sweep_selection
+        sweep_df, base_df = load_sweep_analysis(sparql_query, relative_range, SensitivityAnalyzer.DEFAULT_POINTS,
+                                                threshold)
+        outcome_selected = st.selectbox('Select outcome', SensitivityAnalyzer.OUTCOME_COLUMNS)
+        strategy_selected = st.selectbox('Select strategy', list(base_df['strategy']))
+        tornado_df = SensitivityAnalyzer.get_tornado_dataframe(sweep_df, base_df, outcome_selected)
+        tornado_df = tornado_df[tornado_df['strategy'] == strategy_selected].head(15).iloc[::-1]
+
+        fig, ax = plt.subplots(figsize=(15, 7))
+        labels = tornado_df['parameter'] + ' (' + tornado_df['entity'] + ')'
+        base_outcome = tornado_df['Base Outcome'].to_numpy()
+        ax.barh(labels, tornado_df['Low Outcome'] - base_outcome, left=base_outcome, label='Low value')
+        ax.barh(labels, tornado_df['High Outcome'] - base_outcome, left=base_outcome, label='High value')
+        ax.set_xlabel(outcome_selected)
+        ax.legend()
+        st.pyplot(fig)
+        st.dataframe(tornado_df.iloc[::-1])
+
+
+def comparison_initialization(disease):
+    st.header("Strategy comparison")
+    # Every intervention and strategy of the disease is analyzed and ranked at once
+    if st.button('Compare strategies'):
+        comparison_df, failures_df = load_strategy_comparison(disease)
+        st.dataframe(comparison_df)
+        if not failures_df.empty:
+            st.write('Alternatives without sufficient information to perform a CE analysis:')
+            st.dataframe(failures_df)
+
+
+def download_button(dataframe, key, label, file_name):
+    # Files are only serialized once they are requested, so the reruns of the page do not pay for them
+    file_format = st.selectbox('Format', list(ResultExporter.FORMATS), key=file_name + '_format')
+    download_key = (key, file_name, file_format)
+    prepared_downloads = st.session_state.setdefault('prepared_downloads', set())
+    if download_key not in prepared_downloads and st.button('Prepare ' + label, key=file_name + '_prepare'):
+        prepared_downloads.add(download_key)
+
+    if download_key in prepared_downloads:
+        mime, extension = ResultExporter.FORMATS[file_format]
+        return st.download_button(
+            label='Download ' + label + ' as ' + file_format.upper(),
+            data=get_result_exporter().get_bytes((key, file_name), dataframe, file_format),
+            file_name=file_name + extension,
+            mime=mime,
+        )
+
+
+def download_ce_dataframe_button(dataframe, key):
+    return download_button(dataframe, key, 'CE', 'ce_analysis')
+
+
+def download_ce_results_button(dataframe, key):
+    return download_button(dataframe, key, 'CE results', 'ce_results_analysis')
+
+
+def profiling_panel(tracer, trace_key):
+    # Breakdown of the stages of the last traced run of this session
+    st.sidebar.header("Profiling")
+    breakdown = tracer.get_breakdown(session_key=trace_key)
+    if breakdown.empty:
+        st.sidebar.write('No run traced yet')
+    else:
+        st.sidebar.dataframe(breakdown)
+
+
+def main_page_initialization(param_list, query_template):
     st.title("StaDiOS - Cost-Effectiveness Analyzer")
     st.header("Cost-Effectiveness Dataframe")
 
@@ -49,27 +177,42 @@ def main_page_initialization(param_list, sparql_query):
 
     if st.button('Generate CE Analysis', on_click=callback) or st.session_state.load_state:
 
-        filter_option = "\n FILTER(?disease = std:" + disease_selected + " && ?development = std:" + \
-                        development_selected + " && ?followUpStrategy = std:" + follow_up_selected + \
-                        " && ?treatmentStrategy = std:" + treatment_selected + ") . \n"
-        filter_study_option = "FILTER(STR(?studyIdentifier) =" + '"' + \
-                              study_identifier_selected + '") .' + "\n } "
+        # The selection is bound to the template, so the same selection always produces the same query
+        analysis_query = query_template.bind(disease=disease_selected, development=development_selected,
+                                             followUpStrategy=follow_up_selected,
+                                             treatmentStrategy=treatment_selected,
+                                             studyIdentifier=study_identifier_selected)
+        # Selections of the materialized view are read from it, the rest are analyzed
+        materialized_view = get_materialized_view()
+        selection = (disease_selected, development_selected, follow_up_selected, treatment_selected,
+                     study_identifier_selected)
 
         try:
-            ce_dataframe = load_ce_dataframe(sparql_query + filter_option + filter_study_option)
+            ce_dataframe = materialized_view.get_analysis(selection)
+            if ce_dataframe is None:
+                ce_dataframe = load_ce_dataframe(analysis_query)
             st.dataframe(ce_dataframe, width=1500, height=600)
 
-            download_ce_dataframe_button(ce_dataframe)
+            download_ce_dataframe_button(ce_dataframe, analysis_query)
 
             st.header("Cost-Effectiveness Results")
             grouped_params = ['interventionKind', 'detectionStrategy',
                               'treatmentStrategy', 'followUpStrategy']
-            grouped_df = ce_dataframe.groupby(grouped_params, as_index=False)[['Branch Lifetime Cost',
-                                                                               'Branch Annual Cost',
-                                                                               'Branch QALY']].sum()
+            result_aggregator = get_result_aggregator()
+            grouped_df = materialized_view.get_results(selection)
+            if grouped_df is None:
+                grouped_df = result_aggregator.get_results(analysis_query, ce_dataframe, grouped_params,
+                                                           ['Branch Lifetime Cost', 'Branch Annual Cost',
+                                                            'Branch QALY'])
             st.dataframe(grouped_df)
 
-            download_ce_results_button(grouped_df)
+            download_ce_results_button(grouped_df, analysis_query)
+
+            what_if_initialization(analysis_query, grouped_params)
+
+            markov_initialization(analysis_query, grouped_params)
+
+            sensitivity_initialization(analysis_query)
 
             st.header("Graphic analysis")
             # Specific groupings we want from the data
@@ -88,8 +231,8 @@ def main_page_initialization(param_list, sparql_query):
 
                 # Bar chart to compare the desired parameters of the different groupings
                 fig, ax = plt.subplots(figsize=(15, 7))
-                diagram = ce_dataframe.groupby(grouping_options).agg(
-                    {final_selected_parameter: params_to_display})
+                diagram = result_aggregator.get_statistics(analysis_query, ce_dataframe, grouping_options,
+                                                           [final_selected_parameter], params_to_display)
                 diagram.plot.barh(ax=ax)
 
                 for bars in ax.containers:
@@ -103,6 +246,8 @@ def main_page_initialization(param_list, sparql_query):
                      "we invite you to review our bibliography: "
                      "[StaDiOS](https://alu0101028491.github.io/TFG_StaDiOS/)")
 
+    comparison_initialization(disease_selected)
+
 
 if __name__ == '__main__':
     st.set_page_config(page_title="StaDiOS-App", layout="wide")
@@ -112,12 +257,21 @@ if __name__ == '__main__':
     if 'load_state' not in st.session_state:
         st.session_state.load_state = False
 
-    sparql_manager = SparqlManager()
-    ontology_analyzer = CostEffectivenessAnalyzer()
+    # The persistent query cache is shared, so reloading the ontology invalidates it for every process
+    if st.sidebar.button("Reload ontology"):
+        reload_resources()
+
+    # Profiling only traces the runs of this session, on top of the tracing of the whole process
+    tracer = get_tracer()
+    profiling = st.sidebar.checkbox("Profiling", value=tracer.enabled, key='profiling')
+    trace_key = st.session_state.setdefault('trace_key', os.urandom(8).hex())
+
+    with tracer.session(trace_key, profiling):
+        query = get_query_template('cost_effectiveness_query')
 
-    query = Path('data/sparql_prefixes').read_text() + '\n' + Path(
-        'data/cost_effectiveness_query').read_text()
+        parameters_list = get_sparql_manager().get_selection_parameters()
 
-    parameters_list = sparql_manager.get_selection_parameters()
+        main_page_initialization(parameters_list, query)
 
-    main_page_initialization(parameters_list, query)
+    if profiling:
+        profiling_panel(tracer, trace_key)
@@ -0,0 +1,26 @@
+import argparse
+from analyzer.MaterializedView import MaterializedView
+from sparql.QueryBackend import QueryBackend
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='StaDiOS - Materialization of the cost-effectiveness analysis of '
+                                                 'every selection of the ontology')
+    parser.add_argument('--directory', default=MaterializedView.DEFAULT_DIRECTORY,
+                        help='Directory of the materialized view')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--page-rows', type=int, default=QueryBackend.DEFAULT_PAGE_ROWS,
+                        help='Rows of each page of the streamed query')
+    parser.add_argument('--full', action='store_true',
+                        help='Analyze every selection again instead of only those whose inputs changed')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    materialized_view = MaterializedView(arguments.directory, arguments.workers, arguments.page_rows)
+
+    analyzed, reused = materialized_view.refresh(arguments.full)
+
+    print(str(analyzed) + ' selections analyzed, ' + str(reused) + ' selections reused')
@@ -1,7 +1,7 @@
 import streamlit as st
 import numpy as np
-from sparql.SparqlManager import SparqlManager
 import pyautogui
+from resources import get_sparql_manager
 
 
 def load_manifestation_treatments(manager, disease, development):
@@ -66,7 +66,8 @@ if __name__ == '__main__':
     if st.sidebar.button("Reset"):
         pyautogui.hotkey("ctrl", "F5")
 
-    sparql_manager = SparqlManager()
+    # The manager, its backend and its caches are shared with every session and with the main page
+    sparql_manager = get_sparql_manager()
     parameters_list = sparql_manager.get_selection_parameters()
     page_initialization(parameters_list)
 
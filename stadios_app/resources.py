@@ -0,0 +1,58 @@
+import streamlit as st
+from analyzer.CostEffectivenessAnalyzer import CostEffectivenessAnalyzer
+from analyzer.MaterializedView import MaterializedView
+from analyzer.ResultAggregator import ResultAggregator
+from analyzer.ResultExporter import ResultExporter
+from sparql.QueryRegistry import get_query_registry
+from sparql.SparqlManager import SparqlManager
+
+# Resources of the server process shared by every session and page. They are built on the first rerun of any
+# session instead of on every rerun, and only keep state that is safe to share: the query backend with its
+# pool of connections, the query templates, the costing tables and results keyed by the query of each analysis.
+
+
+@st.cache_resource
+def get_ontology_analyzer():
+    return CostEffectivenessAnalyzer()
+
+
+@st.cache_resource
+def get_materialized_view():
+    # Analyses of every selection, refreshed in the background when the ontology changes
+    return MaterializedView()
+
+
+@st.cache_resource
+def get_sparql_manager():
+    return SparqlManager()
+
+
+@st.cache_resource
+def get_result_aggregator():
+    # Aggregates are shared by every session, keyed by the query of each analysis
+    return ResultAggregator()
+
+
+@st.cache_resource
+def get_result_exporter():
+    # Serialized files are shared by every session, keyed by the query of each analysis
+    return ResultExporter()
+
+
+def get_query_template(name):
+    """
+    :param name: Name of the query template
+    :return: Query template of the registry shared by the whole process
+    """
+    return get_query_registry().get(name)
+
+
+def reload_resources():
+    """ Invalidates the results of the ontology for every process and rebuilds the resources of this one, so
+    they are stamped with the version of the reloaded ontology
+    """
+    sparql_manager = get_sparql_manager()
+    sparql_manager.query_cache.invalidate()
+    sparql_manager.invalidate_selection_parameters()
+    st.cache_data.clear()
+    st.cache_resource.clear()
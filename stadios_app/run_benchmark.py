@@ -0,0 +1,43 @@
+import argparse
+import pandas as pd
+from benchmark.PipelineBenchmark import PipelineBenchmark
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='StaDiOS - Offline benchmark of the analyzer pipeline')
+    parser.add_argument('--scales', default='1,2,4,8', help='Comma-separated values of the growing dimension')
+    parser.add_argument('--dimension', default='studies',
+                        choices=['diseases', 'interventions', 'developments', 'manifestations', 'studies', 'countries'],
+                        help='Dimension of the synthetic ontology that grows')
+    parser.add_argument('--diseases', type=int, default=1)
+    parser.add_argument('--interventions', type=int, default=2)
+    parser.add_argument('--developments', type=int, default=1)
+    parser.add_argument('--manifestations', type=int, default=6)
+    parser.add_argument('--studies', type=int, default=1)
+    parser.add_argument('--countries', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5, help='Number of timed runs of each stage')
+    parser.add_argument('--ontology', default=None,
+                        help='OWL file to write each synthetic ontology and measure the local query')
+    parser.add_argument('--output', default=None, help='CSV file for the measures')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    pipeline_benchmark = PipelineBenchmark(arguments.repeats)
+
+    print('Reference PBD analysis matches in ' + format(pipeline_benchmark.check_reference(), '.3f') + ' s')
+    print('Empty selection is reported: ' + pipeline_benchmark.check_empty_selection())
+
+    parameters = {name: getattr(arguments, name) for name in ['diseases', 'interventions', 'developments',
+                                                              'manifestations', 'studies', 'countries']}
+    parameters.pop(arguments.dimension)
+    measures = pipeline_benchmark.run_scaling([int(scale) for scale in arguments.scales.split(',')],
+                                              arguments.dimension, arguments.ontology, **parameters)
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(measures.pivot(index='stage', columns=arguments.dimension, values='seconds').reindex(
+            measures['stage'].unique()))
+    if arguments.output is not None:
+        measures.to_csv(arguments.output, index=False)
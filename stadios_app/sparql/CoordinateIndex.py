@@ -0,0 +1,119 @@
+import re
+import numpy as np
+import pandas as pd
+from geopy.distance import geodesic as gd
+
+
+class CoordinateIndex:
+    """ Spatial index of the geographic coordinates of the StaDiOS parameters.
+
+    Parameters share the coordinates of their country, so the WKT points are parsed once into float arrays
+    of distinct locations and every distance is computed per location and then gathered for each point.
+    Distances are approximated with the vectorized haversine formula, and optionally refined with the
+    exact geodesic distance only for the locations that can be part of the answer.
+    """
+
+    EARTH_RADIUS = 6371.0088
+    # Maximum relative difference between the haversine and the geodesic distance on Earth
+    HAVERSINE_ERROR = 0.0056
+    POINT_PATTERN = r'^\s*Point\s*\(\s*([^\s()]+)\s+([^\s()]+)\s*\)\s*$'
+
+    def __init__(self, coordinates):
+        """ Builder overload -- Initialize CoordinateIndex parameters
+
+        :param coordinates: WKT point, 'Point(longitude latitude)', of each indexed element
+        """
+        self.codes, locations = pd.factorize(pd.Series(coordinates, dtype=object))
+        points = pd.Series(locations, dtype=object).str.extract(self.POINT_PATTERN, flags=re.IGNORECASE)
+        points = points.astype(np.float64)
+        invalid = points.isna().any(axis=1).to_numpy()
+        if invalid.any():
+            raise Exception('Invalid coordinates: ' + str(locations[invalid][0]))
+
+        self.longitudes = points[0].to_numpy()
+        self.latitudes = points[1].to_numpy()
+        self.radian_longitudes = np.radians(self.longitudes)
+        self.radian_latitudes = np.radians(self.latitudes)
+        self.cos_latitudes = np.cos(self.radian_latitudes)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @staticmethod
+    def parse_point(wkt):
+        """
+        :param wkt: WKT point, 'Point(longitude latitude)'
+        :return: Pair (latitude, longitude)
+        """
+        index = CoordinateIndex([wkt])
+        return index.latitudes[0], index.longitudes[0]
+
+    def get_location_distances(self, latitude, longitude):
+        """
+        :param latitude: Latitude of the origin
+        :param longitude: Longitude of the origin
+        :return: Haversine distance in km from the origin to each distinct location
+        """
+        origin_latitude, origin_longitude = np.radians(latitude), np.radians(longitude)
+        half_chord = np.sin((self.radian_latitudes - origin_latitude) / 2) ** 2 + \
+            np.cos(origin_latitude) * self.cos_latitudes * \
+            np.sin((self.radian_longitudes - origin_longitude) / 2) ** 2
+
+        return 2 * self.EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(half_chord, 0.0, 1.0)))
+
+    def get_distances(self, latitude, longitude):
+        """
+        :param latitude: Latitude of the origin
+        :param longitude: Longitude of the origin
+        :return: Haversine distance in km from the origin to each indexed element
+        """
+        return self.get_location_distances(latitude, longitude)[self.codes]
+
+    def get_geodesic_distances(self, latitude, longitude, positions):
+        """ Exact distances, computed once per distinct location of the given elements
+
+        :param latitude: Latitude of the origin
+        :param longitude: Longitude of the origin
+        :param positions: Positions of the indexed elements
+        :return: Geodesic distance in km from the origin to each given element
+        """
+        location_codes, inverse = np.unique(self.codes[positions], return_inverse=True)
+        distances = np.array([gd((self.latitudes[code], self.longitudes[code]), (latitude, longitude)).km
+                              for code in location_codes])
+
+        return distances[inverse] if len(distances) else np.zeros(0)
+
+    def query(self, latitude, longitude, k=None, radius=None, candidates=None, exact=False):
+        """ Nearest elements to an origin, sorted by distance
+
+        :param latitude: Latitude of the origin
+        :param longitude: Longitude of the origin
+        :param k: Maximum number of elements, None for all of them
+        :param radius: Maximum distance in km, None for any distance
+        :param candidates: Boolean mask of the elements that can be returned, None for all of them
+        :param exact: Refine the distances of the returned elements with the geodesic distance
+        :return: Positions of the nearest elements and their distances in km
+        """
+        distances = self.get_distances(latitude, longitude)
+        positions = np.arange(len(distances)) if candidates is None else np.flatnonzero(candidates)
+        distances = distances[positions]
+        margin = 1 + 2 * self.HAVERSINE_ERROR if exact else 1
+
+        if radius is not None:
+            within_radius = distances <= radius * margin
+            positions, distances = positions[within_radius], distances[within_radius]
+        if k is not None and k < len(positions):
+            # Only the elements that can still be among the k nearest after the refinement are kept
+            kth_distance = np.partition(distances, k - 1)[k - 1]
+            nearest = distances <= kth_distance * margin
+            positions, distances = positions[nearest], distances[nearest]
+
+        if exact:
+            distances = self.get_geodesic_distances(latitude, longitude, positions)
+            if radius is not None:
+                within_radius = distances <= radius
+                positions, distances = positions[within_radius], distances[within_radius]
+
+        order = np.argsort(distances, kind='stable')[:k]
+
+        return positions[order], distances[order]
@@ -0,0 +1,175 @@
+import bz2
+import gzip
+import json
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+class CountryGazetteer:
+    """ Bundled and versioned snapshot of the Wikidata countries, with their English label, membership of
+    the European Union and coordinates.
+
+    It replaces the federated SERVICE calls to Wikidata: the snapshot is loaded once per process and
+    joined in memory against the countries of the StaDiOS parameters.
+    """
+
+    GAZETTEER_PATH = 'data/country_gazetteer.csv'
+    VERSION_PATH = 'data/country_gazetteer_version'
+    COLUMNS = ['countryLabel', 'europeanUnion', 'coordinates']
+
+    # Wikidata entities of the European Union and of the classes of countries
+    EUROPEAN_UNION = 'Q458'
+    COUNTRY_CLASSES = {'Q6256', 'Q3624078'}
+
+    # Snapshots already loaded in this process, by path
+    snapshots = dict()
+    snapshots_lock = threading.Lock()
+
+    def __init__(self, gazetteer_path=GAZETTEER_PATH, version_path=VERSION_PATH):
+        """ Builder overload -- Initialize CountryGazetteer parameters
+
+        :param gazetteer_path: CSV file of the snapshot
+        :param version_path: File with the version of the snapshot
+        """
+        with CountryGazetteer.snapshots_lock:
+            if gazetteer_path not in CountryGazetteer.snapshots:
+                countries = pd.read_csv(gazetteer_path, dtype={'countryLabel': object, 'coordinates': object})
+                countries['europeanUnion'] = countries['europeanUnion'].astype(bool)
+                version = Path(version_path).read_text().strip() if Path(version_path).is_file() else ''
+                CountryGazetteer.snapshots[gazetteer_path] = (countries, version)
+
+        self.countries, self.version = CountryGazetteer.snapshots[gazetteer_path]
+        self.matches = dict()
+
+    def get_matches(self, country):
+        """ Countries whose label contains a given country name, as FILTER CONTAINS(?countryLabel, ?country)
+
+        :param country: Country name of a parameter
+        :return: Positions of the matching countries in the snapshot
+        """
+        if country not in self.matches:
+            self.matches[country] = np.flatnonzero(
+                self.countries['countryLabel'].str.contains(country, regex=False).to_numpy())
+
+        return self.matches[country]
+
+    def join_parameters(self, dataframe, country_column='parameterCountry', european_only=False):
+        """ Joins some parameters with the countries of the snapshot
+
+        :param dataframe: Parameters with the country name of each one
+        :param country_column: Column with the country name
+        :param european_only: Keep only the countries of the European Union
+        :return: Dataframe of the parameters with the label and coordinates of their country
+        """
+        countries = list()
+        positions = list()
+        for country in pd.unique(dataframe[country_column].dropna()):
+            country_positions = self.get_matches(country)
+            countries += [country] * len(country_positions)
+            positions.append(country_positions)
+
+        matches = self.countries.iloc[np.concatenate(positions) if positions else []]
+        matches = matches.assign(**{country_column: countries})
+        if european_only:
+            matches = matches[matches['europeanUnion']]
+
+        return dataframe.merge(matches[[country_column, 'countryLabel', 'coordinates']], on=country_column)
+
+    @staticmethod
+    def open_dump(dump_path):
+        dump_path = str(dump_path)
+        if dump_path.endswith('.gz'):
+            return gzip.open(dump_path, 'rt', encoding='utf-8')
+        if dump_path.endswith('.bz2'):
+            return bz2.open(dump_path, 'rt', encoding='utf-8')
+
+        return open(dump_path, encoding='utf-8')
+
+    @staticmethod
+    def is_entity_dump(dump):
+        """ Entity dumps are a JSON array, or JSON lines, with one entity per line
+
+        :param dump: Dump file, rewound after the check
+        :return: Whether the dump is an entity dump instead of a SPARQL JSON result
+        """
+        first_line = dump.readline().strip().rstrip(',')
+        dump.seek(0)
+        if first_line.startswith('['):
+            return True
+        try:
+            return 'id' in json.loads(first_line)
+        except ValueError:
+            return False
+
+    @staticmethod
+    def read_sparql_dump(dump):
+        """ Reads the countries from the SPARQL JSON result of the data/get_wikidata_countries query
+
+        :param dump: Dump file
+        :return: Dataframe of countries
+        """
+        bindings = json.load(dump)['results']['bindings']
+
+        return pd.DataFrame([{'countryLabel': binding['countryLabel']['value'],
+                              'europeanUnion': binding['europeanUnion']['value'] in ('true', '1'),
+                              'coordinates': binding['coordinates']['value']} for binding in bindings],
+                            columns=CountryGazetteer.COLUMNS)
+
+    @staticmethod
+    def read_entity_dump(dump):
+        """ Reads the countries from a Wikidata JSON entity dump, with one entity per line
+
+        :param dump: Dump file
+        :return: Dataframe of countries
+        """
+        countries = dict()
+        european_members = set()
+
+        for line in dump:
+            line = line.strip().rstrip(',')
+            if not line.startswith('{'):
+                continue
+            entity = json.loads(line)
+            claims = entity.get('claims', {})
+            values = {prop: [claim['mainsnak'].get('datavalue', {}).get('value') for claim in claims.get(prop, [])]
+                      for prop in ('P31', 'P527', 'P625')}
+
+            if entity['id'] == CountryGazetteer.EUROPEAN_UNION:
+                european_members = {value['id'] for value in values['P527'] if value}
+            instance_of = {value['id'] for value in values['P31'] if value}
+            coordinates = [value for value in values['P625'] if value]
+            label = entity.get('labels', {}).get('en', {}).get('value')
+            if instance_of & CountryGazetteer.COUNTRY_CLASSES and coordinates and label:
+                countries[entity['id']] = {'countryLabel': label, 'coordinates': 'Point(' +
+                                           str(coordinates[0]['longitude']) + ' ' +
+                                           str(coordinates[0]['latitude']) + ')'}
+
+        return pd.DataFrame([dict(country, europeanUnion=item in european_members)
+                             for item, country in countries.items()], columns=CountryGazetteer.COLUMNS)
+
+    @staticmethod
+    def refresh(dump_path, version, gazetteer_path=GAZETTEER_PATH, version_path=VERSION_PATH):
+        """ Rebuilds the snapshot offline from a dump file, either the SPARQL JSON result of the
+        data/get_wikidata_countries query or a Wikidata JSON entity dump
+
+        :param dump_path: Dump file, optionally compressed with gzip or bzip2
+        :param version: Version of the new snapshot
+        :param gazetteer_path: CSV file of the snapshot
+        :param version_path: File with the version of the snapshot
+        :return: Dataframe of countries
+        """
+        with CountryGazetteer.open_dump(dump_path) as dump:
+            countries = CountryGazetteer.read_entity_dump(dump) if CountryGazetteer.is_entity_dump(dump) \
+                else CountryGazetteer.read_sparql_dump(dump)
+
+        countries = countries.drop_duplicates('countryLabel').sort_values('countryLabel')
+        countries['europeanUnion'] = countries['europeanUnion'].map({True: 'true', False: 'false'})
+        countries.to_csv(gazetteer_path, index=False)
+        Path(version_path).write_text(version)
+
+        with CountryGazetteer.snapshots_lock:
+            CountryGazetteer.snapshots.pop(gazetteer_path, None)
+
+        return countries
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import pickle
+import queue
+import re
+import threading
+import uuid
+import rdflib
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from http.client import HTTPConnection, HTTPSConnection, CannotSendRequest, RemoteDisconnected
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+from rdflib import BNode, Literal
+from rdflib.plugins.sparql import prepareQuery
+from tracing.Tracer import get_tracer
+
+
+class QueryBackend(ABC):
+    """ Abstract class for the execution of SPARQL queries against the StaDiOS ontology.
+    """
+
+    DEFAULT_PAGE_ROWS = 10000
+    PROJECTION = re.compile(r'\bSELECT\b(.*?)\bWHERE\b', re.IGNORECASE | re.DOTALL)
+
+    @abstractmethod
+    def query(self, sparql_query):
+        """ Runs a query and returns its result
+
+        :param sparql_query: StaDiOS sparql query
+        :return: Result in the SPARQL JSON format, already parsed
+        """
+        pass
+
+    @staticmethod
+    def get_page_query(sparql_query, order_variables=(), limit=None, offset=0):
+        """ Adds the solution modifiers of a page to a query. Rows are sorted by the given variables and then
+        by the rest of the projected ones, so the order is total and consecutive pages neither repeat nor skip
+        rows.
+
+        :param sparql_query: StaDiOS sparql query, without solution modifiers
+        :param order_variables: Variables by which the rows are sorted first
+        :param limit: Number of rows of the page, None for every row
+        :param offset: Position of the first row of the page
+        :return: Text of the query of the page
+        """
+        projection = QueryBackend.PROJECTION.search(sparql_query)
+        if projection is None:
+            raise Exception('Only SELECT queries can be paged')
+        order_variables = list(order_variables)
+        order_variables += [variable for variable in re.findall(r'[?$](\w+)', projection.group(1))
+                            if variable not in order_variables]
+
+        page_query = sparql_query + '\nORDER BY ' + ' '.join('?' + variable for variable in order_variables)
+        if limit is not None:
+            page_query += '\nLIMIT ' + str(limit) + ' OFFSET ' + str(offset)
+
+        return page_query
+
+    def query_pages(self, sparql_query, order_variables=(), page_rows=DEFAULT_PAGE_ROWS):
+        """ Runs a query one page of rows at a time with LIMIT and OFFSET, so only the response of a page is
+        held in memory
+
+        :param sparql_query: StaDiOS sparql query, without solution modifiers
+        :param order_variables: Variables by which the rows are sorted first, so the rows that share their
+        values are consecutive
+        :param page_rows: Number of rows of each page
+        :return: Generator of the result of each page in the SPARQL JSON format
+        """
+        offset = 0
+        while True:
+            result = self.query(self.get_page_query(sparql_query, order_variables, page_rows, offset))
+            rows = len(result['results']['bindings'])
+            if rows or not offset:
+                yield result
+            if rows < page_rows:
+                return
+            offset += page_rows
+
+
+class HttpQueryBackend(QueryBackend):
+    """ Backend that sends the queries to a SPARQL endpoint, such as the Fuseki server of StaDiOS.
+
+    Connections are kept alive in a pool and reused by the following queries, so concurrent queries do
+    not pay a new TCP handshake each, and queries are sent by POST so that long VALUES bindings fit.
+    """
+
+    DEFAULT_MAX_CONNECTIONS = 8
+    DEFAULT_TIMEOUT = 60
+    USER_AGENT = 'StaDiOS analysis'
+
+    def __init__(self, endpoint, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT):
+        """ Builder overload -- Initialize HttpQueryBackend parameters
+
+        :param endpoint: URL of the SPARQL endpoint
+        :param max_connections: Number of idle connections kept alive
+        :param timeout: Seconds to wait for the endpoint
+        """
+        self.endpoint = endpoint.strip()
+        self.url = urlsplit(self.endpoint)
+        if self.url.scheme not in ('http', 'https'):
+            raise Exception('Unknown endpoint scheme: ' + self.endpoint)
+        self.path = (self.url.path or '/') + ('?' + self.url.query if self.url.query else '')
+        self.timeout = timeout
+        self.connections = queue.LifoQueue(maxsize=max_connections)
+
+    def get_connection(self):
+        """
+        :return: Idle connection of the pool, or a new one if every connection is in use
+        """
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            connection_class = HTTPSConnection if self.url.scheme == 'https' else HTTPConnection
+            return connection_class(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def release_connection(self, connection):
+        try:
+            self.connections.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def post(self, connection, sparql_query):
+        """
+        :param connection: Connection to the endpoint
+        :param sparql_query: StaDiOS sparql query
+        :return: Status and body of the response
+        """
+        connection.request('POST', self.path, body=urlencode({'query': sparql_query}),
+                           headers={'Content-Type': 'application/x-www-form-urlencoded',
+                                    'Accept': 'application/sparql-results+json',
+                                    'User-Agent': self.USER_AGENT, 'Connection': 'keep-alive'})
+        response = connection.getresponse()
+
+        return response.status, response.read()
+
+    def query(self, sparql_query):
+        connection = self.get_connection()
+        try:
+            try:
+                status, body = self.post(connection, sparql_query)
+            except (RemoteDisconnected, CannotSendRequest, ConnectionError):
+                # The endpoint closed the idle connection, the query is sent again over a new one
+                connection.close()
+                status, body = self.post(connection, sparql_query)
+        except Exception:
+            connection.close()
+            raise
+        self.release_connection(connection)
+
+        get_tracer().count('bytesReceived', len(body))
+        if status != 200:
+            raise Exception('SPARQL endpoint error ' + str(status) + ': ' + body.decode('utf-8', 'replace')[:500])
+
+        return json.loads(body.decode('utf-8'))
+
+
+class LocalQueryBackend(QueryBackend):
+    """ Backend that answers the queries in process from the OWL file of the ontology.
+
+    The file is parsed once per process into an indexed in-memory graph, which is also pickled next to the
+    query cache so that later processes load it without parsing the OWL file again.
+    """
+
+    ONTOLOGY_PATH = '../ontology/StaDiOS.owl'
+    GRAPH_DIRECTORY = '.cache/ontology'
+
+    # Graphs already loaded in this process, by ontology hash
+    graphs = dict()
+    graphs_lock = threading.Lock()
+    # The SPARQL parser of rdflib is not thread-safe, so concurrent queries are answered one at a time
+    query_lock = threading.Lock()
+
+    def __init__(self, ontology_path=ONTOLOGY_PATH, graph_directory=GRAPH_DIRECTORY):
+        """ Builder overload -- Initialize LocalQueryBackend parameters
+
+        :param ontology_path: Path to the OWL file of the ontology
+        :param graph_directory: Directory for the pickled graphs, None to disable them
+        """
+        self.ontology_path = Path(ontology_path)
+        self.graph_directory = Path(graph_directory) if graph_directory is not None else None
+        self.graph = self.load_graph()
+
+    def load_graph(self):
+        """
+        :return: Graph of the ontology, parsed only if it is not already loaded or pickled
+        """
+        version = hashlib.sha256(self.ontology_path.read_bytes()).hexdigest()
+
+        with LocalQueryBackend.graphs_lock:
+            if version in LocalQueryBackend.graphs:
+                return LocalQueryBackend.graphs[version]
+
+            pickle_path = self.graph_directory / (version + '.pickle') if self.graph_directory else None
+            if pickle_path is not None and pickle_path.is_file():
+                graph = pickle.loads(pickle_path.read_bytes())
+            else:
+                graph = rdflib.Graph()
+                graph.parse(self.ontology_path)
+                if pickle_path is not None:
+                    self.graph_directory.mkdir(parents=True, exist_ok=True)
+                    temporary_path = pickle_path.with_suffix('.' + uuid.uuid4().hex + '.tmp')
+                    temporary_path.write_bytes(pickle.dumps(graph, protocol=pickle.HIGHEST_PROTOCOL))
+                    os.replace(temporary_path, pickle_path)
+
+            LocalQueryBackend.graphs[version] = graph
+
+        return graph
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def prepare_query(sparql_query):
+        """ Parsing is a large part of the local query time, so parsed queries are reused
+
+        :param sparql_query: StaDiOS sparql query
+        :return: Parsed query
+        """
+        return prepareQuery(sparql_query)
+
+    @staticmethod
+    def get_term_binding(term):
+        """
+        :param term: RDF term
+        :return: Term in the SPARQL JSON format
+        """
+        if isinstance(term, Literal):
+            binding = {'type': 'literal', 'value': str(term)}
+            if term.datatype is not None:
+                binding['datatype'] = str(term.datatype)
+            if term.language is not None:
+                binding['xml:lang'] = term.language
+            return binding
+        if isinstance(term, BNode):
+            return {'type': 'bnode', 'value': str(term)}
+
+        return {'type': 'uri', 'value': str(term)}
+
+    def get_result(self, variables, rows):
+        """
+        :param variables: Projected variables
+        :param rows: Rows of RDF terms
+        :return: Result in the SPARQL JSON format
+        """
+        bindings = [{variable: self.get_term_binding(term) for variable, term in zip(variables, row)
+                     if term is not None} for row in rows]
+
+        return {'head': {'vars': variables}, 'results': {'bindings': bindings}}
+
+    def query(self, sparql_query):
+        with LocalQueryBackend.query_lock:
+            result = self.graph.query(self.prepare_query(sparql_query))
+            variables = [str(variable) for variable in result.vars]
+
+            return self.get_result(variables, result)
+
+    def query_pages(self, sparql_query, order_variables=(), page_rows=QueryBackend.DEFAULT_PAGE_ROWS):
+        # The graph is in memory, so the sorted query is run once and only its terms are kept, while their
+        # conversion to the JSON format is done one page at a time
+        with LocalQueryBackend.query_lock:
+            result = self.graph.query(self.prepare_query(self.get_page_query(sparql_query, order_variables)))
+            variables = [str(variable) for variable in result.vars]
+            rows = list(result)
+
+        for start in range(0, max(len(rows), 1), page_rows):
+            yield self.get_result(variables, rows[start:start + page_rows])
+
+
+# HTTP backends shared by the whole process, so that their connections outlive each page run
+http_backends = dict()
+http_backends_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def read_setting(path):
+    """ Settings of the data directory are read once per process
+
+    :param path: File of the setting
+    :return: Value of the setting
+    """
+    return Path(path).read_text().strip()
+
+
+def get_endpoint():
+    """
+    :return: URL of the SPARQL endpoint configured in data/sparql_endpoint
+    """
+    return read_setting('data/sparql_endpoint')
+
+
+def get_query_backend(backend=None):
+    """ Builds the query backend set in the STADIOS_SPARQL_BACKEND environment variable or, otherwise,
+    configured in data/sparql_backend
+
+    :param backend: Name of the backend, 'http' or 'local', to override the configured one
+    :return: Query backend
+    """
+    if backend is None:
+        backend = os.environ.get('STADIOS_SPARQL_BACKEND') or read_setting('data/sparql_backend')
+
+    if backend == 'local':
+        return LocalQueryBackend()
+    if backend == 'http':
+        endpoint = get_endpoint()
+        with http_backends_lock:
+            if endpoint not in http_backends:
+                http_backends[endpoint] = HttpQueryBackend(endpoint)
+        return http_backends[endpoint]
+
+    raise Exception('Unknown query backend: ' + backend)
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import time
+import uuid
+import pandas as pd
+from pathlib import Path
+
+
+class QueryCache:
+    """ Persistent cache of SPARQL query results shared by every process of the application.
+
+    Each result is stored as a Parquet file named after the hash of the normalized query text and the
+    version of the dataset, so restarted workers and other replicas find it warm. Entries expire after
+    a time to live, and the least recently used ones are evicted when the cache exceeds its size.
+    """
+
+    DEFAULT_DIRECTORY = '.cache/sparql'
+    DEFAULT_TTL = 24 * 60 * 60
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+    ONTOLOGY_PATH = '../ontology/StaDiOS.owl'
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES,
+                 dataset_version=None):
+        """ Builder overload -- Initialize QueryCache parameters
+
+        :param directory: Directory where results are stored
+        :param ttl: Seconds after which a result expires, None to never expire
+        :param max_bytes: Maximum size of the cache on disk
+        :param dataset_version: Version stamp of the dataset, by default the hash of the ontology file
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.dataset_version = dataset_version if dataset_version is not None else self.get_ontology_version()
+
+    @staticmethod
+    def get_ontology_version(ontology_path=ONTOLOGY_PATH):
+        """
+        :param ontology_path: Path to the ontology file
+        :return: Hash of the ontology file, or an empty stamp when it is not available
+        """
+        path = Path(ontology_path)
+        if not path.is_file():
+            return ''
+
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+
+    @staticmethod
+    def normalize_query(sparql_query):
+        """
+        :param sparql_query: Sparql query
+        :return: Query text with its whitespace collapsed
+        """
+        return re.sub(r'\s+', ' ', sparql_query).strip()
+
+    def get_key(self, sparql_query):
+        """
+        :param sparql_query: Sparql query
+        :return: Cache key of the query for the current dataset version
+        """
+        text = self.dataset_version + '\n' + self.normalize_query(sparql_query)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_path(self, sparql_query):
+        return self.directory / (self.get_key(sparql_query) + '.parquet')
+
+    def get(self, sparql_query):
+        """ Looks up the result of a query
+
+        :param sparql_query: Sparql query
+        :return: Dataframe with the cached result, or None on a miss
+        """
+        path = self.get_path(sparql_query)
+        try:
+            modified = path.stat().st_mtime
+            if self.ttl is not None and time.time() - modified > self.ttl:
+                path.unlink()
+                return None
+            dataframe = pd.read_parquet(path)
+            # The access time records the last use of the entry for the LRU eviction
+            os.utime(path, (time.time(), modified))
+        except (FileNotFoundError, OSError):
+            return None
+
+        return dataframe
+
+    def put(self, sparql_query, dataframe):
+        """ Stores the result of a query and evicts entries if the cache is over its size
+
+        :param sparql_query: Sparql query
+        :param dataframe: Query result
+        """
+        path = self.get_path(sparql_query)
+        # Written to a temporary file first so that readers never see a partial result
+        temporary_path = path.with_suffix('.' + uuid.uuid4().hex + '.tmp')
+        dataframe.to_parquet(temporary_path, index=False)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self):
+        """ Removes expired entries and then the least recently used ones until the cache fits its size
+        """
+        entries = list()
+        now = time.time()
+
+        for path in self.directory.glob('*.parquet'):
+            try:
+                stat = path.stat()
+                if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                    path.unlink()
+                else:
+                    entries.append((stat.st_atime, stat.st_size, path))
+            except FileNotFoundError:
+                continue
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def invalidate(self, dataset_version=None):
+        """ Removes every entry, to be called when the ontology is reloaded
+
+        :param dataset_version: New version stamp of the dataset, by default the hash of the ontology file
+        """
+        for path in self.directory.glob('*.parquet'):
+            path.unlink(missing_ok=True)
+
+        self.dataset_version = dataset_version if dataset_version is not None else self.get_ontology_version()
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueryExecutor:
+    """ Executor that runs independent SPARQL queries concurrently on a pool of threads.
+
+    Queries spend most of their time waiting for the endpoint, so running them at the same time makes a
+    group of queries take about as long as the slowest of them instead of the sum of all of them.
+    """
+
+    DEFAULT_MAX_WORKERS = 8
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        """ Builder overload -- Initialize QueryExecutor parameters
+
+        :param max_workers: Number of queries run at the same time
+        """
+        self.max_workers = max_workers
+        self.thread_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stadios-query')
+
+    def submit(self, function, *arguments):
+        """
+        :param function: Function to run in the background, such as a query
+        :param arguments: Arguments of the function
+        :return: Future with the result of the function
+        """
+        return self.thread_pool.submit(function, *arguments)
+
+    def run_queries(self, query_function, sparql_queries):
+        """ Runs several queries at the same time and waits for all of them
+
+        :param query_function: Function that runs one query, such as SparqlManager.get_query
+        :param sparql_queries: Independent sparql queries
+        :return: Results of the queries, in the same order
+        """
+        futures = [self.thread_pool.submit(query_function, sparql_query) for sparql_query in sparql_queries]
+
+        return [future.result() for future in futures]
+
+    async def run_queries_async(self, query_function, sparql_queries):
+        """ Runs several queries at the same time from an event loop, without blocking it
+
+        :param query_function: Function that runs one query, such as SparqlManager.get_query
+        :param sparql_queries: Independent sparql queries
+        :return: Results of the queries, in the same order
+        """
+        loop = asyncio.get_running_loop()
+
+        return list(await asyncio.gather(*[loop.run_in_executor(self.thread_pool, query_function, sparql_query)
+                                           for sparql_query in sparql_queries]))
+
+
+# Executor shared by the whole process
+process_executor = None
+process_executor_lock = threading.Lock()
+
+
+def get_query_executor():
+    """
+    :return: Query executor shared by the whole process
+    """
+    global process_executor
+    with process_executor_lock:
+        if process_executor is None:
+            process_executor = QueryExecutor()
+
+    return process_executor
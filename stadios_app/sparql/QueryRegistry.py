@@ -0,0 +1,73 @@
+import re
+import threading
+from pathlib import Path
+from sparql.QueryTemplate import QueryTemplate
+
+
+class QueryRegistry:
+    """ Registry of the SPARQL query templates of the data directory.
+
+    Every query and the prefixes are read and validated once, when the registry is built, instead of
+    reading them from disk each time a query is run.
+    """
+
+    DATA_DIRECTORY = 'data'
+    PREFIXES_NAME = 'sparql_prefixes'
+
+    def __init__(self, directory=DATA_DIRECTORY):
+        """ Builder overload -- Initialize QueryRegistry parameters
+
+        :param directory: Directory with the queries and the prefixes
+        """
+        self.directory = Path(directory)
+        self.prefixes = (self.directory / self.PREFIXES_NAME).read_text()
+        self.templates = dict()
+
+        for path in sorted(self.directory.iterdir()):
+            if path.is_file() and not path.suffix and path.name != self.PREFIXES_NAME:
+                text = path.read_text()
+                if re.match(r'\s*SELECT\b', text, re.IGNORECASE):
+                    self.templates[path.name] = QueryTemplate(path.name, text, self.prefixes)
+
+    def get(self, name):
+        """
+        :param name: Name of the query in the data directory
+        :return: Template of the query
+        """
+        if name not in self.templates:
+            raise Exception('Unknown query template: ' + name)
+
+        return self.templates[name]
+
+    def bind(self, name, **bindings):
+        """
+        :param name: Name of the query in the data directory
+        :param bindings: Value or list of values of each variable
+        :return: Text of the query
+        """
+        return self.get(name).bind(**bindings)
+
+    def get_key(self, name, **bindings):
+        """
+        :param name: Name of the query in the data directory
+        :param bindings: Value or list of values of each variable
+        :return: Stable key of the template and bindings
+        """
+        return self.get(name).get_key(**bindings)
+
+
+# Registry shared by the whole process
+process_registry = None
+process_registry_lock = threading.Lock()
+
+
+def get_query_registry():
+    """
+    :return: Query registry shared by the whole process, loaded on first use
+    """
+    global process_registry
+    with process_registry_lock:
+        if process_registry is None:
+            process_registry = QueryRegistry()
+
+    return process_registry
@@ -0,0 +1,106 @@
+import hashlib
+import re
+from functools import lru_cache
+from rdflib import Literal, URIRef
+from rdflib.plugins.sparql import prepareQuery
+
+
+class QueryTemplate:
+    """ SPARQL query of the data directory whose parameters are bound with VALUES clauses.
+
+    The text of the query is fixed and the bindings are added at the start of its WHERE block, so the same
+    selection always produces the same query and every value is escaped. A variable may be bound to several
+    values, so one query can cover several diseases or studies.
+    """
+
+    STADIOS_NAMESPACE = 'http://www.semanticweb.org/storh/ontologies/2022/11/StaDiOS#'
+    XSD_STRING = 'http://www.w3.org/2001/XMLSchema#string'
+    # Variables bound to literals and their datatype, the rest are bound to IRIs of StaDiOS
+    LITERAL_DATATYPES = {'studyIdentifier': XSD_STRING}
+    LOCAL_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_\-]*(\.[A-Za-z0-9_\-]+)*')
+    IRI = re.compile(r'https?://[^\s<>"{}|\\^`]+')
+
+    def __init__(self, name, text, prefixes):
+        """ Builder overload -- Initialize QueryTemplate parameters
+
+        :param name: Name of the query in the data directory
+        :param text: Text of the query, whose WHERE block may be left open to add filters
+        :param prefixes: Prefixes of the query
+        """
+        self.name = name
+        opened_blocks = text.count('{') - text.count('}')
+        if opened_blocks not in (0, 1):
+            raise Exception('Unbalanced braces in query template ' + name)
+        where = re.search(r'\bWHERE\s*\{', text, re.IGNORECASE)
+        if where is None:
+            raise Exception('Query template ' + name + ' has no WHERE block')
+
+        self.head = prefixes + '\n' + text[:where.end()]
+        self.body = text[where.end():] + ('\n}' if opened_blocks else '')
+        self.variables = frozenset(re.findall(r'[?$](\w+)', text))
+        self.version = hashlib.sha256((self.head + self.body).encode('utf-8')).hexdigest()
+
+        try:
+            prepareQuery(self.head + self.body)
+        except Exception as error:
+            raise Exception('Invalid query template ' + name + ': ' + str(error))
+
+    def format_value(self, variable, value):
+        """
+        :param variable: Bound variable
+        :param value: Local name or IRI of a StaDiOS entity, or value of a literal variable
+        :return: Escaped term of the value
+        """
+        value = str(value)
+        if variable in self.LITERAL_DATATYPES:
+            return Literal(value, datatype=URIRef(self.LITERAL_DATATYPES[variable])).n3()
+        if self.LOCAL_NAME.fullmatch(value):
+            return 'std:' + value
+        if self.IRI.fullmatch(value):
+            return '<' + value + '>'
+
+        raise Exception('Invalid IRI for ?' + variable + ': ' + value)
+
+    def get_bindings(self, bindings):
+        """
+        :param bindings: Value or list of values of each variable
+        :return: Bindings sorted by variable and value, which identify the query whatever their order
+        """
+        canonical_bindings = list()
+        for variable, values in bindings.items():
+            if variable not in self.variables:
+                raise Exception('Query template ' + self.name + ' has no variable ?' + variable)
+            values = [values] if isinstance(values, str) or not hasattr(values, '__iter__') else list(values)
+            if not values:
+                raise Exception('No values bound to ?' + variable)
+            canonical_bindings.append((variable, tuple(sorted({str(value) for value in values}))))
+
+        return tuple(sorted(canonical_bindings))
+
+    @lru_cache(maxsize=1024)
+    def get_query(self, canonical_bindings=()):
+        """
+        :param canonical_bindings: Bindings returned by get_bindings
+        :return: Text of the query with a VALUES clause for each bound variable
+        """
+        values = ''.join('\n    VALUES ?' + variable + ' { ' +
+                         ' '.join(self.format_value(variable, value) for value in variable_values) + ' }'
+                         for variable, variable_values in canonical_bindings)
+
+        return self.head + values + self.body
+
+    def bind(self, **bindings):
+        """
+        :param bindings: Value or list of values of each variable, such as disease='PBD_ProfoundBiotinidaseDeficiency'
+        :return: Text of the query
+        """
+        return self.get_query(self.get_bindings(bindings))
+
+    def get_key(self, **bindings):
+        """
+        :param bindings: Value or list of values of each variable
+        :return: Stable key of the template and bindings, which changes when the template does
+        """
+        text = self.name + '\n' + self.version + '\n' + repr(self.get_bindings(bindings))
+
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
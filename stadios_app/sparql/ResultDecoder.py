@@ -0,0 +1,306 @@
+import codecs
+import csv
+import io
+import itertools
+import json
+import re
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+class ResultDecoder:
+    """ Class for decoding SPARQL query results into typed columnar dataframes.
+
+    Each variable of the result is decoded as a whole column: literals are converted according to their
+    datatype, and IRIs are stored as categoricals whose categories have the StaDiOS namespace removed.
+    """
+
+    STADIOS_NAMESPACE = 'http://www.semanticweb.org/storh/ontologies/2022/11/StaDiOS#'
+    XSD_NAMESPACE = 'http://www.w3.org/2001/XMLSchema#'
+    INTEGER_TYPES = {'integer', 'int', 'long', 'short', 'byte', 'nonNegativeInteger', 'positiveInteger',
+                     'nonPositiveInteger', 'negativeInteger', 'unsignedLong', 'unsignedInt', 'unsignedShort',
+                     'unsignedByte'}
+    FLOAT_TYPES = {'double', 'float', 'decimal'}
+    # Rows decoded at a time, and characters read at a time from files
+    CHUNK_ROWS = 4096
+    READ_SIZE = 1 << 20
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, namespace=STADIOS_NAMESPACE):
+        """ Builder overload -- Initialize ResultDecoder parameters
+
+        :param namespace: Namespace removed from IRIs and literals
+        """
+        self.namespace = namespace
+
+    def strip_namespace(self, values):
+        """
+        :param values: Series of strings
+        :return: Series with the namespace removed
+        """
+        return values.str.replace(self.namespace, '', regex=False)
+
+    def decode_iris(self, values):
+        """ IRIs are repeated on many rows, so the namespace is only removed from the categories
+
+        :param values: Series of IRIs
+        :return: Categorical series of IRIs without namespace
+        """
+        values = values.astype('category')
+        categories = self.strip_namespace(values.cat.categories.to_series())
+        if categories.is_unique:
+            return values.cat.rename_categories(categories.values)
+
+        return self.strip_namespace(values.astype(object)).astype('category')
+
+    def decode_column(self, values, kinds):
+        """ Decodes a column according to the kind of its terms
+
+        :param values: Series with the lexical value of each term
+        :param kinds: Set with the datatype, or the term type when it has no datatype, of each term
+        :return: Decoded series
+        """
+        kinds = kinds - {None}
+        if kinds == {'uri'}:
+            return self.decode_iris(values)
+
+        datatypes = {kind.replace(self.XSD_NAMESPACE, '') for kind in kinds}
+        if datatypes and datatypes <= self.INTEGER_TYPES | self.FLOAT_TYPES:
+            values = pd.to_numeric(values)
+            if datatypes <= self.FLOAT_TYPES:
+                values = values.astype(np.float64)
+            return values
+        if datatypes == {'boolean'}:
+            return values.map({'true': True, 'false': False, '1': True, '0': False})
+
+        if values.str.contains(self.namespace, regex=False, na=False).any():
+            return self.strip_namespace(values)
+        return values
+
+    def iter_json_members(self, result):
+        """ Parses a result in the SPARQL JSON format incrementally. Files are read in blocks, and the
+        bindings are given one at a time, so the list of bindings is never built whole
+
+        :param result: JSON text, bytes or file
+        :return: Generator of pairs with the name and value of each member of the result and of its results
+        member, where each binding is given on its own with the name 'binding'
+        """
+        decoder = json.JSONDecoder()
+        text = result if isinstance(result, str) else ''
+        position = 0
+        reader = None if isinstance(result, str) else io.BytesIO(result) if isinstance(result, bytes) else result
+        utf8 = codecs.getincrementaldecoder('utf-8')()
+
+        def fill():
+            # Appends the next block of the file to the text that has not been parsed yet
+            nonlocal text, position, reader
+            while reader is not None:
+                block = reader.read(self.READ_SIZE)
+                if not block:
+                    reader = None
+                    block = utf8.decode(b'', final=True)
+                elif isinstance(block, bytes):
+                    block = utf8.decode(block)
+                if block:
+                    text = text[position:] + block
+                    position = 0
+                    return True
+            return False
+
+        def peek():
+            nonlocal position
+            while True:
+                position = self.WHITESPACE.match(text, position).end()
+                if position < len(text) or not fill():
+                    return text[position:position + 1]
+
+        def expect(characters):
+            nonlocal position
+            character = peek()
+            if not character or character not in characters:
+                raise Exception('Malformed SPARQL JSON result, expected one of ' + characters)
+            position += 1
+            return character
+
+        def value():
+            # A value that ends with the text read so far may continue in the next block
+            nonlocal position
+            peek()
+            while True:
+                try:
+                    parsed, end = decoder.raw_decode(text, position)
+                except json.JSONDecodeError:
+                    if fill():
+                        continue
+                    raise
+                if end < len(text) or not fill():
+                    position = end
+                    return parsed
+
+        def iter_keys():
+            expect('{')
+            if peek() == '}':
+                expect('}')
+                return
+            while True:
+                key = value()
+                expect(':')
+                yield key
+                if expect(',}') == '}':
+                    return
+
+        for name in iter_keys():
+            if name != 'results':
+                yield name, value()
+                continue
+            for results_name in iter_keys():
+                if results_name != 'bindings':
+                    yield results_name, value()
+                    continue
+                expect('[')
+                if peek() == ']':
+                    expect(']')
+                    continue
+                while True:
+                    yield 'binding', value()
+                    if expect(',]') == ']':
+                        break
+
+    def decode_json(self, result):
+        """ Decodes a result in the SPARQL JSON format. Its JSON text, bytes or file is parsed incrementally,
+        while a result already parsed is decoded in the same chunks of rows
+
+        :param result: Result already parsed, or its JSON text, bytes or file
+        :return: Dataframe with one typed column per variable
+        """
+        if isinstance(result, dict):
+            return self.decode_bindings(result['head']['vars'], result['results']['bindings'])
+
+        members = self.iter_json_members(result)
+        bindings = list()
+        for name, value in members:
+            if name == 'head':
+                variables = value['vars']
+                # The bindings usually follow the head, and then they are decoded as they are parsed
+                remaining = (value for name, value in members if name == 'binding')
+                return self.decode_bindings(variables, itertools.chain(bindings, remaining))
+            if name == 'binding':
+                bindings.append(value)
+
+        raise Exception('The SPARQL JSON result does not have a head')
+
+    def decode_bindings(self, variables, bindings):
+        """ Decodes the bindings of a result in chunks of rows. The IRIs of each chunk are stored as
+        categoricals as soon as it is read, so only their distinct values are kept, while literals keep their
+        lexical values until every chunk has been read and the datatypes of their column are known
+
+        :param variables: Variables of the result
+        :param bindings: Iterable of the bindings of each row
+        :return: Dataframe with one typed column per variable
+        """
+        bindings = iter(bindings)
+        chunks = {variable: list() for variable in variables}
+        kinds = {variable: set() for variable in variables}
+
+        while True:
+            chunk = list(itertools.islice(bindings, self.CHUNK_ROWS))
+            if not chunk:
+                break
+            for variable in variables:
+                terms = [binding.get(variable) for binding in chunk]
+                values = [term['value'] if term is not None else None for term in terms]
+                chunk_kinds = {term.get('datatype', term['type']) if term is not None else None for term in terms}
+                kinds[variable] |= chunk_kinds
+                chunks[variable].append(pd.Categorical(values) if chunk_kinds == {'uri'}
+                                        else np.array(values, dtype=object))
+
+        columns = dict()
+        for variable in variables:
+            columns[variable] = self.decode_column(self.concat_values(chunks.pop(variable), kinds[variable]),
+                                                   kinds[variable])
+
+        return pd.DataFrame(columns, columns=variables)
+
+    @staticmethod
+    def concat_values(chunks, kinds):
+        """
+        :param chunks: Values of a variable in each chunk, as categoricals or object arrays
+        :param kinds: Set with the datatype, or the term type when it has no datatype, of every term
+        :return: Series with the values of every chunk, categorical when all of them are IRIs
+        """
+        if chunks and kinds - {None} == {'uri'}:
+            return pd.Series(union_categoricals([chunk if isinstance(chunk, pd.Categorical) else pd.Categorical(chunk)
+                                                 for chunk in chunks], sort_categories=True))
+
+        return pd.Series(np.concatenate([np.asarray(chunk, dtype=object) for chunk in chunks]) if chunks else [],
+                         dtype=object)
+
+    @staticmethod
+    def concat_chunks(chunks):
+        """ Concatenates the dataframes decoded from several pages of a result. Their categoricals are
+        decoded separately, so they are given the union of their categories to remain categoricals.
+
+        :param chunks: Dataframes with the same columns
+        :return: Single dataframe
+        """
+        chunks = list(chunks)
+        dtypes = dict()
+        for column in chunks[0].columns:
+            if all(isinstance(chunk[column].dtype, pd.CategoricalDtype) for chunk in chunks):
+                dtypes[column] = pd.CategoricalDtype(union_categoricals([chunk[column] for chunk in chunks]).categories)
+
+        return pd.concat([chunk.astype(dtypes) for chunk in chunks], ignore_index=True)
+
+    def decode_csv(self, result):
+        """ Decodes a result in the SPARQL CSV format, which does not include datatypes
+
+        :param result: CSV text or file
+        :return: Dataframe with one typed column per variable
+        """
+        if isinstance(result, str):
+            result = io.StringIO(result)
+        dataframe = pd.read_csv(result, dtype=str, keep_default_na=False, na_values=[''])
+        columns = dict()
+
+        for variable in dataframe.columns:
+            values = dataframe[variable].astype(object)
+            present = values.dropna()
+            if len(present) and present.str.match(r'^(https?|urn):').all():
+                columns[variable] = self.decode_iris(values)
+            else:
+                numeric_values = pd.to_numeric(values, errors='coerce')
+                is_numeric = len(present) and numeric_values.notna().sum() == len(present)
+                columns[variable] = numeric_values if is_numeric else self.decode_column(values, set())
+
+        return pd.DataFrame(columns, columns=dataframe.columns)
+
+    def decode_tsv(self, result):
+        """ Decodes a result in the SPARQL TSV format, whose terms are written in their Turtle syntax
+
+        :param result: TSV text or file
+        :return: Dataframe with one typed column per variable
+        """
+        if isinstance(result, str):
+            result = io.StringIO(result)
+        dataframe = pd.read_csv(result, sep='\t', dtype=str, keep_default_na=False, na_values=[''],
+                                quoting=csv.QUOTE_NONE)
+        dataframe.columns = [column.lstrip('?') for column in dataframe.columns]
+        columns = dict()
+
+        for variable in dataframe.columns:
+            terms = dataframe[variable].str.extract(r'^(?:<(?P<iri>[^>]*)>|"(?P<literal>.*)"'
+                                                    r'(?:\^\^<(?P<datatype>[^>]*)>|@[\w-]+)?|(?P<bare>.*))$')
+            if terms['iri'].notna().any() and terms['iri'].notna().sum() == dataframe[variable].notna().sum():
+                columns[variable] = self.decode_iris(terms['iri'].astype(object))
+                continue
+
+            # Numbers and booleans may be written without quotes in their abbreviated form
+            values = terms['literal'].fillna(terms['bare']).fillna(terms['iri']).astype(object)
+            datatypes = set(terms['datatype'].dropna().unique())
+            bare = terms['bare'].dropna()
+            if not datatypes and len(bare) and pd.to_numeric(bare, errors='coerce').notna().all():
+                datatypes = {'double'}
+            columns[variable] = self.decode_column(values, datatypes)
+
+        return pd.DataFrame(columns, columns=dataframe.columns)
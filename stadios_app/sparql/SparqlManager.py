@@ -1,21 +1,39 @@
+import threading
+import numpy as np
 import pandas as pd
-import re
-from SPARQLWrapper import SPARQLWrapper, JSON
-from pathlib import Path
-from pandas import json_normalize
-from geopy.distance import geodesic as gd
+from sparql.CoordinateIndex import CoordinateIndex
+from sparql.CountryGazetteer import CountryGazetteer
+from sparql.QueryBackend import get_endpoint, get_query_backend
+from sparql.QueryCache import QueryCache
+from sparql.QueryExecutor import get_query_executor
+from sparql.QueryRegistry import get_query_registry
+from sparql.ResultDecoder import ResultDecoder
+from tracing.Tracer import get_tracer
 
 
 class SparqlManager:
     """ Class for obtaining diverse inference from the StaDiOS ontology
     """
 
+    # Selection lists shared by every session, with the version of the dataset they were loaded from
+    selection_parameters = (None, None)
+    selection_refresh = None
+    selection_lock = threading.Lock()
+
     def __init__(self):
         """ Builder overload -- Initialize SparqlManager parameters
         """
-        self.endpoint = Path('data/sparql_endpoint').read_text()
-        self.sparql_wrapper = SPARQLWrapper(self.endpoint, agent="SparqlWrapper - StaDiOS analysis")
-        self.prefixes = Path('data/sparql_prefixes').read_text()
+        self.endpoint = get_endpoint()
+        self.query_backend = get_query_backend()
+        self.query_registry = get_query_registry()
+        self.prefixes = self.query_registry.prefixes
+        self.query_cache = QueryCache()
+        self.result_decoder = ResultDecoder()
+        self.tracer = get_tracer()
+        self.query_executor = get_query_executor()
+        self.country_gazetteer = CountryGazetteer()
+        self.country_parameters = dict()
+        self.coordinate_indexes = dict()
 
     def get_query(self, sparql_query):
         """ Method to perform any standard query to the StaDiOS ontology and save
@@ -24,35 +42,38 @@ class SparqlManager:
         :param sparql_query: Custom Sparql query
         :return: Dataframe with query results
         """
-        self.sparql_wrapper.setQuery(sparql_query)
-        self.sparql_wrapper.setReturnFormat(JSON)
-
-        # Ask for the result in JSON format
-        result = self.sparql_wrapper.query().convert()
-        result = json_normalize(result["results"]["bindings"])
-
-        simplified_table = result.filter(regex='value')
-        simplified_table = simplified_table.rename(columns=lambda col: col.replace(".value", ""))
-        simplified_table = simplified_table.apply(
-            lambda row: row.replace({'http://www.semanticweb.org/storh/ontologies/2022/11/StaDiOS#': ''}, regex=True))
+        with self.tracer.span('query') as span:
+            cached_table = self.query_cache.get(sparql_query)
+            if cached_table is not None:
+                span.add('cacheHits')
+                span.set('rows', len(cached_table))
+                return cached_table
+            span.add('cacheMisses')
+
+            # Ask for the result in JSON format and decode it into typed columns
+            with self.tracer.span('sparql'):
+                result = self.query_backend.query(sparql_query)
+            with self.tracer.span('decode', rows=len(result['results']['bindings'])):
+                simplified_table = self.result_decoder.decode_json(result)
+            self.query_cache.put(sparql_query, simplified_table)
+            span.set('rows', len(simplified_table))
 
         return simplified_table
 
-    def get_selection_parameters(self):
-        """
+    def load_selection_parameters(self):
+        """ The queries of the lists are independent, so they are run at the same time
+
         :return: Parameters loaded in StaDiOS that we need to select to generate our analysis
         """
-        selection_parameters = self.get_query(self.prefixes + '\n' +
-                                              Path('data/get_selection_parameters').read_text())
-        study_identifier_parameter = self.get_query(self.prefixes + '\n' +
-                                                    Path('data/get_study_identifiers').read_text())
-        countries_parameter = self.get_query(self.prefixes + '\n' +
-                                             Path('data/get_parameters_countries').read_text())
-
-        diseases_list = selection_parameters.disease.unique()
-        developments_list = selection_parameters.development.unique()
-        follow_up_list = selection_parameters.followUpStrategy.unique()
-        treatmets_list = selection_parameters.treatmentStrategy.unique()
+        selection_parameters, study_identifier_parameter, countries_parameter = self.query_executor.run_queries(
+            self.get_query, [self.query_registry.bind(query_name) for query_name in
+                             ('get_selection_parameters', 'get_study_identifiers', 'get_parameters_countries')])
+
+        # IRIs are decoded as categoricals, the lists of options are plain arrays
+        diseases_list = np.asarray(selection_parameters.disease.unique())
+        developments_list = np.asarray(selection_parameters.development.unique())
+        follow_up_list = np.asarray(selection_parameters.followUpStrategy.unique())
+        treatmets_list = np.asarray(selection_parameters.treatmentStrategy.unique())
         study_identifiers_list = study_identifier_parameter.studyIdentifier.unique()
         study_identifiers_list = study_identifiers_list[study_identifiers_list != 'Default_study']
         countries_list = countries_parameter.country.unique()
@@ -61,6 +82,45 @@ class SparqlManager:
         return [diseases_list, developments_list, follow_up_list, treatmets_list,
                 study_identifiers_list, countries_list]
 
+    def refresh_selection_parameters(self, dataset_version):
+        """
+        :param dataset_version: Version of the dataset whose lists are loaded
+        :return: Parameters loaded in StaDiOS that we need to select to generate our analysis
+        """
+        parameters_list = self.load_selection_parameters()
+        with SparqlManager.selection_lock:
+            SparqlManager.selection_parameters = (dataset_version, parameters_list)
+
+        return parameters_list
+
+    def get_selection_parameters(self):
+        """ The lists are shared by every session of the process. When the dataset changes, the lists of the
+        previous version are returned while the new ones are loaded in the background.
+
+        :return: Parameters loaded in StaDiOS that we need to select to generate our analysis
+        """
+        dataset_version = self.query_cache.dataset_version
+        with SparqlManager.selection_lock:
+            parameters_version, parameters_list = SparqlManager.selection_parameters
+            if parameters_list is not None:
+                if parameters_version != dataset_version and \
+                        (SparqlManager.selection_refresh is None or not SparqlManager.selection_refresh.is_alive()):
+                    # The refresh waits for queries run on the pool of the executor, so it does not take a worker
+                    SparqlManager.selection_refresh = threading.Thread(target=self.refresh_selection_parameters,
+                                                                       args=(dataset_version,), daemon=True,
+                                                                       name='stadios-selection-refresh')
+                    SparqlManager.selection_refresh.start()
+                return parameters_list
+
+        return self.refresh_selection_parameters(dataset_version)
+
+    @staticmethod
+    def invalidate_selection_parameters():
+        """ Drops the shared lists, so that the next call loads them again before returning
+        """
+        with SparqlManager.selection_lock:
+            SparqlManager.selection_parameters = (None, None)
+
     def get_common_treament(self, disease, development):
         """ We obtain treatments that have in common the manifestations of a disease under a
         specific development.
@@ -69,11 +129,7 @@ class SparqlManager:
         :param development: Disease-specific development
         :return: Intersection dataframe
         """
-        filter_option = "\n FILTER(?disease = std:" + disease + " && ?development = std:" + \
-                        development + ") . } \n"
-
-        query = self.prefixes + '\n' + \
-                Path('data/get_manifestations_treatments').read_text() + filter_option
+        query = self.query_registry.bind('get_manifestations_treatments', disease=disease, development=development)
         dataframe = self.get_query(query)
         dataframe = dataframe.drop(dataframe[dataframe.treatment == "DefaultTreatmentStrategy"].index)
 
@@ -87,28 +143,45 @@ class SparqlManager:
         :param development: Disease-specific development
         :return: Intersection dataframe
         """
-        filter_option = "\n FILTER(?disease = std:" + disease + " && ?development = std:" + \
-                        development + ") . } \n"
-
-        query = self.prefixes + '\n' + Path('data/get_manifestations_follow_up').read_text() + filter_option
+        query = self.query_registry.bind('get_manifestations_follow_up', disease=disease, development=development)
         dataframe = self.get_query(query)
         dataframe = dataframe.drop(dataframe[dataframe.followUp == "DefaultFollowUpStrategy"].index)
 
         return dataframe
 
+    def get_country_parameters(self, query_name, columns, european_only=False):
+        """ We obtain the parameters of a query joined with the countries of the local gazetteer.
+        The joined parameters are kept in memory for each version of the dataset and the gazetteer.
+
+        :param query_name: Name of the query in the data directory
+        :param columns: Columns of the joined parameters, whose repeated rows are removed
+        :param european_only: Keep only the countries of the European Union
+        :return: Key of the joined parameters and dataframe with them
+        """
+        query = self.query_registry.bind(query_name)
+        key = (self.query_cache.get_key(query), self.country_gazetteer.version, european_only)
+
+        if key not in self.country_parameters:
+            with self.tracer.span('country_join', query=query_name):
+                dataframe = self.country_gazetteer.join_parameters(self.get_query(query), european_only=european_only)
+                self.country_parameters[key] = dataframe[columns].drop_duplicates(ignore_index=True)
+
+        return key, self.country_parameters[key]
+
     def get_european_parameters(self, study_identifier):
         """ We obtain all the parameters of a study that are within the European Union.
 
         :param study_identifier: Study unique identifier
         :return: Intersection dataframe
         """
-        query = self.prefixes + '\n' + Path('data/get_european_parameters').read_text()
-        dataframe = self.get_query(query)
+        _, dataframe = self.get_country_parameters('get_european_parameters',
+                                                   ['parameterType', 'parameter', 'studyIdentifier',
+                                                    'parameterCountry', 'countryLabel'], european_only=True)
 
         if study_identifier != 'ALL':
-            dataframe = dataframe.loc[(dataframe['studyIdentifier'] == study_identifier)]
+            return dataframe.loc[(dataframe['studyIdentifier'] == study_identifier)]
 
-        return dataframe
+        return dataframe.copy()
 
     def get_parameters_coordinates(self, disease, study_identifier, country, parameter_type):
         """ We obtain the parameters loaded in StaDiOS associated with a type of disease and parameter.
@@ -120,14 +193,26 @@ class SparqlManager:
         :param parameter_type: Type of parameter to be analyzed
         :return: Intersection dataframe
         """
-        query = self.prefixes + '\n' + Path('data/get_parameters_coordinates').read_text()
-        aux_dataframe = self.get_nearest_param(self.get_query(query), disease, study_identifier,
-                                               country, parameter_type)
+        with self.tracer.span('get_parameters_coordinates') as span:
+            key, dataframe = self.get_country_parameters('get_parameters_coordinates',
+                                                         ['disease', 'development', 'parameterType', 'parameter',
+                                                          'studyIdentifier', 'countryLabel', 'coordinates'])
+
+            # The coordinates are indexed once and reused by the following lookups
+            if key not in self.coordinate_indexes:
+                with self.tracer.span('coordinate_index', rows=len(dataframe)):
+                    self.coordinate_indexes[key] = CoordinateIndex(dataframe['coordinates'])
+
+            with self.tracer.span('nearest'):
+                aux_dataframe = self.get_nearest_param(dataframe, disease, study_identifier,
+                                                       country, parameter_type, self.coordinate_indexes[key])
+            span.set('rows', len(aux_dataframe))
 
         return aux_dataframe
 
     @staticmethod
-    def get_nearest_param(dataframe, disease, study_identifier, country_label, parameter_type):
+    def get_nearest_param(dataframe, disease, study_identifier, country_label, parameter_type,
+                          coordinate_index=None):
         """ We obtain the parameters loaded in StaDiOS associated with a type of disease and parameter.
         These parameters will be sorted by geographical distance.
 
@@ -136,31 +221,30 @@ class SparqlManager:
         :param study_identifier: Study unique identifier
         :param country_label: Country serving as point of origin
         :param parameter_type: Type of parameter to be analyzed
+        :param coordinate_index: Index of the coordinates of the dataframe, built if it is not given
         :return: Intersection dataframe
         """
+        if coordinate_index is None:
+            coordinate_index = CoordinateIndex(dataframe['coordinates'])
 
         # We are left with the available countries and parameters
-        distance_list = list()
-        aux_table = dataframe[dataframe['disease'] == disease]
-        aux_table = aux_table.reset_index()
+        disease_parameters = (dataframe['disease'] == disease).to_numpy()
+        study_parameters = (dataframe['studyIdentifier'] == study_identifier).to_numpy()
 
         # From a country and study of origin we obtain its coordinates
-        origin_coordinates = aux_table[(aux_table['countryLabel'] == country_label) & \
-                                       (aux_table['studyIdentifier'] == study_identifier)]
-        origin_coordinates = re.findall(r'([^( )]+)(?!.*\()', origin_coordinates.iloc[0]['coordinates'])
-        origin = (origin_coordinates[0], origin_coordinates[1])
+        origin = np.flatnonzero(disease_parameters & study_parameters &
+                                (dataframe['countryLabel'] == country_label).to_numpy())[0]
+        origin_latitude = coordinate_index.latitudes[coordinate_index.codes[origin]]
+        origin_longitude = coordinate_index.longitudes[coordinate_index.codes[origin]]
 
         # We calculate the distances of the rest of the parameters with respect to the point of origin
-        for index, row in aux_table.iterrows():
-            if row['studyIdentifier'] != study_identifier and row['parameterType'] == parameter_type:
-                coordinates = re.findall(r'([^( )]+)(?!.*\()', row['coordinates'])
-                destination = (coordinates[0], coordinates[1])
-                distance = gd(destination, origin).km
-                distance_list.append(
-                    {'countryLabel': row['countryLabel'], 'distance': distance, 'distanceUnit': 'km',
-                     'studyIdentifier': row['studyIdentifier'], 'parameterType': row['parameterType'],
-                     'parameterName': row['parameter'],
-                     })
-
-        sorted_distances = sorted(distance_list, key=lambda p: p['distance'])
-        return pd.DataFrame(sorted_distances)
+        candidates = disease_parameters & ~study_parameters & (dataframe['parameterType'] == parameter_type).to_numpy()
+        positions, distances = coordinate_index.query(origin_latitude, origin_longitude,
+                                                      candidates=candidates, exact=True)
+
+        nearest_parameters = dataframe.iloc[positions]
+        return pd.DataFrame({'countryLabel': nearest_parameters['countryLabel'].to_numpy(),
+                             'distance': distances, 'distanceUnit': 'km',
+                             'studyIdentifier': nearest_parameters['studyIdentifier'].to_numpy(),
+                             'parameterType': nearest_parameters['parameterType'].to_numpy(),
+                             'parameterName': nearest_parameters['parameter'].to_numpy()})
@@ -0,0 +1,81 @@
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+
+class TraceExporter(ABC):
+    """ Abstract class for the exporters of finished traces.
+    """
+
+    @abstractmethod
+    def export(self, trace):
+        """
+        :param trace: Spans of a finished trace
+        """
+        pass
+
+
+class LogTraceExporter(TraceExporter):
+    """ Exporter that writes each span as a structured JSON log record.
+    """
+
+    def __init__(self, logger_name='stadios.tracing'):
+        self.logger = logging.getLogger(logger_name)
+
+    def export(self, trace):
+        for span in trace:
+            self.logger.info(json.dumps({'traceId': span.trace_id, 'spanId': span.span_id,
+                                         'parentSpanId': span.parent.span_id if span.parent is not None else None,
+                                         'name': span.name, 'durationMs': (span.end_time - span.start_time) / 1e6,
+                                         'attributes': span.attributes}, default=str))
+
+
+class OtlpFileExporter(TraceExporter):
+    """ Exporter that appends each trace to a file as a line of OpenTelemetry OTLP/JSON, which the
+    OpenTelemetry Collector can read with its file receiver.
+    """
+
+    SCOPE = {'name': 'stadios_app'}
+
+    def __init__(self, path, service_name='stadios-app'):
+        """ Builder overload -- Initialize OtlpFileExporter parameters
+
+        :param path: File where the traces are appended
+        :param service_name: Name of the service of the traces
+        """
+        self.path = path
+        self.resource = {'attributes': [self.get_attribute('service.name', service_name)]}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_attribute(key, value):
+        """
+        :param key: Name of the attribute
+        :param value: Value of the attribute
+        :return: Attribute in the OTLP/JSON format
+        """
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    def get_span(self, span):
+        otlp_span = {'traceId': span.trace_id, 'spanId': span.span_id, 'name': span.name, 'kind': 1,
+                     'startTimeUnixNano': str(span.start_time), 'endTimeUnixNano': str(span.end_time),
+                     'attributes': [self.get_attribute(key, value) for key, value in span.attributes.items()],
+                     'status': {'code': 2 if 'error' in span.attributes else 1}}
+        if span.parent is not None:
+            otlp_span['parentSpanId'] = span.parent.span_id
+
+        return otlp_span
+
+    def export(self, trace):
+        line = json.dumps({'resourceSpans': [{'resource': self.resource, 'scopeSpans': [
+            {'scope': self.SCOPE, 'spans': [self.get_span(span) for span in trace]}]}]})
+        with self.lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(line + '\n')
@@ -0,0 +1,253 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+import pandas as pd
+from tracing.TraceExporter import LogTraceExporter, OtlpFileExporter
+
+
+class Span:
+    """ Timed stage of a trace, with attributes such as row counts or cache hits.
+    """
+
+    def __init__(self, tracer, name, attributes):
+        """ Builder overload -- Initialize Span parameters
+
+        :param tracer: Tracer that records the span
+        :param name: Name of the stage
+        :param attributes: Initial attributes of the span
+        """
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.trace_id = None
+        self.span_id = os.urandom(8).hex()
+        self.start_time = None
+        self.end_time = None
+        self.start_counter = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, value=1):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def __enter__(self):
+        self.tracer.start_span(self)
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception is not None:
+            self.attributes['error'] = repr(exception)
+        self.tracer.end_span(self)
+        return False
+
+
+class NullSpan:
+    """ Span returned while tracing is disabled, which records nothing.
+    """
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, value=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+
+class TraceSession:
+    """ Scope of the spans started by a thread on behalf of a session, such as a rerun of a Streamlit page.
+    """
+
+    def __init__(self, tracer, key, enabled):
+        """ Builder overload -- Initialize TraceSession parameters
+
+        :param tracer: Tracer that records the spans of the session
+        :param key: Key under which the traces of the session are kept
+        :param enabled: Record the spans of the session even while the tracer is disabled
+        """
+        self.tracer = tracer
+        self.key = key
+        self.enabled = enabled
+        self.previous = None
+
+    def __enter__(self):
+        local = self.tracer.local
+        self.previous = (getattr(local, 'session_key', None), getattr(local, 'session_enabled', False))
+        local.session_key, local.session_enabled = self.key, self.enabled
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.tracer.local.session_key, self.tracer.local.session_enabled = self.previous
+        return False
+
+
+class Tracer:
+    """ Process-wide recorder of timing spans for the stages of the application.
+
+    Spans nest within the current thread, and when a root span ends its whole trace is kept in memory
+    and handed to the exporters. The tracer records every span while it is enabled, and otherwise only
+    those of the sessions that enable tracing for themselves, whose last trace is kept by session. While
+    nothing is recorded, span() returns a shared NullSpan, so an instrumented stage only pays for a few
+    attribute lookups.
+    """
+
+    NULL_SPAN = NullSpan()
+
+    def __init__(self, enabled=False, max_traces=32, max_sessions=256):
+        """ Builder overload -- Initialize Tracer parameters
+
+        :param enabled: Record spans from the start
+        :param max_traces: Number of finished traces kept in memory
+        :param max_sessions: Number of sessions whose last trace is kept in memory
+        """
+        self.enabled = enabled
+        self.exporters = list()
+        self.traces = deque(maxlen=max_traces)
+        self.session_traces = OrderedDict()
+        self.max_sessions = max_sessions
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def session(self, key, enabled=False):
+        """
+        :param key: Key under which the traces of the session are kept
+        :param enabled: Record the spans of the session even while the tracer is disabled
+        :return: Context manager that scopes the spans of the current thread to the session
+        """
+        return TraceSession(self, key, enabled)
+
+    def span(self, name, enabled=None, **attributes):
+        """
+        :param name: Name of the stage
+        :param enabled: Record the span even while the tracer is disabled, by default only within a session
+        that enables tracing or within a recorded span
+        :param attributes: Initial attributes of the span
+        :return: Context manager that times the stage
+        """
+        if not (self.enabled or enabled or getattr(self.local, 'session_enabled', False)
+                or getattr(self.local, 'stack', None)):
+            return self.NULL_SPAN
+
+        return Span(self, name, attributes)
+
+    def current_span(self):
+        """
+        :return: Innermost open span of the current thread, or a NullSpan
+        """
+        stack = getattr(self.local, 'stack', None)
+
+        return stack[-1] if stack else self.NULL_SPAN
+
+    def count(self, key, value=1):
+        """ Adds to a counter of the innermost open span, such as the cache hits of a stage
+
+        :param key: Name of the counter
+        :param value: Amount to add
+        """
+        self.current_span().add(key, value)
+
+    def start_span(self, span):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = list()
+            self.local.finished = list()
+
+        span.parent = stack[-1] if stack else None
+        span.trace_id = span.parent.trace_id if span.parent is not None else os.urandom(16).hex()
+        stack.append(span)
+        span.start_time = time.time_ns()
+        span.start_counter = time.perf_counter_ns()
+
+    def end_span(self, span):
+        span.end_time = span.start_time + time.perf_counter_ns() - span.start_counter
+        self.local.stack.pop()
+        self.local.finished.append(span)
+
+        if span.parent is None:
+            trace = self.local.finished
+            self.local.finished = list()
+            session_key = getattr(self.local, 'session_key', None)
+            with self.lock:
+                self.traces.append(trace)
+                if session_key is not None:
+                    self.session_traces[session_key] = trace
+                    self.session_traces.move_to_end(session_key)
+                    while len(self.session_traces) > self.max_sessions:
+                        self.session_traces.popitem(last=False)
+            for exporter in self.exporters:
+                exporter.export(trace)
+
+    def get_last_trace(self, session_key=None):
+        """
+        :param session_key: Key of the session of the trace, None for the last trace of any thread
+        :return: Spans of the last finished trace, in the order they ended
+        """
+        with self.lock:
+            if session_key is not None:
+                return list(self.session_traces.get(session_key, list()))
+            return list(self.traces[-1]) if self.traces else list()
+
+    def get_breakdown(self, trace=None, session_key=None):
+        """
+        :param trace: Spans of a trace, by default the last finished one
+        :param session_key: Key of the session of the default trace, None for the last trace of any thread
+        :return: Dataframe with the duration and attributes of each span, in the order they started
+        """
+        trace = self.get_last_trace(session_key) if trace is None else trace
+        if not trace:
+            return pd.DataFrame(columns=['span', 'durationMs', 'share', 'attributes'])
+
+        trace = sorted(trace, key=lambda span: span.start_time)
+        root_duration = max(trace[0].end_time - trace[0].start_time, 1)
+        rows = list()
+        for span in trace:
+            depth = 0
+            parent = span.parent
+            while parent is not None:
+                depth, parent = depth + 1, parent.parent
+            rows.append({'span': '  ' * depth + span.name,
+                         'durationMs': (span.end_time - span.start_time) / 1e6,
+                         'share': (span.end_time - span.start_time) / root_duration,
+                         'attributes': ', '.join(key + '=' + str(value) for key, value in span.attributes.items())})
+
+        return pd.DataFrame(rows)
+
+
+# Tracer shared by the whole process
+process_tracer = None
+process_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """ Tracer of the process, enabled when the STADIOS_TRACING environment variable is set. The
+    STADIOS_TRACING_EXPORT variable adds an exporter: 'log' for structured logs, or a file for OTLP JSON.
+
+    :return: Tracer shared by the whole process
+    """
+    global process_tracer
+    with process_tracer_lock:
+        if process_tracer is None:
+            process_tracer = Tracer(os.environ.get('STADIOS_TRACING', '') not in ('', '0'))
+            export = os.environ.get('STADIOS_TRACING_EXPORT', '')
+            if export == 'log':
+                process_tracer.add_exporter(LogTraceExporter())
+            elif export:
+                process_tracer.add_exporter(OtlpFileExporter(export))
+
+    return process_tracer